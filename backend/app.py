@@ -17,6 +17,8 @@ from flask_cors import CORS
 from routes.analysis import analysis_bp
 from routes.history import history_bp
 from config import Config
+from services.case_index import get_shared_case_index
+from services.dataset_watcher import DatasetWatcher
 
 def create_app():
     app = Flask(__name__)
@@ -29,6 +31,17 @@ def create_app():
     app.register_blueprint(analysis_bp, url_prefix='/api')
     app.register_blueprint(history_bp, url_prefix='/api')
     
+    # 启动时预加载案例特征索引
+    try:
+        get_shared_case_index()
+    except Exception as e:
+        print(f"⚠️  案例索引预加载失败，将在首次检索时重试: {e}")
+    
+    # 可选：监控数据集目录，新增案例无需重启即可参与检索
+    if Config.DATASET_WATCH_ENABLED:
+        app.dataset_watcher = DatasetWatcher()
+        app.dataset_watcher.start()
+    
     # 添加根路径
     @app.route('/')
     def index():
@@ -38,7 +51,11 @@ def create_app():
             'version': '1.0.0',
             'endpoints': {
                 'analysis': '/api/analyze',
+                'batch_analysis': '/api/analyze/batch',
+                'jobs': '/api/jobs/<job_id>',
                 'history': '/api/history',
+                'history_export': '/api/history/export',
+                'db_stats': '/api/db/stats',
                 'health': '/api/health'
             }
         })
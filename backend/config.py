@@ -10,9 +10,30 @@ class Config:
     # MongoDB配置
     MONGODB_URI = os.environ.get('MONGODB_URI') or 'mongodb://localhost:27017/'
     DATABASE_NAME = 'hazard_detection'
+    # 共享 MongoClient 连接池配置
+    MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+    MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 60000))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))  # 等待空闲连接的最长时间
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 30000))
+    MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+    MONGO_WRITE_CONCERN = os.environ.get('MONGO_WRITE_CONCERN', '1')  # 数字或 'majority'
+    MONGO_APP_NAME = os.environ.get('MONGO_APP_NAME', 'hazard-detection-backend')
     
     # 模型配置
     CLIP_MODEL_NAME = 'ViT-B/32'  # 使用较小的模型进行测试
+    CLIP_BATCH_SIZE = int(os.environ.get('CLIP_BATCH_SIZE', 32))  # 批量编码时每批图片数
+    EMBEDDING_STORE_ENABLED = os.environ.get('EMBEDDING_STORE_ENABLED', 'true').lower() == 'true'  # 按内容哈希复用 CLIP 图片特征
+    EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', 2048))  # 进程内特征 LRU 条目数
+    FEW_SHOT_POOL_SIZE = int(os.environ.get('FEW_SHOT_POOL_SIZE', 20))  # 每个隐患类型缓存的候选示例数
+    FEW_SHOT_POOL_TTL = int(os.environ.get('FEW_SHOT_POOL_TTL', 600))  # 示例池刷新间隔（秒）
+    SIMILARITY_EMBEDDING_CACHE_SIZE = int(os.environ.get('SIMILARITY_EMBEDDING_CACHE_SIZE', 4096))  # BERT 描述向量 LRU 条目数
+    SIMILARITY_BATCH_SIZE = int(os.environ.get('SIMILARITY_BATCH_SIZE', 64))  # BERT 批量编码大小
+    SIMILARITY_RESCORE_BATCH_SIZE = int(os.environ.get('SIMILARITY_RESCORE_BATCH_SIZE', 1000))  # 重新计算相似度时每批条目数
+    # cases 集合中特征向量的存储精度: float32 / float16
+    FEATURE_STORAGE_DTYPE = os.environ.get('FEATURE_STORAGE_DTYPE', 'float32')
     
     # LLM配置（原有字段，暂未直接使用）
     LLM_API_KEY = os.environ.get('LLM_API_KEY') or 'YOUR_DEFAULT_LLM_KEY'
@@ -28,16 +49,124 @@ class Config:
     GPT4O_BASE_URL = os.environ.get('GPT4O_BASE_URL', 'https://xiaoai.plus/v1')
     GPT4O_API_KEY = os.environ.get('GPT4O_API_KEY', 'sk-***********************')  # 请替换为你自己的 key
     GPT4O_MODEL = os.environ.get('GPT4O_MODEL', 'gpt-4o')
+
+    # LLM 客户端连接池配置（每个 provider 一个长连接池）
+    LLM_POOL_MAX_CONNECTIONS = int(os.environ.get('LLM_POOL_MAX_CONNECTIONS', 20))
+    LLM_POOL_MAX_KEEPALIVE = int(os.environ.get('LLM_POOL_MAX_KEEPALIVE', 10))
+    LLM_POOL_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_POOL_KEEPALIVE_EXPIRY', 60))
+    LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', 10))
+    LLM_READ_TIMEOUT = float(os.environ.get('LLM_READ_TIMEOUT', 120))
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 2))
+    LLM_RETRY_BACKOFF = float(os.environ.get('LLM_RETRY_BACKOFF', 1.0))  # 首次重试等待（秒），之后指数增长
+    LLM_RETRY_MAX_BACKOFF = float(os.environ.get('LLM_RETRY_MAX_BACKOFF', 10.0))
+    # 每个 provider 的整体截止时间（秒，含重试）
+    LLM_DEADLINES = {
+        'gemini': float(os.environ.get('GEMINI_DEADLINE', 45)),
+        'gpt4o': float(os.environ.get('GPT4O_DEADLINE', 45)),
+    }
+    # 对冲请求：主 provider 超过 LLM_HEDGE_DELAY 秒未返回时同时请求备用 provider
+    LLM_HEDGE_ENABLED = os.environ.get('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+    LLM_HEDGE_DELAY = float(os.environ.get('LLM_HEDGE_DELAY', 8))
+    LLM_HEDGE_PROVIDERS = {'gemini': 'gpt4o', 'gpt4o': 'gemini'}
+    LLM_STREAMING = os.environ.get('LLM_STREAMING', 'false').lower() == 'true'  # 流式读取响应，JSON 完整后立即返回
+    
+    # 级联模式：CLIP 分类与相似案例足够一致时不调用 LLM（默认关闭，阈值需按数据校准）
+    CASCADE_ENABLED = os.environ.get('CASCADE_ENABLED', 'false').lower() == 'true'
+    CASCADE_MIN_CLIP_MARGIN = float(os.environ.get('CASCADE_MIN_CLIP_MARGIN', 0.5))  # 第一、二名类别概率差
+    CASCADE_MIN_VOTE_SHARE = float(os.environ.get('CASCADE_MIN_VOTE_SHARE', 0.8))  # 相似案例加权投票占比
+    CASCADE_MIN_TOP_SIMILARITY = float(os.environ.get('CASCADE_MIN_TOP_SIMILARITY', 0.9))
+    CASCADE_MIN_NEIGHBOURS = int(os.environ.get('CASCADE_MIN_NEIGHBOURS', 3))
+    
+    # 提示词文本部分的 token 预算（估算值，不含图片）
+    PROMPT_TOKEN_BUDGET = {
+        'gemini': int(os.environ.get('GEMINI_PROMPT_TOKEN_BUDGET', 1500)),
+        'gpt4o': int(os.environ.get('GPT4O_PROMPT_TOKEN_BUDGET', 1200)),
+        'default': 1500,
+    }
+    PROMPT_MAX_DESCRIPTION_CHARS = int(os.environ.get('PROMPT_MAX_DESCRIPTION_CHARS', 120))  # 单条描述/建议最大字符数
+    
+    # 发送给 LLM 的图片：最长边、JPEG 质量和字节上限（按 provider）
+    LLM_IMAGE_PROFILES = {
+        'gpt4o': {'max_side': 1536, 'quality': 80, 'max_bytes': 600 * 1024},
+        'gemini': {'max_side': 1024, 'quality': 80, 'max_bytes': 400 * 1024},
+        'default': {'max_side': 1024, 'quality': 85, 'max_bytes': 500 * 1024},
+    }
+    LLM_PAYLOAD_CACHE_SIZE = int(os.environ.get('LLM_PAYLOAD_CACHE_SIZE', 64))
+    LLM_PAYLOAD_CACHE_TTL = int(os.environ.get('LLM_PAYLOAD_CACHE_TTL', 600))
     
     # 文件上传配置
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     
+    # 分析结果进程内缓存（位于 MongoDB analysis_cache 之前）
+    RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 1024))
+    RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 600))  # 秒
+    RESULT_CACHE_NEGATIVE_TTL = 5  # 未命中记录的缓存时间（秒）
+    # 近似重复缓存：按感知哈希（64 位 dHash）的汉明距离匹配
+    # 近似命中会返回另一张图片的分析结果，默认关闭
+    NEAR_DUP_ENABLED = os.environ.get('NEAR_DUP_ENABLED', 'false').lower() == 'true'
+    NEAR_DUP_MAX_DISTANCE = int(os.environ.get('NEAR_DUP_MAX_DISTANCE', 6))
+    NEAR_DUP_REFRESH_INTERVAL = 60  # 增量加载其他进程新写入哈希的间隔（秒）
+    
+    # 异步分析任务配置
+    JOB_STORE = os.environ.get('JOB_STORE', 'mongo')  # mongo / memory
+    JOB_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', 2))
+    JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 100))
+    JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 120))  # running 任务心跳超过该时间视为中断
+    JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 15))  # 心跳与排队任务检查间隔（秒）
+    JOB_MAX_WAIT = 30  # 长轮询最长等待（秒）
+    JOB_POLL_INTERVAL = 0.5
+    JOB_RESULT_TTL = 7 * 24 * 3600  # 已完成任务保留时间（秒）
+    
+    # 批量分析配置
+    BATCH_PREPROCESS_WORKERS = int(os.environ.get('BATCH_PREPROCESS_WORKERS', 4))
+    LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 4))
+    BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES', 200))
+    
     # RAG配置
     SIMILAR_CASES_COUNT = 5
     FEW_SHOT_EXAMPLES_COUNT = 3
+    # 案例索引检查 cases 集合变化的间隔（秒）
+    CASE_INDEX_REFRESH_INTERVAL = float(os.environ.get('CASE_INDEX_REFRESH_INTERVAL', 30))
+    # 增量变化（失效行 + 追加行）超过上次全量构建行数的该比例时压缩并重建检索索引
+    CASE_INDEX_REBUILD_RATIO = float(os.environ.get('CASE_INDEX_REBUILD_RATIO', 0.2))
+    # 检索后端: bruteforce / faiss_flat / faiss_ivf / faiss_hnsw
+    RETRIEVAL_BACKEND = os.environ.get('RETRIEVAL_BACKEND', 'bruteforce')
+    RETRIEVAL_BACKEND_PARAMS = {
+        'faiss_ivf': {
+            'nlist': int(os.environ.get('FAISS_IVF_NLIST', 100)),
+            'nprobe': int(os.environ.get('FAISS_IVF_NPROBE', 10)),
+        },
+        'faiss_hnsw': {
+            'm': int(os.environ.get('FAISS_HNSW_M', 32)),
+            'ef_construction': int(os.environ.get('FAISS_HNSW_EF_CONSTRUCTION', 200)),
+            'ef_search': int(os.environ.get('FAISS_HNSW_EF_SEARCH', 64)),
+        },
+    }
+    # 检索索引文件目录（由 utils/database_init.py 构建）
+    RETRIEVAL_INDEX_DIR = os.environ.get('RETRIEVAL_INDEX_DIR', 'indexes')
     
     # 数据集路径
     DATASET_PATH = 'datasets/隐患数据集/隐患数据集/隐患图片'
     DESCRIPTION_FILE = 'datasets/隐患数据集/隐患数据集/隐患描述文档.txt'
-    CATEGORY_FILE = 'datasets/隐患数据集/隐患数据集/隐患类别描述文档.txt'
\ No newline at end of file
+    CATEGORY_FILE = 'datasets/隐患数据集/隐患数据集/隐患类别描述文档.txt'
+    
+    # 数据集导入配置
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 4))
+    INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 64))
+    INGEST_MANIFEST_PATH = os.environ.get('INGEST_MANIFEST_PATH', 'indexes/ingest_manifest.json')
+    # 服务运行时监控数据集目录并增量同步（默认关闭）
+    DATASET_WATCH_ENABLED = os.environ.get('DATASET_WATCH_ENABLED', 'false').lower() == 'true'
+    DATASET_WATCH_INTERVAL = float(os.environ.get('DATASET_WATCH_INTERVAL', 60))
+    # 多个服务进程间的同步租约时长（秒），超时后其他进程可接管
+    DATASET_SYNC_LEASE_TTL = float(os.environ.get('DATASET_SYNC_LEASE_TTL', 1800))
+    
+    # 历史案例列表
+    HISTORY_MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', 100))
+    HISTORY_PAGE_CACHE_SIZE = int(os.environ.get('HISTORY_PAGE_CACHE_SIZE', 256))
+    HISTORY_PAGE_CACHE_TTL = int(os.environ.get('HISTORY_PAGE_CACHE_TTL', 30))  # 分页结果缓存（秒）
+    HISTORY_COUNT_CACHE_TTL = int(os.environ.get('HISTORY_COUNT_CACHE_TTL', 60))  # 带筛选条件的总数缓存（秒）
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))  # 导出时每批读取的案例数
+    
+    # 批量分析接口允许读取的服务器端目录
+    BATCH_PATH_ROOTS = [DATASET_PATH, UPLOAD_FOLDER]
\ No newline at end of file
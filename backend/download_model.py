@@ -156,6 +156,7 @@
 """
 from pymongo import MongoClient
 from config import Config
+from services.similarity_stats import SimilarityStats
 import sys
 from datetime import datetime
 
@@ -176,6 +177,7 @@ def clear_cache_interactive():
         client = MongoClient(Config.MONGODB_URI)
         db = client[Config.DATABASE_NAME]
         cache_collection = db.analysis_cache
+        similarity_stats = SimilarityStats(db)
         
         # 测试连接
         client.admin.command('ping')
@@ -246,6 +248,8 @@ def clear_cache_interactive():
                     # 删除记录
                     delete_result = cache_collection.delete_one({"_id": record_id})
                     if delete_result.deleted_count > 0:
+                        # 从增量统计中扣除这条结果
+                        similarity_stats.record(model, None, result)
                         print(f"✅ 已删除记录 {i}")
                         deleted_count += 1
                     else:
@@ -1,12 +1,115 @@
-from flask import Blueprint, request, jsonify
-from services.hazard_analyzer import HazardAnalyzer
-from services.llm_service import LLMService
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from services.cache_service import CacheService
-from services.bert_similarity_service import BertSimilarityService
+from services.similarity_stats import STATS_MODELS
+from services.cascade_policy import CASCADE_MODEL, cache_model_key
+from services.model_registry import get_model_registry
+from services.job_queue import JobQueue, serialize_job
+from services.llm_client_pool import get_llm_client_pool
+from services.database import pool_stats
+from utils.upload_handler import read_upload, persist_upload
+from utils.content_hash import compute_content_hash
+from utils.perceptual_hash import image_dhash
+from config import Config
+import json
 import os
+import uuid
 analysis_bp = Blueprint('analysis', __name__)
 cache_service = CacheService()
-bert_similarity = BertSimilarityService()
+model_registry = get_model_registry()
+bert_similarity = model_registry.get_bert_similarity()
+
+def _model_similarity(cached):
+    """从缓存记录中提取 BERT / TF-IDF 相似度"""
+    return {
+        'bert': cached['result'].get('bert_similarity', 0.0) if cached else 0.0,
+        'tfidf': cached['result'].get('tfidf_similarity', 0.0) if cached else 0.0,
+    }
+
+
+def run_analysis(image_source, provider, image_hash=None):
+    """执行带缓存的完整分析流程，供同步接口和异步任务共用
+
+    image_source 可以是图片路径或内存中的图片字节；已知内容哈希时直接传入 image_hash。
+    """
+    # 计算图片哈希值
+    if image_hash is None:
+        image_hash = compute_content_hash(image_source)
+    
+    # 一次查询获取两个模型及当前模型的缓存（启用级联时同时查询级联结果）
+    models = {'gemini', 'gpt4o', provider}
+    if Config.CASCADE_ENABLED:
+        models.add(CASCADE_MODEL)
+    cached_results = cache_service.get_cached_results(image_hash, models)
+    
+    # 如果当前请求的模型有缓存，直接返回；级联结果与模型无关，也可直接使用
+    cached_result = cached_results.get(provider) or (
+        cached_results.get(CASCADE_MODEL) if Config.CASCADE_ENABLED else None
+    )
+    if cached_result:
+        print(f"✅ 使用缓存结果，跳过 LLM 调用")
+        # 返回结果，包含两个模型的信息
+        result_data = cached_result['result']
+        result_data['cache_match'] = 'exact'
+        result_data['gemini_similarity'] = _model_similarity(cached_results.get('gemini'))
+        result_data['gpt4o_similarity'] = _model_similarity(cached_results.get('gpt4o'))
+        return result_data
+
+    # 精确缓存未命中时，按感知哈希查找近似重复图片（如经聊天软件转发、重新压缩的照片）
+    phash = None
+    if Config.NEAR_DUP_ENABLED:
+        try:
+            phash = image_dhash(image_source)
+            near = cache_service.find_near_duplicate(phash, provider)
+        except Exception as e:
+            print(f"⚠️  计算感知哈希失败: {e}")
+            near = None
+        if near:
+            matched_results = cache_service.get_cached_results(near['image_hash'], {'gemini', 'gpt4o'})
+            result_data = near['result']
+            result_data['cache_match'] = 'approximate'
+            result_data['cache_distance'] = near['distance']
+            result_data['matched_image_hash'] = near['image_hash']
+            result_data['gemini_similarity'] = _model_similarity(matched_results.get('gemini'))
+            result_data['gpt4o_similarity'] = _model_similarity(matched_results.get('gpt4o'))
+            return result_data
+
+    # 缓存未命中，进行实际分析
+    print(f"🔄 缓存未命中，开始分析 (hash: {image_hash[:8]}..., model: {provider})")
+    analyzer = model_registry.get_hazard_analyzer()
+    result = analyzer.analyze_hazard(image_source, provider=provider, image_hash=image_hash)
+
+    # 保存到缓存（检查返回值）；级联结果单独保存，不冒充 LLM 结果
+    print(f"💾 准备保存分析结果到缓存...")
+    cache_model = cache_model_key(result, provider)
+    cache_saved = cache_service.save_result(image_hash, result, cache_model, phash=phash)
+    
+    if cache_saved:
+        print(f"✅ 分析结果已成功保存到 MongoDB")
+        cached_results[cache_model] = {'result': result}
+    else:
+        print(f"❌ 警告：分析结果保存失败！但继续返回结果")
+
+    # 添加两个模型的相似度信息（当前模型使用刚保存的结果，无需重新查询）
+    result['gemini_similarity'] = _model_similarity(cached_results.get('gemini'))
+    result['gpt4o_similarity'] = _model_similarity(cached_results.get('gpt4o'))
+    return result
+
+
+def _run_job(job):
+    """异步任务执行函数：分析任务保存的图片，结束后删除图片"""
+    payload = job['payload']
+    image_path = payload['image_path']
+    try:
+        return run_analysis(image_path, payload.get('provider', 'gemini'), image_hash=payload.get('image_hash'))
+    finally:
+        # 每个任务的图片单独命名，不会与其他任务共用
+        if os.path.exists(image_path):
+            os.remove(image_path)
+
+
+job_queue = JobQueue(runner=_run_job)
+job_queue.start()
+
 
 @analysis_bp.route('/analyze', methods=['POST'])
 def analyze_hazard():
@@ -18,79 +121,41 @@ def analyze_hazard():
         if image_file.filename == '':
             return jsonify({'error': '没有选择文件'}), 400
 
+        # 读入内存并在读取过程中计算哈希，不落盘
+        try:
+            upload = read_upload(image_file)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 413
+
         # 从表单中读取模型选择
         provider = request.form.get('model', 'gemini')
-        print(f"📤 收到分析请求: 文件={image_file.filename}, 模型={provider}")
-
-        # 确保上传目录存在
-        os.makedirs('uploads', exist_ok=True)
-        
-        # 保存上传的图片
-        image_path = os.path.join('uploads', image_file.filename)
-        image_file.save(image_path)
-        print(f"💾 图片已保存到: {image_path}")
-
-        # 计算图片哈希值
-        image_hash = cache_service.calculate_image_hash(image_path)
-        
-        # 检查两个模型的缓存
-        gemini_result = cache_service.get_cached_result(image_hash, 'gemini')
-        gpt4o_result = cache_service.get_cached_result(image_hash, 'gpt4o')
-        
-        # 如果当前请求的模型有缓存，直接返回
-        cached_result = cache_service.get_cached_result(image_hash, provider)
-        if cached_result:
-            print(f"✅ 使用缓存结果，跳过 LLM 调用")
-            # 清理临时文件
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            
-            # 返回结果，包含两个模型的信息
-            result_data = cached_result['result']
-            result_data['gemini_similarity'] = {
-                'bert': gemini_result['result'].get('bert_similarity', 0.0) if gemini_result else 0.0,
-                'tfidf': gemini_result['result'].get('tfidf_similarity', 0.0) if gemini_result else 0.0,
-            }
-            result_data['gpt4o_similarity'] = {
-                'bert': gpt4o_result['result'].get('bert_similarity', 0.0) if gpt4o_result else 0.0,
-                'tfidf': gpt4o_result['result'].get('tfidf_similarity', 0.0) if gpt4o_result else 0.0,
-            }
-            
-            return jsonify(result_data)
-
-        # 缓存未命中，进行实际分析
-        print(f"🔄 缓存未命中，开始分析 (hash: {image_hash[:8]}..., model: {provider})")
-        llm_service = LLMService()
-        analyzer = HazardAnalyzer(llm_service)
-        result = analyzer.analyze_hazard(image_path, provider=provider)
-
-        # 保存到缓存（检查返回值）
-        print(f"💾 准备保存分析结果到缓存...")
-        cache_saved = cache_service.save_result(image_hash, result, provider)
-        
-        if cache_saved:
-            print(f"✅ 分析结果已成功保存到 MongoDB")
-        else:
-            print(f"❌ 警告：分析结果保存失败！但继续返回结果")
+        # async=1 时只创建任务并立即返回任务 id
+        async_mode = (request.form.get('async') or request.args.get('async', '')).lower() in ('1', 'true', 'yes')
+        print(f"📤 收到分析请求: 文件={image_file.filename}, 模型={provider}, 异步={async_mode}")
 
-        # 保存后再获取两个模型的缓存结果
-        gemini_result = cache_service.get_cached_result(image_hash, 'gemini')
-        gpt4o_result = cache_service.get_cached_result(image_hash, 'gpt4o')
-        
-        # 添加两个模型的相似度信息
-        result['gemini_similarity'] = {
-            'bert': gemini_result['result'].get('bert_similarity', 0.0) if gemini_result else 0.0,
-            'tfidf': gemini_result['result'].get('tfidf_similarity', 0.0) if gemini_result else 0.0,
-        }
-        result['gpt4o_similarity'] = {
-            'bert': gpt4o_result['result'].get('bert_similarity', 0.0) if gpt4o_result else 0.0,
-            'tfidf': gpt4o_result['result'].get('tfidf_similarity', 0.0) if gpt4o_result else 0.0,
-        }
-        
-        # 清理临时文件
-        if os.path.exists(image_path):
-            os.remove(image_path)
+        if async_mode:
+            # 异步任务需要在重启后恢复，写入磁盘；文件名带随机后缀，
+            # 相同内容的并发任务各用一份，删除时不会互相影响
+            image_path = persist_upload(
+                upload, os.path.join(Config.UPLOAD_FOLDER, 'jobs'),
+                name=f"{upload.content_hash}_{uuid.uuid4().hex}",
+            )
+            try:
+                job_id = job_queue.submit({
+                    'image_path': image_path,
+                    'image_hash': upload.content_hash,
+                    'provider': provider,
+                    'filename': image_file.filename,
+                })
+            except RuntimeError as e:
+                return jsonify({'error': str(e)}), 503
+            return jsonify({
+                'job_id': job_id,
+                'status': 'queued',
+                'status_url': f'/api/jobs/{job_id}',
+            }), 202
 
+        result = run_analysis(upload.data, provider, image_hash=upload.content_hash)
         return jsonify(result)
 
     except Exception as e:
@@ -100,15 +165,153 @@ def analyze_hazard():
         return jsonify({'error': f'分析失败: {str(e)}'}), 500
 
 
+def _resolve_batch_path(path):
+    """校验服务器端图片路径，只允许位于配置的目录内"""
+    real_path = os.path.realpath(path)
+    for root in Config.BATCH_PATH_ROOTS:
+        real_root = os.path.realpath(root)
+        if os.path.commonpath([real_path, real_root]) == real_root and os.path.isfile(real_path):
+            return real_path
+    return None
+
+
+@analysis_bp.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """批量分析：接收多张上传图片或服务器端路径，以 NDJSON 逐行流式返回结果"""
+    payload = request.get_json(silent=True) or {}
+    provider = payload.get('model') or request.form.get('model', 'gemini')
+    upload_files = [f for f in request.files.getlist('images') if f.filename]
+    server_paths = payload.get('paths') or request.form.getlist('paths')
+    if not isinstance(server_paths, list) or not all(isinstance(path, str) for path in server_paths):
+        return jsonify({'error': 'paths 必须是字符串列表'}), 400
+
+    if not upload_files and not server_paths:
+        return jsonify({'error': '没有上传图片或提供图片路径'}), 400
+    if len(upload_files) + len(server_paths) > Config.BATCH_MAX_IMAGES:
+        return jsonify({'error': f'单次最多分析 {Config.BATCH_MAX_IMAGES} 张图片'}), 400
+
+    # items: (显示名称, 图片路径或上传文件)；上传图片在流式处理时按窗口读入内存
+    items = []
+    for path in server_paths:
+        resolved = _resolve_batch_path(path)
+        if resolved is None:
+            return jsonify({'error': f'图片路径无效或不允许访问: {path}'}), 400
+        items.append((path, resolved))
+    items.extend((upload_file.filename, upload_file) for upload_file in upload_files)
+
+    print(f"📤 收到批量分析请求: {len(items)} 张图片, 模型={provider}")
+
+    def line(data):
+        return json.dumps(data, ensure_ascii=False, default=str) + '\n'
+
+    def generate():
+        succeeded = failed = 0
+        window_size = max(1, Config.CLIP_BATCH_SIZE)
+        for start in range(0, len(items), window_size):
+            # 每个窗口读入、分析并输出后即释放图片字节，内存不随批量大小增长
+            sources, hashes = {}, {}
+            for index in range(start, min(start + window_size, len(items))):
+                name, source = items[index]
+                try:
+                    if isinstance(source, str):
+                        hashes[index] = compute_content_hash(source)
+                    else:
+                        upload = read_upload(source)
+                        source, hashes[index] = upload.data, upload.content_hash
+                    sources[index] = source
+                except Exception as e:
+                    failed += 1
+                    yield line({'index': index, 'filename': name, 'error': str(e)})
+
+            # 一次查询整个窗口的缓存，命中的直接返回，其余交给批量分析
+            cached_results = cache_service.get_cached_results_for_hashes(list(hashes.values()), provider)
+            if Config.CASCADE_ENABLED:
+                cascade_results = cache_service.get_cached_results_for_hashes(
+                    [h for h in hashes.values() if h not in cached_results], CASCADE_MODEL
+                )
+                cached_results.update(cascade_results)
+            pending, phashes = [], {}
+            for index, image_hash in hashes.items():
+                cached = cached_results.get(image_hash)
+                if cached:
+                    succeeded += 1
+                    yield line({'index': index, 'filename': items[index][0], 'cached': True, 'result': cached['result']})
+                    continue
+                pending.append(index)
+                if Config.NEAR_DUP_ENABLED:
+                    # 与单张分析一致，保存时写入感知哈希供近似查找使用
+                    try:
+                        phashes[index] = image_dhash(sources[index])
+                    except Exception as e:
+                        print(f"⚠️  计算感知哈希失败: {e}")
+
+            if pending:
+                analyzer = model_registry.get_hazard_analyzer()
+                for position, result in analyzer.iter_batch_analyze(
+                    [sources[i] for i in pending], provider=provider,
+                    image_hashes=[hashes[i] for i in pending],
+                ):
+                    index = pending[position]
+                    result.pop('image_path', None)
+                    if result.get('error'):
+                        failed += 1
+                    else:
+                        succeeded += 1
+                        cache_service.save_result(
+                            hashes[index], result, cache_model_key(result, provider), phash=phashes.get(index)
+                        )
+                    yield line({'index': index, 'filename': items[index][0], 'cached': False, 'result': result})
+
+        yield line({'done': True, 'total': len(items), 'succeeded': succeeded, 'failed': failed})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@analysis_bp.route('/jobs/<string:job_id>', methods=['GET'])
+def get_analysis_job(job_id):
+    """查询异步分析任务，wait=秒数 时长轮询直到任务结束或超时"""
+    try:
+        wait = min(float(request.args.get('wait', 0)), Config.JOB_MAX_WAIT)
+        if wait > 0:
+            job = job_queue.wait(job_id, wait)
+        else:
+            job = job_queue.get(job_id)
+        if not job:
+            return jsonify({'error': '任务不存在'}), 404
+        return jsonify(serialize_job(job))
+    except ValueError:
+        return jsonify({'error': 'wait 参数无效'}), 400
+    except Exception as e:
+        return jsonify({'error': f'查询任务失败: {str(e)}'}), 500
+
+
 @analysis_bp.route('/similarity/stats', methods=['GET'])
 def get_similarity_stats():
     """获取相似度统计信息"""
     try:
-        stats = bert_similarity.get_average_similarity()
+        stats = bert_similarity.get_average_similarity(cache_service.similarity_stats)
         return jsonify(stats)
     except Exception as e:
         return jsonify({'error': f'获取相似度统计失败: {str(e)}'}), 500
 
+@analysis_bp.route('/llm/stats', methods=['GET'])
+def get_llm_stats():
+    """获取 LLM 客户端连接池和提示词 token 统计信息"""
+    try:
+        stats = get_llm_client_pool().stats()
+        stats['prompt'] = model_registry.get_llm_service().prompt_builder.stats()
+        return jsonify(stats)
+    except Exception as e:
+        return jsonify({'error': f'获取统计失败: {str(e)}'}), 500
+
+@analysis_bp.route('/db/stats', methods=['GET'])
+def get_db_stats():
+    """获取 MongoDB 连接池统计信息"""
+    try:
+        return jsonify(pool_stats())
+    except Exception as e:
+        return jsonify({'error': f'获取统计失败: {str(e)}'}), 500
+
 @analysis_bp.route('/cache/stats', methods=['GET'])
 def get_cache_stats():
     """获取缓存统计信息"""
@@ -123,48 +326,18 @@ def get_cache_stats():
 def get_average_similarities():
     """获取所有模型的平均相似度统计（BERT 和 TF-IDF）"""
     try:
-        from pymongo import MongoClient
-        from config import Config
-        
-        client = MongoClient(Config.MONGODB_URI)
-        db = client[Config.DATABASE_NAME]
-        cache_collection = db.analysis_cache
-        
+        # 读取增量维护的统计，不再扫描 analysis_cache
+        by_model = cache_service.similarity_stats.get_stats()['by_model']
         stats = {
-            'gemini': {
-                'bert_avg': 0.0,
-                'tfidf_avg': 0.0,
-                'count': 0
-            },
-            'gpt4o': {
-                'bert_avg': 0.0,
-                'tfidf_avg': 0.0,
-                'count': 0
+            model: {
+                'bert_avg': data.get('bert_avg', 0.0),
+                'tfidf_avg': data.get('tfidf_avg', 0.0),
+                'count': data.get('count', 0),
+                'by_type': data.get('by_type', {}),
             }
+            for model, data in ((model, by_model.get(model, {})) for model in STATS_MODELS)
         }
         
-        # 获取所有缓存记录
-        all_caches = list(cache_collection.find({}))
-        
-        for cache in all_caches:
-            model = cache.get('model', '')
-            result = cache.get('result', {})
-            
-            if model in ['gemini', 'gpt4o']:
-                bert_sim = result.get('bert_similarity', 0.0)
-                tfidf_sim = result.get('tfidf_similarity', 0.0)
-                
-                if bert_sim > 0 or tfidf_sim > 0:
-                    stats[model]['count'] += 1
-                    stats[model]['bert_avg'] += bert_sim
-                    stats[model]['tfidf_avg'] += tfidf_sim
-        
-        # 计算平均值
-        for model in ['gemini', 'gpt4o']:
-            if stats[model]['count'] > 0:
-                stats[model]['bert_avg'] /= stats[model]['count']
-                stats[model]['tfidf_avg'] /= stats[model]['count']
-        
         return jsonify(stats)
     except Exception as e:
         return jsonify({'error': f'获取平均相似度失败: {str(e)}'}), 500
\ No newline at end of file
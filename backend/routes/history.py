@@ -1,32 +1,181 @@
-from flask import Blueprint, jsonify, request
-from pymongo import MongoClient
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from bson import ObjectId
 from config import Config
+from services.database import get_db
+from utils.lru_cache import TTLCache
+import base64
+import csv
+import io
+import json
 import os
+import tempfile
+import zlib
 from datetime import datetime
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow 为可选依赖，未安装时不支持 Parquet 导出
+    pa = pq = None
+
 history_bp = Blueprint('history', __name__)
 
+# 列表只返回这些字段（不含特征向量）
+HISTORY_PROJECTION = {
+    '_id': 1,
+    'filename': 1,
+    'type': 1,
+    'image_id': 1,
+    'description': 1,
+    'category_description': 1,
+    'suggestion': 1,
+    'created_at': 1,
+    'file_size': 1,
+    'file_type': 1
+}
+HISTORY_SORT = [('created_at', -1), ('_id', -1)]
+
+# 短时间内重复请求同一页时直接返回缓存
+page_cache = TTLCache(Config.HISTORY_PAGE_CACHE_SIZE, Config.HISTORY_PAGE_CACHE_TTL)
+count_cache = TTLCache(256, Config.HISTORY_COUNT_CACHE_TTL)
+_indexes_ready = False
+EXPORT_CHUNK_SIZE = 1024 * 1024
+
 def get_db_connection():
-    """获取数据库连接"""
+    """获取数据库连接（共享连接池，不再每个请求创建客户端）"""
+    global _indexes_ready
     try:
-        client = MongoClient(Config.MONGODB_URI)
-        db = client[Config.DATABASE_NAME]
+        db = get_db()
+        if not _indexes_ready:
+            try:
+                ensure_history_indexes(db)
+            except Exception as e:
+                print(f"⚠️  创建历史列表索引失败: {e}")
+            _indexes_ready = True
         return db
     except Exception as e:
         print(f"数据库连接失败: {e}")
         return None
 
+def ensure_history_indexes(db):
+    """游标分页使用的 (created_at, _id) 复合索引"""
+    db.cases.create_index([('created_at', -1), ('_id', -1)])
+    db.cases.create_index([('type', 1), ('created_at', -1), ('_id', -1)])
+
+def _parse_limit():
+    limit = int(request.args.get('limit', 20))
+    return max(1, min(limit, Config.HISTORY_MAX_PAGE_SIZE))
+
+def _serialize_case(case):
+    """转换ObjectId和日期为字符串"""
+    case['_id'] = str(case['_id'])
+    for key in ('created_at', 'updated_at'):
+        if isinstance(case.get(key), datetime):
+            case[key] = case[key].isoformat()
+    return case
+
+def _encode_cursor(case):
+    """游标记录最后一条的 (created_at, _id)，_id 的类型一并保存"""
+    case_id = case['_id']
+    payload = {
+        'c': case['created_at'].isoformat() if isinstance(case.get('created_at'), datetime) else None,
+        'i': str(case_id),
+        'o': isinstance(case_id, ObjectId),
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def _decode_cursor(token):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        created_at = datetime.fromisoformat(payload['c']) if payload['c'] else None
+        case_id = ObjectId(payload['i']) if payload['o'] else payload['i']
+        return created_at, case_id
+    except Exception:
+        raise ValueError('cursor 无效')
+
+def _after_cursor(created_at, case_id):
+    """排在游标之后的文档
+
+    倒序排序中没有 created_at（null 或缺失）的旧数据排在所有带日期的文档之后，
+    游标仍是日期时要把它们一并包含；游标已进入这部分数据后只按 _id 继续。
+    """
+    if created_at is None:
+        return {'created_at': None, '_id': {'$lt': case_id}}
+    return {'$or': [
+        {'created_at': {'$lt': created_at}},
+        {'created_at': created_at, '_id': {'$lt': case_id}},
+        {'created_at': None},
+    ]}
+
+def _count(db, query):
+    """按 total 参数返回总数：estimate 使用估算或缓存的计数，exact 精确计数，none 不计数"""
+    mode = request.args.get('total', 'estimate')
+    if mode == 'none':
+        return None
+    if mode == 'exact':
+        return db.cases.count_documents(query)
+    if not query:
+        return db.cases.estimated_document_count()
+    key = json.dumps(query, sort_keys=True, default=str)
+    total = count_cache.get(key, None)
+    if total is None:
+        total = db.cases.count_documents(query)
+        count_cache.set(key, total)
+    return total
+
+def _paginate(db, query, limit):
+    """游标分页查询；未传 cursor 但传了 page 时退化为按页码跳过"""
+    cursor_token = request.args.get('cursor')
+    page = request.args.get('page')
+    find_query = query
+    skip = 0
+    if cursor_token:
+        created_at, case_id = _decode_cursor(cursor_token)
+        find_query = {'$and': [query, _after_cursor(created_at, case_id)]}
+    elif page:
+        skip = (max(1, int(page)) - 1) * limit
+    
+    # 多取一条判断是否还有下一页
+    cases = list(db.cases.find(find_query, HISTORY_PROJECTION)
+                 .sort(HISTORY_SORT).skip(skip).limit(limit + 1))
+    has_more = len(cases) > limit
+    cases = cases[:limit]
+    next_cursor = _encode_cursor(cases[-1]) if has_more and cases else None
+    
+    response = {
+        'cases': [_serialize_case(case) for case in cases],
+        'limit': limit,
+        'has_more': has_more,
+        'next_cursor': next_cursor,
+    }
+    if not cursor_token:
+        response['page'] = max(1, int(page or 1))
+    total = _count(db, query)
+    if total is not None:
+        response['total'] = total
+        response['total_pages'] = (total + limit - 1) // limit
+    return response
+
 @history_bp.route('/history', methods=['GET'])
 def get_history_cases():
-    """获取历史案例列表"""
+    """获取历史案例列表
+
+    默认按 (created_at, _id) 倒序做游标分页：返回的 next_cursor 作为下一页的 cursor 参数；
+    仍兼容 page 参数（跳过前面的文档，深分页较慢）。
+    total 参数: estimate（默认，估算/缓存的总数）、exact（精确计数）、none（不返回总数）。
+    """
     try:
         db = get_db_connection()
-        if not db:
+        if db is None:
             return jsonify({'error': '数据库连接失败'}), 500
         
+        cache_key = ('list', tuple(sorted(request.args.items())))
+        cached = page_cache.get(cache_key, None)
+        if cached is not None:
+            return jsonify(cached)
+        
         # 获取查询参数
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
+        limit = _parse_limit()
         hazard_type = request.args.get('type', None)
         
         # 构建查询条件
@@ -34,43 +183,12 @@ def get_history_cases():
         if hazard_type:
             query['type'] = hazard_type
         
-        # 计算跳过的文档数量
-        skip = (page - 1) * limit
-        
-        # 查询历史案例
-        cases = list(db.cases.find(
-            query,
-            {
-                '_id': 1,
-                'filename': 1,
-                'type': 1,
-                'image_id': 1,
-                'description': 1,
-                'category_description': 1,
-                'suggestion': 1,
-                'created_at': 1,
-                'file_size': 1,
-                'file_type': 1
-            }
-        ).skip(skip).limit(limit).sort('created_at', -1))
-        
-        # 获取总数
-        total = db.cases.count_documents(query)
-        
-        # 转换ObjectId为字符串
-        for case in cases:
-            case['_id'] = str(case['_id'])
-            if 'created_at' in case:
-                case['created_at'] = case['created_at'].isoformat()
-        
-        return jsonify({
-            'cases': cases,
-            'total': total,
-            'page': page,
-            'limit': limit,
-            'total_pages': (total + limit - 1) // limit
-        })
+        response = _paginate(db, query, limit)
+        page_cache.set(cache_key, response)
+        return jsonify(response)
         
+    except ValueError as e:
+        return jsonify({'error': f'参数无效: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': f'获取历史案例失败: {str(e)}'}), 500
 
@@ -79,7 +197,7 @@ def get_history_case_detail(case_id):
     """获取特定历史案例详情"""
     try:
         db = get_db_connection()
-        if not db:
+        if db is None:
             return jsonify({'error': '数据库连接失败'}), 500
         
         # 查询特定案例
@@ -107,7 +225,7 @@ def get_statistics():
     """获取历史案例统计信息"""
     try:
         db = get_db_connection()
-        if not db:
+        if db is None:
             return jsonify({'error': '数据库连接失败'}), 500
         
         # 总案例数
@@ -159,14 +277,19 @@ def search_history_cases():
     """搜索历史案例"""
     try:
         db = get_db_connection()
-        if not db:
+        if db is None:
             return jsonify({'error': '数据库连接失败'}), 500
         
         # 获取搜索参数
         query_text = request.args.get('q', '')
         hazard_type = request.args.get('type', None)
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
+        page = max(1, int(request.args.get('page', 1)))
+        limit = _parse_limit()
+        
+        cache_key = ('search', tuple(sorted(request.args.items())))
+        cached = page_cache.get(cache_key, None)
+        if cached is not None:
+            return jsonify(cached)
         
         # 构建查询条件
         query = {}
@@ -177,61 +300,31 @@ def search_history_cases():
         if query_text:
             # 文本搜索
             query['$text'] = {'$search': query_text}
-        
-        # 计算跳过的文档数量
-        skip = (page - 1) * limit
-        
-        # 执行搜索
-        if query_text:
-            # 文本搜索，按相关性排序
+            # 按相关性排序，无法使用游标分页，仍按页码跳过
+            skip = (page - 1) * limit
             cases = list(db.cases.find(
                 query,
-                {
-                    '_id': 1,
-                    'filename': 1,
-                    'type': 1,
-                    'image_id': 1,
-                    'description': 1,
-                    'category_description': 1,
-                    'suggestion': 1,
-                    'created_at': 1,
-                    'score': {'$meta': 'textScore'}
-                }
+                dict(HISTORY_PROJECTION, score={'$meta': 'textScore'})
             ).sort([('score', {'$meta': 'textScore'})]).skip(skip).limit(limit))
+            response = {
+                'cases': [_serialize_case(case) for case in cases],
+                'page': page,
+                'limit': limit,
+            }
+            total = _count(db, query)
+            if total is not None:
+                response['total'] = total
+                response['total_pages'] = (total + limit - 1) // limit
         else:
-            # 普通查询
-            cases = list(db.cases.find(
-                query,
-                {
-                    '_id': 1,
-                    'filename': 1,
-                    'type': 1,
-                    'image_id': 1,
-                    'description': 1,
-                    'category_description': 1,
-                    'suggestion': 1,
-                    'created_at': 1
-                }
-            ).skip(skip).limit(limit).sort('created_at', -1))
-        
-        # 获取总数
-        total = db.cases.count_documents(query)
+            # 普通查询，游标分页
+            response = _paginate(db, query, limit)
         
-        # 转换ObjectId为字符串
-        for case in cases:
-            case['_id'] = str(case['_id'])
-            if 'created_at' in case:
-                case['created_at'] = case['created_at'].isoformat()
-        
-        return jsonify({
-            'cases': cases,
-            'total': total,
-            'page': page,
-            'limit': limit,
-            'total_pages': (total + limit - 1) // limit,
-            'query': query_text
-        })
+        response['query'] = query_text
+        page_cache.set(cache_key, response)
+        return jsonify(response)
         
+    except ValueError as e:
+        return jsonify({'error': f'参数无效: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': f'搜索失败: {str(e)}'}), 500
 
@@ -240,7 +333,7 @@ def delete_history_case(case_id):
     """删除历史案例"""
     try:
         db = get_db_connection()
-        if not db:
+        if db is None:
             return jsonify({'error': '数据库连接失败'}), 500
         
         # 删除案例
@@ -249,50 +342,159 @@ def delete_history_case(case_id):
         if result.deleted_count == 0:
             return jsonify({'error': '案例不存在'}), 404
         
+        # 列表和计数缓存失效
+        page_cache.clear()
+        count_cache.clear()
+        
         return jsonify({'message': '案例删除成功'})
         
     except Exception as e:
         return jsonify({'error': f'删除案例失败: {str(e)}'}), 500
 
+EXPORT_FIELDS = [
+    '_id', 'filename', 'type', 'image_id', 'description', 'category_description',
+    'suggestion', 'created_at', 'updated_at', 'file_size', 'file_type'
+]
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+def _parse_date(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} 日期格式无效，应为 ISO 格式（如 2024-01-31）')
+
+def _export_query():
+    """按类型和创建时间范围（start 含、end 不含）构建导出条件"""
+    query = {}
+    hazard_type = request.args.get('type')
+    if hazard_type:
+        query['type'] = hazard_type
+    created_at = {}
+    if request.args.get('start'):
+        created_at['$gte'] = _parse_date(request.args['start'], 'start')
+    if request.args.get('end'):
+        created_at['$lt'] = _parse_date(request.args['end'], 'end')
+    if created_at:
+        query['created_at'] = created_at
+    return query
+
+def _iter_export_batches(db, query):
+    """按批读取游标，每次产出一批已转换的案例"""
+    projection = {field: 1 for field in EXPORT_FIELDS}
+    cursor = db.cases.find(query, projection, batch_size=Config.EXPORT_BATCH_SIZE).sort(
+        [('created_at', 1), ('_id', 1)]
+    )
+    batch = []
+    for case in cursor:
+        batch.append(_serialize_case(case))
+        if len(batch) >= Config.EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _export_json(batches):
+    """流式输出与原接口相同结构的 JSON: {cases, total, export_time}"""
+    yield '{"cases": ['
+    total = 0
+    for batch in batches:
+        yield (',' if total else '') + ','.join(json.dumps(case, ensure_ascii=False) for case in batch)
+        total += len(batch)
+    yield f'], "total": {total}, "export_time": {json.dumps(datetime.now().isoformat())}}}'
+
+def _export_ndjson(batches):
+    for batch in batches:
+        yield ''.join(json.dumps(case, ensure_ascii=False) + '\n' for case in batch)
+
+def _export_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+    # BOM 便于 Excel 正确识别 UTF-8 中文
+    yield '\ufeff'
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def _export_parquet(batches):
+    """Parquet 需要写完文件尾，按批写入临时文件（每批一个 row group）后再分块输出"""
+    schema = pa.schema([
+        (field, pa.int64() if field == 'file_size' else pa.string()) for field in EXPORT_FIELDS
+    ])
+    with tempfile.TemporaryFile() as tmp:
+        with pq.ParquetWriter(tmp, schema) as writer:
+            for batch in batches:
+                columns = {
+                    field: [
+                        case.get(field) if field == 'file_size' or case.get(field) is None
+                        else str(case.get(field))
+                        for case in batch
+                    ]
+                    for field in EXPORT_FIELDS
+                }
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+        tmp.seek(0)
+        for chunk in iter(lambda: tmp.read(EXPORT_CHUNK_SIZE), b''):
+            yield chunk
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip 格式
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
 @history_bp.route('/history/export', methods=['GET'])
 def export_history_cases():
-    """导出历史案例数据"""
+    """流式导出历史案例数据
+
+    format: json（默认，结构与原接口一致）/ ndjson / csv / parquet；gzip=1 时压缩输出；
+    type、start、end（ISO 日期，按 created_at 筛选）为可选过滤条件。
+    """
     try:
         db = get_db_connection()
-        if not db:
+        if db is None:
             return jsonify({'error': '数据库连接失败'}), 500
         
-        # 获取所有案例（不包含特征向量）
-        cases = list(db.cases.find(
-            {},
-            {
-                'filename': 1,
-                'type': 1,
-                'image_id': 1,
-                'description': 1,
-                'category_description': 1,
-                'suggestion': 1,
-                'created_at': 1,
-                'updated_at': 1,
-                'file_size': 1,
-                'file_type': 1
-            }
-        ))
-        
-        # 转换日期格式
-        for case in cases:
-            case['_id'] = str(case['_id'])
-            if 'created_at' in case:
-                case['created_at'] = case['created_at'].isoformat()
-            if 'updated_at' in case:
-                case['updated_at'] = case['updated_at'].isoformat()
-        
-        return jsonify({
-            'cases': cases,
-            'total': len(cases),
-            'export_time': datetime.now().isoformat()
-        })
-        
+        export_format = request.args.get('format', 'json').lower()
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f'不支持的导出格式: {export_format}'}), 400
+        if export_format == 'parquet' and pq is None:
+            return jsonify({'error': 'Parquet 导出需要安装 pyarrow'}), 501
+        use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+        query = _export_query()
+        
+        batches = _iter_export_batches(db, query)
+        writers = {
+            'json': _export_json,
+            'ndjson': _export_ndjson,
+            'csv': _export_csv,
+            'parquet': _export_parquet,
+        }
+        chunks = writers[export_format](batches)
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        filename = f"cases_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+        if use_gzip:
+            chunks = _gzip_stream(chunks)
+            mimetype = 'application/gzip'
+            filename += '.gz'
+        
+        headers = {}
+        if export_format != 'json' or use_gzip:
+            headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+        
+    except ValueError as e:
+        return jsonify({'error': f'参数无效: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': f'导出数据失败: {str(e)}'}), 500
 
@@ -1,9 +1,9 @@
 import os
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 from config import Config
+from utils.lru_cache import TTLCache
 
 # 配置 Hugging Face 镜像源（如果在中国大陆，可以使用镜像）
 # 如果遇到 SSL 错误或连接问题，取消下面的注释来使用镜像源
@@ -93,6 +93,10 @@ class BertSimilarityService:
         
         print("✅ BERT模型加载完成")
         
+        self._similarity_stats = None
+        # 生成描述的向量缓存（相同描述只编码一次）
+        self.embedding_cache = TTLCache(Config.SIMILARITY_EMBEDDING_CACHE_SIZE)
+        
         # 加载隐患类别描述
         self.hazard_descriptions = self._load_hazard_descriptions()
         # 预编码所有类别描述
@@ -139,8 +143,62 @@ class BertSimilarityService:
             for i, hazard_type in enumerate(type_keys):
                 embeddings[hazard_type] = encoded[i]
         
+        # 归一化的类别矩阵，行号与 type_index 对应，相似度只需点积
+        self.type_index = {hazard_type: i for i, hazard_type in enumerate(type_keys)}
+        self.category_matrix = (
+            self._normalize(np.vstack([embeddings[t] for t in type_keys])) if type_keys else None
+        )
         return embeddings
     
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.where(norms > 0, norms, 1.0)
+    
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """批量编码文本，返回 (n, d) 归一化向量；重复文本从 LRU 缓存读取"""
+        vectors = {}
+        missing = []
+        for text in dict.fromkeys(texts):
+            vector = self.embedding_cache.get(text, None)
+            if vector is None:
+                missing.append(text)
+            else:
+                vectors[text] = vector
+        if missing:
+            encoded = self._normalize(self.model.encode(
+                missing, batch_size=Config.SIMILARITY_BATCH_SIZE, convert_to_numpy=True
+            ))
+            for text, vector in zip(missing, encoded):
+                self.embedding_cache.set(text, vector)
+                vectors[text] = vector
+        return np.vstack([vectors[text] for text in texts])
+    
+    def calculate_similarities(self, pairs: List[Tuple[str, str]]) -> List[Tuple[float, str]]:
+        """批量计算 (生成描述, 隐患类型) 与对应类型标准描述的相似度
+
+        所有描述一次编码，与预先归一化的类别矩阵逐行点积。
+        返回与 pairs 对齐的 (相似度分数, 标准描述文本)，未知类型为 (0.0, "")；
+        编码失败时抛出异常，避免调用方把失败当作 0 分写入。
+        """
+        results = [(0.0, "")] * len(pairs)
+        valid = [
+            i for i, (_, hazard_type) in enumerate(pairs)
+            if hazard_type in self.type_index
+        ]
+        for i, (_, hazard_type) in enumerate(pairs):
+            if hazard_type not in self.type_index:
+                print(f"⚠️  未找到类型 {hazard_type} 的标准描述")
+        if not valid:
+            return results
+        generated = self.encode_texts([pairs[i][0] or "" for i in valid])
+        rows = self.category_matrix[[self.type_index[pairs[i][1]] for i in valid]]
+        similarities = np.clip(np.einsum('ij,ij->i', generated, rows), 0.0, 1.0)
+        for i, similarity in zip(valid, similarities):
+            results[i] = (float(similarity), self.hazard_descriptions[pairs[i][1]])
+        return results
+    
     def calculate_similarity(
         self, 
         generated_description: str, 
@@ -154,91 +212,34 @@ class BertSimilarityService:
             hazard_type: 隐患类型（如 "1", "2"）
         
         Returns:
-            (相似度分数, 标准描述文本)
+            (相似度分数, 标准描述文本)，计算失败时为 (0.0, "")
         """
         try:
-            # 获取标准描述
-            standard_description = self.hazard_descriptions.get(hazard_type)
-            if not standard_description:
-                print(f"⚠️  未找到类型 {hazard_type} 的标准描述")
-                return 0.0, ""
-            
-            # 编码生成的描述
-            generated_embedding = self.model.encode(
-                [generated_description], 
-                convert_to_numpy=True
-            )[0]
-            
-            # 获取预编码的标准描述
-            standard_embedding = self.description_embeddings.get(hazard_type)
-            if standard_embedding is None:
-                # 如果预编码中没有，实时编码
-                standard_embedding = self.model.encode(
-                    [standard_description], 
-                    convert_to_numpy=True
-                )[0]
-            
-            # 计算余弦相似度
-            similarity = cosine_similarity(
-                generated_embedding.reshape(1, -1),
-                standard_embedding.reshape(1, -1)
-            )[0][0]
-            
-            # 确保相似度在 [0, 1] 范围内
-            similarity = max(0.0, min(1.0, float(similarity)))
-            
-            return similarity, standard_description
-            
+            return self.calculate_similarities([(generated_description, hazard_type)])[0]
         except Exception as e:
             print(f"❌ 计算相似度失败: {e}")
             return 0.0, ""
     
-    def get_average_similarity(self) -> Dict[str, float]:
-        """获取所有已识别图像的平均相似度"""
-        from pymongo import MongoClient
-        from config import Config
-        
+    def get_average_similarity(self, similarity_stats=None) -> Dict[str, float]:
+        """获取所有已识别图像的平均相似度（读取增量维护的统计）
+
+        average/count 与原先扫描 analysis_cache 的口径一致：所有带 BERT 相似度的结果，含 0 分；
+        by_model 为各模型排除 0 分结果后的 BERT 平均值（见 similarity_stats._contribution）。
+        """
         try:
-            client = MongoClient(Config.MONGODB_URI)
-            db = client[Config.DATABASE_NAME]
-            cache_collection = db.analysis_cache
-            
-            # 获取所有有相似度记录的结果
-            all_results = list(cache_collection.find(
-                {"result.bert_similarity": {"$exists": True}}
-            ))
-            
-            if not all_results:
-                return {
-                    "average": 0.0,
-                    "count": 0,
-                    "by_model": {}
-                }
-            
-            # 计算总体平均
-            similarities = [
-                r["result"].get("bert_similarity", 0.0) 
-                for r in all_results
-            ]
-            average = sum(similarities) / len(similarities) if similarities else 0.0
-            
-            # 按模型分组计算
-            by_model = {}
-            for model in ['gemini', 'gpt4o']:
-                model_results = [
-                    r["result"].get("bert_similarity", 0.0)
-                    for r in all_results
-                    if r.get("model") == model and r["result"].get("bert_similarity")
-                ]
-                if model_results:
-                    by_model[model] = sum(model_results) / len(model_results)
-                else:
-                    by_model[model] = 0.0
-            
+            if similarity_stats is None:
+                from services.similarity_stats import SimilarityStats
+                if self._similarity_stats is None:
+                    self._similarity_stats = SimilarityStats()
+                similarity_stats = self._similarity_stats
+            stats = similarity_stats.get_stats()
             return {
-                "average": average,
-                "count": len(all_results),
-                "by_model": by_model
+                "average": stats["all"]["scored_bert_avg"],
+                "count": stats["all"]["scored_count"],
+                "by_model": {
+                    model: data.get("bert_avg", 0.0)
+                    for model, data in stats["by_model"].items()
+                }
             }
         except Exception as e:
             print(f"❌ 获取平均相似度失败: {e}")
@@ -246,4 +247,4 @@ class BertSimilarityService:
                 "average": 0.0,
                 "count": 0,
                 "by_model": {}
-            }
\ No newline at end of file
+            }
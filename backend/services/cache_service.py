@@ -1,18 +1,44 @@
-import hashlib
-from pymongo import MongoClient
+import copy
+from pymongo import ReturnDocument
 from datetime import datetime
 from config import Config
-from typing import Optional, Dict
-import os
+from typing import Optional, Dict, List
+import threading
+import time
+from datetime import timedelta
+from utils.lru_cache import TTLCache, MISSING
+from utils.perceptual_hash import BKTree
+from services.similarity_stats import SimilarityStats
+from services.database import get_mongo_client
+
+# 本地缓存中表示“数据库中不存在”的标记
+_ABSENT = object()
+# 本地缓存写入与回填按键分段加锁的段数
+_LOCK_STRIPES = 64
+
 
 class CacheService:
-    """分析结果缓存服务"""
+    """分析结果缓存服务（进程内 LRU + MongoDB 两级缓存）"""
     
     def __init__(self):
+        # 进程内缓存层，键为 (image_hash, model)
+        self.local_cache = TTLCache(Config.RESULT_CACHE_SIZE, Config.RESULT_CACHE_TTL)
+        # 每段一把锁和一个版本号：保存结果后版本号加一，查询前记下版本号的读取方据此放弃回填旧值
+        self._stripe_locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+        self._stripe_versions = [0] * _LOCK_STRIPES
+        # 感知哈希 BK 树（首次近似查找时从数据库加载，之后按 updated_at 增量加载）
+        self._phash_tree = None
+        self._phash_keys = set()
+        self._phash_loaded_at = 0.0
+        self._phash_since = None
+        self._phash_refreshing = False
+        self._phash_lock = threading.Lock()
         try:
-            self.client = MongoClient(Config.MONGODB_URI)
+            self.client = get_mongo_client()
             self.db = self.client[Config.DATABASE_NAME]
             self.cache_collection = self.db.analysis_cache
+            # 按模型/类型增量维护的相似度统计
+            self.similarity_stats = SimilarityStats(self.db)
             
             # 删除旧的错误索引（如果存在）
             try:
@@ -28,6 +54,9 @@ class CacheService:
                 name="image_hash_model_idx"
             )
             self.cache_collection.create_index("created_at")
+            self.cache_collection.create_index("updated_at")
+            # 感知哈希稀疏索引，加速近似查找索引的加载
+            self.cache_collection.create_index("phash", sparse=True)
             
             # 测试连接
             self.client.admin.command('ping')
@@ -38,55 +67,114 @@ class CacheService:
             traceback.print_exc()
             raise
     
-    def calculate_image_hash(self, image_path: str) -> str:
-        """计算图片的MD5哈希值"""
-        try:
-            hash_md5 = hashlib.md5()
-            with open(image_path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            hash_value = hash_md5.hexdigest()
-            print(f"🔍 计算图片哈希: {hash_value[:8]}... (文件: {os.path.basename(image_path)})")
-            return hash_value
-        except Exception as e:
-            print(f"❌ 计算哈希失败: {e}")
-            raise
-    
-    def calculate_bytes_hash(self, image_bytes: bytes) -> str:
-        """计算图片字节流的MD5哈希值"""
-        return hashlib.md5(image_bytes).hexdigest()
-    
-    def get_cached_result(self, image_hash: str, model: str) -> Optional[Dict]:
-        """从缓存中获取分析结果"""
+    # 覆盖旧结果时只取统计需要的字段
+    STATS_PROJECTION = {
+        "_id": 0,
+        "result.type": 1,
+        "result.bert_similarity": 1,
+        "result.tfidf_similarity": 1,
+        "result.decision_path": 1,
+    }
+
+    # 读取缓存时只取需要的字段
+    CACHE_PROJECTION = {
+        "_id": 0,
+        "image_hash": 1,
+        "model": 1,
+        "result": 1,
+        "created_at": 1,
+        "updated_at": 1,
+    }
+
+    @staticmethod
+    def _stripe(key) -> int:
+        return hash(key) % _LOCK_STRIPES
+
+    def _fill_local(self, key, value, versions: List[int], ttl: Optional[float] = None):
+        """回填本地缓存；查询期间该键所在分段有结果写入时放弃回填，避免旧值覆盖新结果"""
+        stripe = self._stripe(key)
+        with self._stripe_locks[stripe]:
+            if self._stripe_versions[stripe] == versions[stripe]:
+                self.local_cache.set(key, value, ttl=ttl)
+
+    def get_cached_results(self, image_hash: str, models: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """一次查询获取同一图片多个模型的缓存结果，返回 {model: 缓存记录}
+
+        先查进程内缓存，只有本地未命中的模型才查询 MongoDB；
+        models 为空时查询该图片的所有模型。
+        """
         try:
-            print(f"🔍 查询缓存: hash={image_hash[:8]}..., model={model}")
-            
-            cached = self.cache_collection.find_one({
-                "image_hash": image_hash,
-                "model": model
-            })
-            
-            if cached:
-                result = {
-                    "image_hash": cached.get("image_hash"),
-                    "model": cached.get("model"),
-                    "result": cached.get("result"),
-                    "created_at": cached.get("created_at"),
-                    "updated_at": cached.get("updated_at"),
-                }
-                print(f"✅ 从缓存中获取结果 (hash: {image_hash[:8]}..., model: {model})")
-                return result
-            
-            print(f"⚠️  缓存未命中 (hash: {image_hash[:8]}..., model: {model})")
-            return None
+            cached, missing = {}, []
+            if models is None:
+                missing = None
+            else:
+                for model in models:
+                    entry = self.local_cache.get((image_hash, model))
+                    if entry is MISSING:
+                        missing.append(model)
+                    elif entry is not _ABSENT:
+                        cached[model] = copy.deepcopy(entry)
+                if not missing:
+                    print(f"⚡ 本地缓存命中: hash={image_hash[:8]}..., 模型={sorted(cached) or '无'}")
+                    return cached
+
+            versions = list(self._stripe_versions)
+            query = {"image_hash": image_hash}
+            if missing is not None:
+                query["model"] = {"$in": missing}
+            for doc in self.cache_collection.find(query, self.CACHE_PROJECTION):
+                self._fill_local((image_hash, doc["model"]), doc, versions)
+                cached[doc["model"]] = copy.deepcopy(doc)
+            # 数据库中也没有的模型短时间记为不存在，避免重复查询
+            for model in missing or []:
+                if model not in cached:
+                    self._fill_local((image_hash, model), _ABSENT, versions, ttl=Config.RESULT_CACHE_NEGATIVE_TTL)
+            print(f"🔍 查询缓存: hash={image_hash[:8]}..., 命中模型={sorted(cached) or '无'}")
+            return cached
         except Exception as e:
             print(f"❌ 查询缓存失败: {e}")
             import traceback
             traceback.print_exc()
-            return None
+            return {}
+
+    def get_cached_results_for_hashes(self, image_hashes: List[str], model: str) -> Dict[str, Dict]:
+        """一次查询获取多张图片同一模型的缓存结果，返回 {image_hash: 缓存记录}
+
+        与 get_cached_results 相同，只有本地缓存未命中的图片才查询 MongoDB。
+        """
+        try:
+            cached, missing = {}, []
+            for image_hash in dict.fromkeys(image_hashes):
+                entry = self.local_cache.get((image_hash, model))
+                if entry is MISSING:
+                    missing.append(image_hash)
+                elif entry is not _ABSENT:
+                    cached[image_hash] = copy.deepcopy(entry)
+            if missing:
+                versions = list(self._stripe_versions)
+                for doc in self.cache_collection.find(
+                    {"image_hash": {"$in": missing}, "model": model}, self.CACHE_PROJECTION
+                ):
+                    self._fill_local((doc["image_hash"], model), doc, versions)
+                    cached[doc["image_hash"]] = copy.deepcopy(doc)
+                for image_hash in missing:
+                    if image_hash not in cached:
+                        self._fill_local((image_hash, model), _ABSENT, versions, ttl=Config.RESULT_CACHE_NEGATIVE_TTL)
+            print(f"🔍 批量查询缓存: {len(image_hashes)} 张图片, 模型={model}, 命中 {len(cached)} 张")
+            return cached
+        except Exception as e:
+            print(f"❌ 批量查询缓存失败: {e}")
+            return {}
+
+    def get_cached_result(self, image_hash: str, model: str) -> Optional[Dict]:
+        """从缓存中获取分析结果"""
+        return self.get_cached_results(image_hash, [model]).get(model)
     
-    def save_result(self, image_hash: str, result: Dict, model: str) -> bool:
-        """保存分析结果到缓存"""
+    def save_result(self, image_hash: str, result: Dict, model: str, phash: Optional[str] = None) -> bool:
+        """保存分析结果到缓存，并增量更新相似度统计
+
+        phash 为图片的感知哈希，提供时写入记录并加入近似查找索引。
+        """
         try:
             print(f"💾 开始保存到缓存: hash={image_hash[:8]}..., model={model}")
             
@@ -95,40 +183,53 @@ class CacheService:
                 print("❌ 结果数据为空，无法保存")
                 return False
             
-            cache_data = {
-                "image_hash": image_hash,
-                "model": model,
-                "result": result,
-                "created_at": datetime.now(),
-                "updated_at": datetime.now(),
-            }
-            
-            # 使用 upsert 更新或插入
-            update_result = self.cache_collection.update_one(
-                {"image_hash": image_hash, "model": model},
-                {"$set": cache_data},
-                upsert=True
-            )
-            
-            if update_result.upserted_id:
-                print(f"✅ 已插入新缓存记录 (hash: {image_hash[:8]}..., model: {model}, _id: {update_result.upserted_id})")
-            elif update_result.modified_count > 0:
-                print(f"✅ 已更新缓存记录 (hash: {image_hash[:8]}..., model: {model})")
-            else:
-                print(f"⚠️  缓存记录未变化 (hash: {image_hash[:8]}..., model: {model})")
-            
-            # 验证保存是否成功
-            verify = self.cache_collection.find_one({
-                "image_hash": image_hash,
-                "model": model
-            })
-            
-            if verify:
-                print(f"✅ 验证成功：缓存已保存到数据库")
-                return True
+            now = datetime.now()
+            cache_key = (image_hash, model)
+            fields = {"result": result, "updated_at": now}
+            if phash:
+                fields["phash"] = phash
+
+            # 持有该键所在分段的锁完成写库和本地缓存更新；版本号加一后，
+            # 写入前开始查询的读取方不会再把旧值回填到本地缓存
+            stripe = self._stripe(cache_key)
+            with self._stripe_locks[stripe]:
+                self.local_cache.pop(cache_key)
+                try:
+                    # 使用 upsert 更新或插入，同时取回被覆盖的旧结果用于修正统计
+                    previous = self.cache_collection.find_one_and_update(
+                        {"image_hash": image_hash, "model": model},
+                        {
+                            "$set": fields,
+                            "$setOnInsert": {"created_at": now},
+                        },
+                        projection=self.STATS_PROJECTION,
+                        upsert=True,
+                        return_document=ReturnDocument.BEFORE,
+                    )
+                    self.local_cache.set(cache_key, {
+                        "image_hash": image_hash,
+                        "model": model,
+                        "result": copy.deepcopy(result),
+                        "updated_at": now,
+                    })
+                finally:
+                    self._stripe_versions[stripe] += 1
+            if phash:
+                self._add_to_phash_index(phash, image_hash, model)
+
+            try:
+                self.similarity_stats.record(
+                    model, result, previous.get("result") if previous else None
+                )
+            except Exception as e:
+                # 统计可通过 rebuild 修复，不影响缓存写入
+                print(f"⚠️  更新相似度统计失败: {e}")
+
+            if previous is None:
+                print(f"✅ 已插入新缓存记录 (hash: {image_hash[:8]}..., model: {model})")
             else:
-                print(f"❌ 验证失败：缓存未找到")
-                return False
+                print(f"✅ 已更新缓存记录 (hash: {image_hash[:8]}..., model: {model})")
+            return True
                 
         except Exception as e:
             print(f"❌ 保存缓存失败: {e}")
@@ -136,6 +237,82 @@ class CacheService:
             traceback.print_exc()
             return False
     
+    def _refresh_phash_index(self):
+        """加载感知哈希：首次全量，之后只加载上次加载以来更新的记录
+
+        数据库查询在锁外进行，查询期间其他请求继续使用现有的树；
+        同一时间只有一个线程执行加载。
+        """
+        with self._phash_lock:
+            if self._phash_refreshing or (
+                    self._phash_tree is not None
+                    and time.time() - self._phash_loaded_at <= Config.NEAR_DUP_REFRESH_INTERVAL):
+                return
+            self._phash_refreshing = True
+            since = self._phash_since
+        try:
+            started = datetime.now()
+            query = {"phash": {"$exists": True}}
+            if since is not None:
+                query["updated_at"] = {"$gte": since}
+            docs = list(self.cache_collection.find(
+                query, {"_id": 0, "phash": 1, "image_hash": 1, "model": 1},
+            ))
+            with self._phash_lock:
+                full_load = self._phash_tree is None
+                if full_load:
+                    self._phash_tree = BKTree()
+                for doc in docs:
+                    self._add_phash_locked(doc["phash"], doc["image_hash"], doc["model"])
+                # 留出余量覆盖查询期间写入的记录，重复条目由 _phash_keys 去重
+                self._phash_since = started - timedelta(seconds=5)
+                self._phash_loaded_at = time.time()
+            if full_load:
+                print(f"✅ 感知哈希索引已加载: {len(self._phash_tree)} 条记录")
+        finally:
+            with self._phash_lock:
+                self._phash_refreshing = False
+
+    def _add_phash_locked(self, phash: str, image_hash: str, model: str):
+        key = (phash, image_hash, model)
+        if key not in self._phash_keys:
+            self._phash_keys.add(key)
+            self._phash_tree.add(int(phash, 16), (image_hash, model))
+
+    def _add_to_phash_index(self, phash: str, image_hash: str, model: str):
+        with self._phash_lock:
+            if self._phash_tree is not None:
+                self._add_phash_locked(phash, image_hash, model)
+
+    def find_near_duplicate(self, phash: str, model: str, max_distance: Optional[int] = None) -> Optional[Dict]:
+        """按感知哈希查找近似重复图片的缓存结果
+
+        返回最接近的缓存记录，并附带 distance（汉明距离）；未找到时返回 None。
+        """
+        if max_distance is None:
+            max_distance = Config.NEAR_DUP_MAX_DISTANCE
+        try:
+            # 定期增量加载，以包含其他进程写入的记录
+            self._refresh_phash_index()
+            with self._phash_lock:
+                if self._phash_tree is None:
+                    # 其他线程正在首次加载
+                    return None
+                candidates = self._phash_tree.search(int(phash, 16), max_distance)
+
+            for distance, (image_hash, candidate_model) in candidates:
+                if candidate_model != model:
+                    continue
+                cached = self.get_cached_result(image_hash, model)
+                if cached:
+                    cached["distance"] = distance
+                    print(f"🔁 近似重复命中: hash={image_hash[:8]}..., 距离={distance}")
+                    return cached
+            return None
+        except Exception as e:
+            print(f"❌ 近似重复查找失败: {e}")
+            return None
+
     def get_cache_stats(self) -> Dict:
         """获取缓存统计信息"""
         try:
@@ -146,8 +323,9 @@ class CacheService:
                 by_model[model] = count
             return {
                 "total": total,
-                "by_model": by_model
+                "by_model": by_model,
+                "local": self.local_cache.stats(),
             }
         except Exception as e:
             print(f"⚠️  获取缓存统计失败: {e}")
-            return {"total": 0, "by_model": {}}
\ No newline at end of file
+            return {"total": 0, "by_model": {}, "local": self.local_cache.stats()}
\ No newline at end of file
@@ -0,0 +1,86 @@
+import math
+from typing import Dict, List, Optional
+from config import Config
+
+# CLIP 的 logit 缩放系数，用于把余弦相似度换算为类别概率
+CLIP_LOGIT_SCALE = 100.0
+# 级联结果（未调用 LLM）在 analysis_cache 中的模型键，与各 LLM 的结果分开保存
+CASCADE_MODEL = 'cascade'
+
+
+def cache_model_key(result: Dict, provider: str) -> str:
+    """结果写入缓存时使用的模型键：级联结果统一保存在 CASCADE_MODEL 下"""
+    return CASCADE_MODEL if result.get('decision_path') == 'cascade' else provider
+
+
+class CascadePolicy:
+    """判断 CLIP 分类和相似案例是否足够一致，可以不调用 LLM
+
+    同时满足以下条件才跳过 LLM：
+    - CLIP 零样本分类第一名与第二名的概率差不低于 min_clip_margin；
+    - 相似案例按相似度加权投票，CLIP 预测类型的票数占比不低于 min_vote_share；
+    - 参与投票的案例数不少于 min_neighbours，且最相似案例的相似度不低于 min_top_similarity。
+    阈值来自配置，每次判断的指标都会随结果记录，便于离线校准。
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, min_clip_margin: Optional[float] = None,
+                 min_vote_share: Optional[float] = None, min_top_similarity: Optional[float] = None,
+                 min_neighbours: Optional[int] = None):
+        self.enabled = Config.CASCADE_ENABLED if enabled is None else enabled
+        self.min_clip_margin = Config.CASCADE_MIN_CLIP_MARGIN if min_clip_margin is None else min_clip_margin
+        self.min_vote_share = Config.CASCADE_MIN_VOTE_SHARE if min_vote_share is None else min_vote_share
+        self.min_top_similarity = (
+            Config.CASCADE_MIN_TOP_SIMILARITY if min_top_similarity is None else min_top_similarity
+        )
+        self.min_neighbours = Config.CASCADE_MIN_NEIGHBOURS if min_neighbours is None else min_neighbours
+
+    @staticmethod
+    def clip_probabilities(all_scores: Dict[str, float]) -> Dict[str, float]:
+        """按 CLIP 的方式对类别余弦相似度做 softmax"""
+        if not all_scores:
+            return {}
+        peak = max(all_scores.values())
+        weights = {key: math.exp(CLIP_LOGIT_SCALE * (score - peak)) for key, score in all_scores.items()}
+        total = sum(weights.values())
+        return {key: weight / total for key, weight in weights.items()}
+
+    def decide(self, classification: Dict, similar_cases: List[Dict]) -> Dict:
+        """返回 {'skip_llm', 'type', 'reason', 各项指标}"""
+        probabilities = self.clip_probabilities(classification.get('all_scores') or {})
+        ranked = sorted(probabilities.values(), reverse=True)
+        clip_type = classification.get('type')
+        clip_margin = ranked[0] - ranked[1] if len(ranked) > 1 else (ranked[0] if ranked else 0.0)
+
+        votes = {}
+        for case in similar_cases or []:
+            weight = max(0.0, float(case.get('similarity', 0.0)))
+            votes[case.get('type')] = votes.get(case.get('type'), 0.0) + weight
+        total_votes = sum(votes.values())
+        vote_share = votes.get(clip_type, 0.0) / total_votes if total_votes else 0.0
+        top_similarity = max((case.get('similarity', 0.0) for case in similar_cases or []), default=0.0)
+
+        decision = {
+            'skip_llm': False,
+            'type': clip_type,
+            'clip_probability': round(probabilities.get(clip_type, 0.0), 4),
+            'clip_margin': round(clip_margin, 4),
+            'vote_share': round(vote_share, 4),
+            'top_similarity': round(float(top_similarity), 4),
+            'neighbours': len(similar_cases or []),
+        }
+        if not self.enabled:
+            decision['reason'] = 'disabled'
+        elif clip_type in (None, 'unknown'):
+            decision['reason'] = 'clip_failed'
+        elif decision['neighbours'] < self.min_neighbours:
+            decision['reason'] = 'too_few_neighbours'
+        elif clip_margin < self.min_clip_margin:
+            decision['reason'] = 'low_clip_margin'
+        elif vote_share < self.min_vote_share:
+            decision['reason'] = 'neighbours_disagree'
+        elif top_similarity < self.min_top_similarity:
+            decision['reason'] = 'low_similarity'
+        else:
+            decision['skip_llm'] = True
+            decision['reason'] = 'confident'
+        return decision
@@ -0,0 +1,386 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+from typing import Dict, List, Optional
+from config import Config
+from services.database import get_db
+from services.retrieval_backends import BruteForceBackend, create_backend, index_file_paths
+from utils.feature_codec import decode_features
+
+
+class CaseIndex:
+    """常驻内存的案例特征索引
+
+    将 cases 集合中所有案例的归一化特征拼接为一个连续的 float32 矩阵，
+    并保存与之行对齐的 id、类型和描述数组。检索交给可插拔的检索后端
+    （暴力检索 / FAISS Flat / IVF / HNSW，见 retrieval_backends）。
+
+    增量变化（apply_changes）只追加新行、把删除或被替换的行标记为失效（alive 掩码），
+    检索时跳过失效行；失效行和追加行占比超过 CASE_INDEX_REBUILD_RATIO 时才压缩并全量重建。
+    """
+
+    PROJECTION = {
+        'features': 1,
+        'features_format': 1,
+        'features_dim': 1,
+        'description': 1,
+        'type': 1,
+        'category_description': 1,
+        'content_hash': 1,
+        'updated_at': 1,
+    }
+    # 与矩阵行对齐的数组
+    ROW_FIELDS = ('ids', 'types', 'descriptions', 'category_descriptions', 'versions')
+
+    def __init__(self, db, refresh_interval: Optional[float] = None, backend_name: Optional[str] = None):
+        self.db = db
+        self.backend_name = backend_name or Config.RETRIEVAL_BACKEND
+        self.refresh_interval = (
+            Config.CASE_INDEX_REFRESH_INTERVAL if refresh_interval is None else refresh_interval
+        )
+        self._lock = threading.RLock()
+        # (快照, 检索后端) 整体替换，保证检索时二者一致
+        self._state = (self._empty_snapshot(), create_backend(self.backend_name))
+        # 有效行的 id -> 行号，只在持有 _lock 时读写
+        self._positions = {}
+        self._built_rows = 0
+        self._appended_rows = 0
+        self._fingerprint = None
+        self._last_check = 0.0
+        self.loaded = False
+
+    @staticmethod
+    def _empty_snapshot() -> Dict:
+        return {
+            'matrix': np.zeros((0, 0), dtype=np.float32),
+            'ids': np.array([], dtype=object),
+            'types': np.array([], dtype=object),
+            'descriptions': np.array([], dtype=object),
+            'category_descriptions': np.array([], dtype=object),
+            'versions': np.array([], dtype=object),
+            'alive': np.array([], dtype=bool),
+            'dead': 0,
+        }
+
+    @staticmethod
+    def _case_version(case: Dict) -> str:
+        """案例内容版本：优先使用图片内容哈希，旧数据退回到更新时间"""
+        version = case.get('content_hash') or case.get('updated_at')
+        return str(version) if version is not None else ''
+
+    @staticmethod
+    def _content_digest(snapshot: Dict) -> str:
+        """按行顺序对有效行的 (id, 内容版本) 计算摘要，用于判断磁盘索引是否过期"""
+        digest = hashlib.sha1()
+        for case_id, version, alive in zip(snapshot['ids'], snapshot['versions'], snapshot['alive']):
+            if alive:
+                digest.update(f"{case_id}:{version}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _normalize_features(case: Dict) -> Optional[np.ndarray]:
+        """将案例文档中的特征（二进制或旧的列表格式）转换为归一化的一维 float32 向量"""
+        vector = decode_features(case)
+        if vector is None:
+            return None
+        norm = np.linalg.norm(vector)
+        if vector.size == 0 or norm == 0:
+            return None
+        return vector / norm
+
+    def _build_snapshot(self, cases: List[Dict]) -> Dict:
+        vectors, ids, types, descriptions, category_descriptions, versions = [], [], [], [], [], []
+        dim = None
+        for case in cases:
+            try:
+                vector = self._normalize_features(case)
+            except ValueError as e:
+                print(f"⚠️  案例 {case.get('_id')} 特征解码失败，已跳过: {e}")
+                continue
+            if vector is None:
+                continue
+            if dim is None:
+                dim = vector.shape[0]
+            elif vector.shape[0] != dim:
+                print(f"⚠️  案例 {case.get('_id')} 特征维度不一致，已跳过")
+                continue
+            vectors.append(vector)
+            ids.append(case.get('_id'))
+            types.append(case.get('type'))
+            descriptions.append(case.get('description', ''))
+            category_descriptions.append(case.get('category_description', ''))
+            versions.append(self._case_version(case))
+
+        if not vectors:
+            return self._empty_snapshot()
+
+        return {
+            'matrix': np.ascontiguousarray(np.vstack(vectors), dtype=np.float32),
+            'ids': np.array(ids, dtype=object),
+            'types': np.array(types, dtype=object),
+            'descriptions': np.array(descriptions, dtype=object),
+            'category_descriptions': np.array(category_descriptions, dtype=object),
+            'versions': np.array(versions, dtype=object),
+            'alive': np.ones(len(vectors), dtype=bool),
+            'dead': 0,
+        }
+
+    @classmethod
+    def _take_rows(cls, snapshot: Dict, rows: np.ndarray, alive: np.ndarray) -> Dict:
+        """按行号重新排列快照，alive 为新快照的有效行掩码"""
+        taken = {field: snapshot[field][rows] for field in cls.ROW_FIELDS}
+        taken['matrix'] = np.ascontiguousarray(snapshot['matrix'][rows], dtype=np.float32)
+        taken['alive'] = alive
+        taken['dead'] = int(alive.size - np.count_nonzero(alive))
+        return taken
+
+    @classmethod
+    def _compact(cls, snapshot: Dict) -> Dict:
+        """去掉失效行"""
+        rows = np.flatnonzero(snapshot['alive'])
+        return cls._take_rows(snapshot, rows, np.ones(rows.size, dtype=bool))
+
+    @classmethod
+    def _concat(cls, snapshot: Dict, extra: Dict, alive: np.ndarray) -> Dict:
+        """在快照末尾追加 extra 的所有行"""
+        if snapshot['matrix'].shape[0] == 0:
+            return extra
+        merged = {field: np.concatenate([snapshot[field], extra[field]]) for field in cls.ROW_FIELDS}
+        merged['matrix'] = np.ascontiguousarray(np.vstack([snapshot['matrix'], extra['matrix']]))
+        merged['alive'] = np.concatenate([alive, extra['alive']])
+        merged['dead'] = int(merged['alive'].size - np.count_nonzero(merged['alive']))
+        return merged
+
+    def current_fingerprint(self):
+        """用文档数量和最近更新时间判断 cases 集合是否发生变化"""
+        count = self.db.cases.estimated_document_count()
+        latest = list(self.db.cases.find({}, {'updated_at': 1}).sort('updated_at', -1).limit(1))
+        latest_updated = latest[0].get('updated_at') if latest else None
+        return count, latest_updated
+
+    def _build_backend(self, matrix: np.ndarray):
+        backend = create_backend(self.backend_name)
+        if matrix.shape[0] > 0:
+            backend.build(matrix)
+        return backend
+
+    def _set_state(self, snapshot: Dict, backend, rebuilt: bool):
+        """替换当前状态；rebuilt 表示检索后端按当前有效行重新构建或加载"""
+        self._state = (snapshot, backend)
+        self._positions = {
+            case_id: row for row, (case_id, alive) in enumerate(zip(snapshot['ids'], snapshot['alive'])) if alive
+        }
+        if rebuilt:
+            self._built_rows = len(self._positions)
+            self._appended_rows = 0
+
+    def _load_backend_from_disk(self, snapshot: Dict):
+        """加载 database_init 或增量同步保存的索引文件，返回 (按文件行序排列的快照, 检索后端)
+
+        文件中的有效 id 集合或案例内容与数据库不一致时返回 None；
+        暴力检索的矩阵就是快照本身，直接使用快照，不读取磁盘文件。
+        """
+        backend = create_backend(self.backend_name)
+        if backend.name == BruteForceBackend.name:
+            return None
+        index_path, ids_path = index_file_paths(backend.name)
+        if not (os.path.exists(index_path) and os.path.exists(ids_path)):
+            return None
+        try:
+            with open(ids_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            # 旧版本只保存了 id 列表，没有内容摘要，视为过期
+            if not isinstance(saved, dict) or not isinstance(saved.get('ids'), list):
+                print(f"⚠️  索引文件 {index_path} 格式过旧，重新构建")
+                return None
+            # 文件中失效行的 id 为 None；按文件的行序排列数据库快照
+            row_of = {str(case_id): row for row, case_id in enumerate(snapshot['ids'])}
+            saved_ids = saved['ids']
+            live_ids = [case_id for case_id in saved_ids if case_id is not None]
+            if len(live_ids) != len(row_of) or any(case_id not in row_of for case_id in live_ids):
+                print(f"⚠️  索引文件 {index_path} 与当前案例不一致，重新构建")
+                return None
+            rows = np.array([row_of.get(case_id, 0) if case_id is not None else 0 for case_id in saved_ids],
+                            dtype=np.int64)
+            alive = np.array([case_id is not None for case_id in saved_ids], dtype=bool)
+            ordered = self._take_rows(snapshot, rows, alive) if saved_ids else snapshot
+            if saved.get('digest') != self._content_digest(ordered):
+                print(f"⚠️  索引文件 {index_path} 与当前案例内容不一致，重新构建")
+                return None
+            backend.load(index_path)
+            if backend.ntotal != len(saved_ids):
+                print(f"⚠️  索引文件 {index_path} 行数不一致，重新构建")
+                return None
+            print(f"📁 已加载检索索引文件: {index_path}")
+            return ordered, backend
+        except Exception as e:
+            print(f"⚠️  加载索引文件失败，重新构建: {e}")
+            return None
+
+    def save(self) -> str:
+        """将当前检索后端的索引、id 映射（失效行为 None）和内容摘要写入磁盘"""
+        with self._lock:
+            os.makedirs(Config.RETRIEVAL_INDEX_DIR, exist_ok=True)
+            snapshot, backend = self._state
+            index_path, ids_path = index_file_paths(backend.name)
+            backend.save(index_path)
+            with open(ids_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'ids': [
+                        str(case_id) if alive else None
+                        for case_id, alive in zip(snapshot['ids'], snapshot['alive'])
+                    ],
+                    'digest': self._content_digest(snapshot),
+                }, f)
+            print(f"💾 检索索引已保存: {index_path}")
+            return index_path
+
+    def load(self, rebuild: bool = False) -> int:
+        """从数据库全量加载索引，rebuild=True 时忽略磁盘上的索引文件"""
+        with self._lock:
+            start = time.time()
+            fingerprint = self.current_fingerprint()
+            cases = self.db.cases.find({}, self.PROJECTION)
+            snapshot = self._build_snapshot(cases)
+            loaded = None if rebuild else self._load_backend_from_disk(snapshot)
+            if loaded is None:
+                loaded = snapshot, self._build_backend(snapshot['matrix'])
+            self._set_state(*loaded, rebuilt=True)
+            self._fingerprint = fingerprint
+            self._last_check = time.time()
+            self.loaded = True
+            size = len(self)
+            print(f"✅ 案例索引加载完成: {size} 个案例, 后端 {loaded[1].name}, 耗时 {time.time() - start:.2f}s")
+            return size
+
+    def ensure_fresh(self):
+        """按刷新间隔检查 cases 集合是否变化，变化时重新加载"""
+        if not self.loaded:
+            self.load()
+            return
+        if time.time() - self._last_check < self.refresh_interval:
+            return
+        with self._lock:
+            if time.time() - self._last_check < self.refresh_interval:
+                return
+            self._last_check = time.time()
+            try:
+                fingerprint = self.current_fingerprint()
+            except Exception as e:
+                print(f"⚠️  检查案例索引状态失败: {e}")
+                return
+            if fingerprint != self._fingerprint:
+                print("🔄 检测到 cases 集合变化，重新加载案例索引")
+                self.load()
+
+    def upsert_cases(self, cases: List[Dict]):
+        """增量写入或更新若干案例（需包含 _id 和 features）"""
+        self.apply_changes(cases, [])
+
+    def remove_cases(self, case_ids: List):
+        """从索引中移除若干案例"""
+        self.apply_changes([], case_ids)
+
+    def apply_changes(self, upserted: List[Dict], removed_ids: List, fingerprint=None):
+        """增量应用变化：删除和被替换的行标记为失效，新案例追加到末尾
+
+        检索后端只追加新向量（FAISS 复制索引后 add，不重新训练）；
+        失效行和追加行超过上次全量构建行数的 CASE_INDEX_REBUILD_RATIO 时压缩并全量重建。
+        fingerprint 为变更后 cases 集合的指纹，未传入时在此读取当前指纹，
+        避免这次变化随后再触发一次全量重载。
+        """
+        with self._lock:
+            snapshot, backend = self._state
+            extra = self._build_snapshot(list(upserted))
+            if (extra['matrix'].shape[0] and snapshot['matrix'].shape[0]
+                    and extra['matrix'].shape[1] != snapshot['matrix'].shape[1]):
+                print("⚠️  新案例特征维度与索引不一致，全量重建")
+                self.load(rebuild=True)
+                return
+
+            dropped = [self._positions.pop(case_id) for case_id in
+                       set(removed_ids) | {case.get('_id') for case in upserted}
+                       if case_id in self._positions]
+            alive = snapshot['alive']
+            if dropped:
+                alive = alive.copy()
+                alive[dropped] = False
+
+            added = extra['matrix'].shape[0]
+            if added:
+                base = snapshot['matrix'].shape[0]
+                snapshot = self._concat(snapshot, extra, alive)
+                backend = backend.with_added(extra['matrix']) if backend.ntotal else self._build_backend(extra['matrix'])
+                for offset, case_id in enumerate(extra['ids']):
+                    self._positions[case_id] = base + offset
+                self._appended_rows += added
+            else:
+                snapshot = dict(snapshot, alive=alive, dead=int(alive.size - np.count_nonzero(alive)))
+
+            drift = snapshot['dead'] + self._appended_rows
+            if drift > Config.CASE_INDEX_REBUILD_RATIO * max(self._built_rows, 1):
+                snapshot = self._compact(snapshot)
+                self._set_state(snapshot, self._build_backend(snapshot['matrix']), rebuilt=True)
+                print(f"🔄 案例索引变化累计 {drift} 行，已压缩并全量重建")
+            else:
+                self._state = (snapshot, backend)
+            self._fingerprint = self.current_fingerprint() if fingerprint is None else fingerprint
+            self._last_check = time.time()
+
+    def __len__(self):
+        snapshot = self._state[0]
+        return int(snapshot['matrix'].shape[0] - snapshot['dead'])
+
+    def search(self, query_features, top_k: int = 5) -> List[Dict]:
+        """检索与查询特征最相似的 top_k 个案例"""
+        return self.search_batch(np.asarray(query_features).reshape(1, -1), top_k=top_k)[0]
+
+    def search_batch(self, query_features, top_k: int = 5) -> List[List[Dict]]:
+        """批量检索：query_features 形状为 (n, d)，返回每个查询的 top_k 案例"""
+        self.ensure_fresh()
+        snapshot, backend = self._state
+        queries = np.asarray(query_features, dtype=np.float32)
+        if backend.ntotal == 0 or top_k <= 0:
+            return [[] for _ in range(queries.shape[0])]
+
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1.0)
+
+        # 多取失效行数量的候选，过滤后仍有 top_k 个
+        scores, indices = backend.search(queries, top_k + snapshot['dead'])
+        alive = snapshot['alive']
+        return [
+            [
+                {
+                    '_id': snapshot['ids'][i],
+                    'type': snapshot['types'][i],
+                    'description': snapshot['descriptions'][i],
+                    'category_description': snapshot['category_descriptions'][i],
+                    'similarity': float(score),
+                }
+                for score, i in zip(row_scores, row_indices)
+                if i >= 0 and alive[i]
+            ][:top_k]
+            for row_scores, row_indices in zip(scores, indices)
+        ]
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_case_index(db=None) -> CaseIndex:
+    """获取进程内共享的案例索引（首次调用时加载）"""
+    global _shared_index
+    if _shared_index is None:
+        with _shared_lock:
+            if _shared_index is None:
+                if db is None:
+                    db = get_db()
+                index = CaseIndex(db)
+                index.load()
+                _shared_index = index
+    return _shared_index
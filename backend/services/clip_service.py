@@ -2,27 +2,37 @@ import torch
 import clip
 import numpy as np
 import random
-from pymongo import MongoClient
 from config import Config
+from services.database import get_db
+from services.case_index import get_shared_case_index
+from utils.lru_cache import TTLCache
 
 class CLIPService:
-    def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    def __init__(self, model=None, preprocess=None, device=None):
+        # 未显式传入时使用模型注册表中共享的 CLIP 权重
+        if model is None:
+            from services.model_registry import get_model_registry
+            model, preprocess, device = get_model_registry().get_clip_model()
+        self.model, self.preprocess = model, preprocess
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         print(f"使用设备: {self.device}")
-        
-        try:
-            self.model, self.preprocess = clip.load(Config.CLIP_MODEL_NAME, device=self.device)
-            print("CLIP模型加载成功")
-        except Exception as e:
-            print(f"CLIP模型加载失败: {e}")
-            raise e
             
         try:
-            self.db = MongoClient(Config.MONGODB_URI)[Config.DATABASE_NAME]
+            self.db = get_db()
             print("数据库连接成功")
         except Exception as e:
             print(f"数据库连接失败: {e}")
             raise e
+
+        # 常驻内存的案例特征索引（进程内共享，只加载一次）
+        try:
+            self.case_index = get_shared_case_index(self.db)
+        except Exception as e:
+            print(f"案例索引加载失败，将在检索时重试: {e}")
+            self.case_index = None
+        
+        # 按隐患类型缓存的 few-shot 示例池
+        self.example_pools = TTLCache(max_size=64, ttl=Config.FEW_SHOT_POOL_TTL)
         
         # 预编码所有隐患类别的文本描述
         self.hazard_descriptions = self._load_hazard_descriptions()
@@ -60,30 +70,37 @@ class CLIPService:
         
         return text_features
     
-    def classify_hazard(self, image):
-        """直接分类隐患类型（零样本学习）"""
-        try:
-            image_features = self.encode_image(image)
-            
-            # 计算与所有文本描述的相似度
-            similarities = torch.cosine_similarity(image_features, self.text_features)
-            
-            # 获取最相似的类别
-            best_match_idx = similarities.argmax().item()
-            confidence = similarities[best_match_idx].item()
-            
-            hazard_type = str(best_match_idx + 1)
-            description = self.hazard_descriptions[hazard_type]
-            
-            return {
-                'type': hazard_type,
-                'description': description,
-                'confidence': confidence,
-                'all_scores': {
-                    str(i+1): score.item() 
-                    for i, score in enumerate(similarities)
-                }
+    def _classification_from_scores(self, similarities):
+        """根据一张图片与所有类别文本的相似度生成分类结果"""
+        # 获取最相似的类别
+        best_match_idx = similarities.argmax().item()
+        confidence = similarities[best_match_idx].item()
+        
+        hazard_type = str(best_match_idx + 1)
+        description = self.hazard_descriptions[hazard_type]
+        
+        return {
+            'type': hazard_type,
+            'description': description,
+            'confidence': confidence,
+            'all_scores': {
+                str(i+1): score.item() 
+                for i, score in enumerate(similarities)
             }
+        }
+
+    def classify_features(self, image_features):
+        """对已编码的图片特征 (n, d) 批量进行零样本分类"""
+        # 特征均已归一化，矩阵乘法即余弦相似度
+        similarities = image_features.to(self.text_features.dtype) @ self.text_features.T
+        return [self._classification_from_scores(row) for row in similarities]
+
+    def classify_hazard(self, image, image_features=None):
+        """直接分类隐患类型（零样本学习），已编码的特征可通过 image_features 传入"""
+        try:
+            if image_features is None:
+                image_features = self.encode_image(image)
+            return self.classify_features(image_features)[0]
         except Exception as e:
             print(f"CLIP分类失败: {e}")
             return {
@@ -103,46 +120,116 @@ class CLIPService:
             return image_features  # 直接返回Tensor，不转换为numpy
         except Exception as e:
             raise Exception(f"图片编码失败: {e}")
+
+    def encode_preprocessed(self, image_tensors, batch_size=None):
+        """将已预处理的图片张量堆叠后批量编码，返回 (n, d) 归一化特征"""
+        batch_size = batch_size or Config.CLIP_BATCH_SIZE
+        outputs = []
+        try:
+            with torch.no_grad():
+                for start in range(0, len(image_tensors), batch_size):
+                    batch = torch.stack(image_tensors[start:start + batch_size]).to(self.device)
+                    features = self.model.encode_image(batch)
+                    outputs.append(features / features.norm(dim=-1, keepdim=True))
+            return torch.cat(outputs)
+        except Exception as e:
+            raise Exception(f"批量图片编码失败: {e}")
+
+    def features_from_numpy(self, vectors):
+        """将 (n, d) numpy 特征（如从特征存储读取）转换为设备上的 Tensor"""
+        features = torch.from_numpy(np.ascontiguousarray(vectors, dtype=np.float32))
+        return features.to(self.device)
+
+    def encode_images(self, images, batch_size=None):
+        """批量编码多张图片"""
+        return self.encode_preprocessed([self.preprocess(image) for image in images], batch_size)
+
+    def _get_case_index(self):
+        if self.case_index is None:
+            self.case_index = get_shared_case_index(self.db)
+        return self.case_index
     
-    def find_similar_cases(self, image, top_k=5):
-        """查找最相似的历史案例"""
+    def find_similar_cases(self, image, top_k=5, image_features=None):
+        """查找最相似的历史案例，已编码的特征可通过 image_features 传入"""
         try:
-            query_features = self.encode_image(image)
-            # 确保query_features在CPU上并转换为numpy数组
-            if query_features.is_cuda:
-                query_features_np = query_features.cpu().numpy()
-            else:
-                query_features_np = query_features.numpy()
-            
-            # 从数据库获取所有案例的特征向量
-            cases = list(self.db.cases.find({}, {'features': 1, 'description': 1, 'type': 1, 'category_description': 1}))
-            
-            if not cases:
-                print("数据库中没有案例数据")
-                return []
-            
-            similarities = []
-            for case in cases:
-                if 'features' in case:
-                    case_features = np.array(case['features'])
-                    similarity = np.dot(query_features_np, case_features.T).item()
-                    similarities.append((similarity, case))
-            
-            # 按相似度排序并返回前k个
-            similarities.sort(key=lambda x: x[0], reverse=True)
-            return [case for _, case in similarities[:top_k]]
-            
+            if image_features is None:
+                image_features = self.encode_image(image)
+            return self.find_similar_cases_batch(image_features, top_k=top_k)[0]
         except Exception as e:
             print(f"查找相似案例失败: {e}")
             return []
+
+    def find_similar_cases_batch(self, image_features, top_k=5):
+        """对已编码的图片特征 (n, d) 批量检索相似案例，一次矩阵乘法完成"""
+        # 确保特征在CPU上并转换为numpy数组
+        queries = image_features.float().cpu().numpy()
+
+        # 在常驻内存的案例索引上检索
+        case_index = self._get_case_index()
+        if len(case_index) == 0:
+            case_index.ensure_fresh()
+        if len(case_index) == 0:
+            print("数据库中没有案例数据")
+            return [[] for _ in range(queries.shape[0])]
+
+        return case_index.search_batch(queries, top_k=top_k)
     
+    EXAMPLE_PROJECTION = {'description': 1, 'type': 1, 'suggestion': 1, 'category_description': 1}
+
     def get_random_examples(self, count=3):
-        """随机选择few-shot示例"""
+        """随机选择few-shot示例（由数据库 $sample 抽样，不再读取整个集合）"""
         try:
-            all_cases = list(self.db.cases.find({}, {'description': 1, 'type': 1, 'suggestion': 1, 'category_description': 1}))
-            if not all_cases:
-                return []
-            return random.sample(all_cases, min(count, len(all_cases)))
+            return list(self.db.cases.aggregate([
+                {'$sample': {'size': count}},
+                {'$project': self.EXAMPLE_PROJECTION},
+            ]))
         except Exception as e:
             print(f"获取随机示例失败: {e}")
-            return []
\ No newline at end of file
+            return []
+
+    def _get_type_pool(self, hazard_type):
+        """获取某个隐患类型的示例池（抽样后缓存，按 TTL 刷新）"""
+        pool = self.example_pools.get(hazard_type, None)
+        if pool is None:
+            pool = list(self.db.cases.aggregate([
+                {'$match': {'type': hazard_type}},
+                {'$sample': {'size': Config.FEW_SHOT_POOL_SIZE}},
+                {'$project': self.EXAMPLE_PROJECTION},
+            ]))
+            self.example_pools.set(hazard_type, pool)
+        return pool
+
+    def select_examples(self, classification, similar_cases, count=3):
+        """按候选类型选择few-shot示例
+
+        候选类型依次取 CLIP 分类得分最高的类型和相似案例中出现的类型，
+        每个类型取一个示例（排除已作为相似案例提供的案例），类型不足时从排名靠前的类型补足。
+        """
+        if count <= 0:
+            return []
+        try:
+            scores = (classification or {}).get('all_scores') or {}
+            candidate_types = sorted(scores, key=scores.get, reverse=True)[:count]
+            for case in similar_cases or []:
+                if case.get('type') and case['type'] not in candidate_types:
+                    candidate_types.append(case['type'])
+            if not candidate_types:
+                return self.get_random_examples(count)
+
+            exclude = {case.get('_id') for case in similar_cases or []}
+            pools = {}
+            for hazard_type in candidate_types:
+                pool = [case for case in self._get_type_pool(hazard_type) if case['_id'] not in exclude]
+                random.shuffle(pool)
+                pools[hazard_type] = pool
+
+            # 先保证类型多样，再按类型排名轮流补足
+            examples = []
+            while len(examples) < count and any(pools.values()):
+                for hazard_type in candidate_types:
+                    if pools[hazard_type] and len(examples) < count:
+                        examples.append(pools[hazard_type].pop())
+            return examples
+        except Exception as e:
+            print(f"选择few-shot示例失败: {e}")
+            return []
@@ -0,0 +1,152 @@
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from pymongo import MongoClient, monitoring
+from pymongo.errors import DuplicateKeyError
+from config import Config
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """统计连接池事件：创建/关闭的连接数、借出/归还次数和获取连接失败次数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            'pools_created': 0,
+            'connections_created': 0,
+            'connections_closed': 0,
+            'checked_out': 0,
+            'checked_in': 0,
+            'checkout_failed': 0,
+        }
+
+    def _inc(self, key: str):
+        with self._lock:
+            self.counters[key] += 1
+
+    def pool_created(self, event):
+        self._inc('pools_created')
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._inc('connections_created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc('connections_closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._inc('checkout_failed')
+
+    def connection_checked_out(self, event):
+        self._inc('checked_out')
+
+    def connection_checked_in(self, event):
+        self._inc('checked_in')
+
+    def stats(self) -> Dict:
+        with self._lock:
+            data = dict(self.counters)
+        data['open_connections'] = data['connections_created'] - data['connections_closed']
+        data['in_use'] = data['checked_out'] - data['checked_in']
+        return data
+
+
+def _write_concern(value: str):
+    return int(value) if str(value).isdigit() else value
+
+
+_client = None
+_client_lock = threading.Lock()
+_pool_listener = PoolStatsListener()
+
+
+def get_mongo_client() -> MongoClient:
+    """获取进程内共享的 MongoClient（所有服务和蓝图共用一个连接池）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    Config.MONGODB_URI,
+                    maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=Config.MONGO_MAX_IDLE_TIME_MS,
+                    waitQueueTimeoutMS=Config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=Config.MONGO_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=Config.MONGO_SOCKET_TIMEOUT_MS,
+                    readPreference=Config.MONGO_READ_PREFERENCE,
+                    w=_write_concern(Config.MONGO_WRITE_CONCERN),
+                    appname=Config.MONGO_APP_NAME,
+                    event_listeners=[_pool_listener],
+                )
+    return _client
+
+
+def get_db():
+    """获取共享连接上的业务数据库"""
+    return get_mongo_client()[Config.DATABASE_NAME]
+
+
+def lease_owner() -> str:
+    """当前进程/线程的租约持有者标识"""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def acquire_lease(db, name: str, ttl: float, owner: Optional[str] = None) -> bool:
+    """在 locks 集合中获取跨进程租约，已被其他持有者占用且未过期时返回 False
+
+    租约到期后自动失效，持有者异常退出也不会永久占用。
+    """
+    owner = owner or lease_owner()
+    now = datetime.utcnow()
+    try:
+        db.locks.find_one_and_update(
+            {'_id': name, '$or': [{'expires_at': {'$lt': now}}, {'owner': owner}]},
+            {'$set': {'owner': owner, 'expires_at': now + timedelta(seconds=ttl)}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # 文档已存在但条件不满足（他人持有且未过期），upsert 插入同一 _id 失败
+        return False
+
+
+def release_lease(db, name: str, owner: Optional[str] = None):
+    """释放自己持有的租约"""
+    db.locks.delete_one({'_id': name, 'owner': owner or lease_owner()})
+
+
+def pool_stats() -> Dict:
+    """返回 MongoDB 连接池配置和连接事件统计"""
+    return {
+        'config': {
+            'max_pool_size': Config.MONGO_MAX_POOL_SIZE,
+            'min_pool_size': Config.MONGO_MIN_POOL_SIZE,
+            'max_idle_time_ms': Config.MONGO_MAX_IDLE_TIME_MS,
+            'wait_queue_timeout_ms': Config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            'server_selection_timeout_ms': Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            'connect_timeout_ms': Config.MONGO_CONNECT_TIMEOUT_MS,
+            'socket_timeout_ms': Config.MONGO_SOCKET_TIMEOUT_MS,
+            'read_preference': Config.MONGO_READ_PREFERENCE,
+            'write_concern': Config.MONGO_WRITE_CONCERN,
+        },
+        'client_created': _client is not None,
+        'pool': _pool_listener.stats(),
+    }
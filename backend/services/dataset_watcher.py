@@ -0,0 +1,68 @@
+import os
+import threading
+from typing import Dict, Optional
+from config import Config
+from services.case_index import get_shared_case_index
+
+
+class DatasetWatcher:
+    """后台轮询数据集目录，发现新增、修改或删除的图片时增量同步到案例库
+
+    每次只比较目录中文件的大小和修改时间，没有变化时不访问数据库；
+    同步结果直接应用到进程内共享的案例索引，无需重启服务。
+    """
+
+    def __init__(self, interval: Optional[float] = None, image_folder: Optional[str] = None):
+        self.interval = interval or Config.DATASET_WATCH_INTERVAL
+        self.image_folder = image_folder or Config.DATASET_PATH
+        self._signature = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_stats = None
+
+    def _scan_signature(self) -> Optional[Dict]:
+        if not os.path.isdir(self.image_folder):
+            return None
+        with os.scandir(self.image_folder) as entries:
+            return {
+                entry.name: (entry.stat().st_size, entry.stat().st_mtime)
+                for entry in entries
+                if entry.is_file()
+            }
+
+    def check_once(self) -> Optional[Dict]:
+        """目录有变化时执行一次增量同步，返回同步统计"""
+        # 延迟导入：database_init 会加载模型注册表等较重的依赖
+        from utils.database_init import sync_dataset
+
+        signature = self._scan_signature()
+        if signature is None or signature == self._signature:
+            return None
+        case_index = get_shared_case_index()
+        stats = sync_dataset(db=case_index.db, case_index=case_index)
+        if stats is not None and not stats['errors']:
+            # 有错误时保留旧签名，下次轮询重试
+            self._signature = signature
+        self.last_stats = stats
+        return stats
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check_once()
+            except Exception as e:
+                print(f"⚠️  数据集目录同步失败: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='dataset-watcher', daemon=True)
+        self._thread.start()
+        print(f"👀 已开始监控数据集目录: {self.image_folder}（间隔 {self.interval}s）")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
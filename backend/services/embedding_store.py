@@ -0,0 +1,89 @@
+import numpy as np
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+from pymongo import UpdateOne
+from config import Config
+from services.database import get_db
+from utils.feature_codec import decode_features, encode_features
+from utils.lru_cache import TTLCache
+
+
+class EmbeddingStore:
+    """按图片内容哈希保存 CLIP 图片特征
+
+    进程内 LRU 在前，MongoDB image_embeddings 集合在后；
+    文档以 (内容哈希, CLIP 模型名) 区分，更换模型后旧特征不会被误用。
+    """
+
+    def __init__(self, db=None, model_name: Optional[str] = None):
+        if db is None:
+            db = get_db()
+        self.collection = db.image_embeddings
+        self.model_name = model_name or Config.CLIP_MODEL_NAME
+        self.local_cache = TTLCache(Config.EMBEDDING_CACHE_SIZE)
+        try:
+            self.collection.create_index([("image_hash", 1), ("model", 1)], unique=True)
+        except Exception as e:
+            print(f"⚠️  创建特征存储索引失败: {e}")
+
+    def get_many(self, image_hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """批量读取特征，返回 {image_hash: 一维 float32 向量}，不存在的哈希不出现在结果中"""
+        found = {}
+        missing = []
+        for image_hash in set(image_hashes):
+            vector = self.local_cache.get(image_hash, None)
+            if vector is None:
+                missing.append(image_hash)
+            else:
+                found[image_hash] = vector
+        if not missing:
+            return found
+        try:
+            cursor = self.collection.find(
+                {'image_hash': {'$in': missing}, 'model': self.model_name},
+                {'_id': 0, 'image_hash': 1, 'features': 1, 'features_format': 1, 'features_dim': 1},
+            )
+            for doc in cursor:
+                vector = decode_features(doc)
+                if vector is None:
+                    continue
+                self.local_cache.set(doc['image_hash'], vector)
+                found[doc['image_hash']] = vector
+        except Exception as e:
+            print(f"⚠️  读取图片特征失败: {e}")
+        return found
+
+    def get(self, image_hash: str) -> Optional[np.ndarray]:
+        return self.get_many([image_hash]).get(image_hash)
+
+    def put_many(self, vectors: Dict[str, np.ndarray]):
+        """批量写入特征（已存在的哈希只刷新最后使用时间）"""
+        if not vectors:
+            return
+        now = datetime.now()
+        operations = []
+        for image_hash, vector in vectors.items():
+            vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+            self.local_cache.set(image_hash, vector)
+            operations.append(UpdateOne(
+                {'image_hash': image_hash, 'model': self.model_name},
+                {
+                    '$setOnInsert': {**encode_features(vector), 'created_at': now},
+                    '$set': {'last_used_at': now},
+                },
+                upsert=True,
+            ))
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            print(f"⚠️  保存图片特征失败: {e}")
+
+    def put(self, image_hash: str, vector: np.ndarray):
+        self.put_many({image_hash: vector})
+
+    def stats(self) -> Dict:
+        try:
+            total = self.collection.estimated_document_count()
+        except Exception:
+            total = None
+        return {'model': self.model_name, 'stored': total, 'local': self.local_cache.stats()}
@@ -1,26 +1,36 @@
 import os
 import json
 import base64
-import re
+import numpy as np
 from datetime import datetime
-from typing import Dict, List, Tuple, Optional
-from services.tfidf_similarity_service import TfidfSimilarityService
-from services.clip_service import CLIPService
-from services.llm_service import LLMService
-from services.bert_similarity_service import BertSimilarityService
-from utils.image_processor import ImageProcessor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Tuple, Optional, Union
+from services.llm_service import LLMService, clean_llm_output
+from services.model_registry import ModelRegistry, get_model_registry
+from utils.content_hash import compute_content_hash
+from services.cascade_policy import CascadePolicy
 from config import Config
 
 
 class HazardAnalyzer:
     """隐患分析器 - 整合CLIP模型、LLM服务和相似案例检索"""
 
-    def __init__(self, llm_service: LLMService):
+    def __init__(self, llm_service: LLMService, registry: Optional[ModelRegistry] = None):
         self.llm_service = llm_service
-        self.clip_service = CLIPService()
-        self.image_processor = ImageProcessor()
-        self.bert_similarity = BertSimilarityService()  # 初始化BERT相似度服务
-        self.tfidf_similarity = TfidfSimilarityService()
+        # 模型统一从进程内注册表获取，每个进程只加载一次
+        registry = registry or get_model_registry()
+        self.clip_service = registry.get_clip_service()
+        self.image_processor = registry.get_image_processor()
+        self.bert_similarity = registry.get_bert_similarity()  # BERT相似度服务
+        self.tfidf_similarity = registry.get_tfidf_similarity()
+        self.cascade_policy = CascadePolicy()
+        # 按内容哈希复用的 CLIP 图片特征
+        self.embedding_store = None
+        if Config.EMBEDDING_STORE_ENABLED:
+            try:
+                self.embedding_store = registry.get_embedding_store()
+            except Exception as e:
+                print(f"⚠️  特征存储不可用，将每次重新编码: {e}")
 
         # 隐患类型映射
         self.hazard_types = {
@@ -47,63 +57,69 @@ class HazardAnalyzer:
         top_k: int = 5,
         few_shot_count: int = 3,
         provider: str = "gemini",
+        image_hash: Optional[str] = None,
     ) -> Dict:
-        """分析隐患图片，可指定 provider=gemini/gpt4o"""
+        """分析隐患图片（路径或内存中的图片字节），可指定 provider=gemini/gpt4o
+
+        image_hash 为图片内容的 MD5，已知时传入可避免重复计算。
+        """
         try:
-            print(f"🔍 开始分析图片: {image_path}")
+            if isinstance(image_path, str):
+                print(f"🔍 开始分析图片: {image_path}")
+            else:
+                print(f"🔍 开始分析内存图片: {len(image_path)} 字节")
+
+            # 内容哈希用于复用特征和图片负载
+            image_hash = image_hash or compute_content_hash(image_path)
 
             # 1. 处理图片
             processed_image = self.image_processor.process_image(image_path)
 
-            # 2. CLIP 直接分类
-            direct_classification = self.clip_service.classify_hazard(processed_image)
+            # 2. CLIP 编码一次，分类和检索共用同一份特征
+            image_features = self._get_image_features(image_path, processed_image, image_hash)
+
+            # 3. CLIP 直接分类
+            direct_classification = self.clip_service.classify_hazard(
+                processed_image, image_features=image_features
+            )
             print(
                 f"✅ CLIP直接分类结果: 类型 {direct_classification['type']}, 置信度 {direct_classification['confidence']:.3f}"
             )
 
-            # 3. 检索相似案例
+            # 4. 检索相似案例
             similar_cases = self.clip_service.find_similar_cases(
-                processed_image, top_k=top_k
+                processed_image, top_k=top_k, image_features=image_features
             )
             print(f"📋 找到 {len(similar_cases)} 个相似案例")
 
-            # 4. Few-shot 示例
-            few_shot_examples = self.clip_service.get_random_examples(
-                count=few_shot_count
+            # CLIP 与相似案例足够一致时直接返回，不调用 LLM
+            decision = self.cascade_policy.decide(direct_classification, similar_cases)
+            if decision["skip_llm"]:
+                final_result = self._build_cascade_result(
+                    direct_classification, similar_cases, decision, provider
+                )
+                print(f"⚡ 级联判定跳过LLM: 类型 {final_result['type']}, 投票占比 {decision['vote_share']:.2f}")
+                return final_result
+
+            # 5. Few-shot 示例
+            few_shot_examples = self.clip_service.select_examples(
+                direct_classification, similar_cases, count=few_shot_count
             )
             print(f"🎯 获取 {len(few_shot_examples)} 个Few-shot示例")
 
-            # 5. 图片转 base64
-            image_base64 = self.image_processor.image_to_base64(processed_image)
+            # 6. 按 provider 生成图片负载（对冲请求按备用 provider 的配置另行生成）
+            image_payload = self._llm_payload_factory(image_path, image_hash, processed_image)
 
-            # 6. 调用 LLM（可切换模型）
-            enhanced_result = self.llm_service.generate_hazard_analysis(
-                image_base64=image_base64,
+            # 7. 调用 LLM（可切换模型），整合结果
+            final_result = self._analyze_with_llm(
+                image_base64=image_payload,
+                direct_classification=direct_classification,
                 similar_cases=similar_cases,
                 few_shot_examples=few_shot_examples,
                 provider=provider,
             )
-            print("#####################llm输出结果########################")
-            print(enhanced_result)
-            
-            # 清理 markdown 代码块标记
-            cleaned_result = enhanced_result.strip()
-            # 删除 ```json 或 ``` 开头的标记
-            cleaned_result = re.sub(r'^```(?:json)?\s*\n?', '', cleaned_result)
-            # 删除结尾的 ``` 标记
-            cleaned_result = re.sub(r'\n?```\s*$', '', cleaned_result)
-            cleaned_result = cleaned_result.strip()
-            
-            print("#####################清理后的llm输出结果########################")
-            print(cleaned_result)
-
-            # 7. 整合结果（带上 model）
-            final_result = self._integrate_results(
-                direct_classification=direct_classification,
-                enhanced_result=cleaned_result,
-                similar_cases=similar_cases,
-                model=provider,
-            )
+            final_result["decision_path"] = "llm"
+            final_result["cascade"] = decision
 
             print(
                 f"🎉 分析完成: 类型 {final_result['type']}, 置信度 {final_result['confidence']:.3f}, BERT相似度 {final_result.get('bert_similarity', 0.0):.4f}"
@@ -116,14 +132,112 @@ class HazardAnalyzer:
             traceback.print_exc()
             return self._create_error_result(str(e), model=provider)
 
+    def _get_image_features(self, image_source, processed_image, image_hash: Optional[str] = None):
+        """获取图片的 CLIP 特征：优先从特征存储读取，未命中时编码并写回
+
+        编码失败时返回 None，由分类和检索各自降级处理。
+        """
+        store = self.embedding_store
+        try:
+            if store is not None:
+                image_hash = image_hash or compute_content_hash(image_source)
+                vector = store.get(image_hash)
+                if vector is not None:
+                    print(f"⚡ 复用已保存的图片特征 (hash: {image_hash[:8]}...)")
+                    return self.clip_service.features_from_numpy(vector[None, :])
+            image_features = self.clip_service.encode_image(processed_image)
+            if store is not None:
+                store.put(image_hash, image_features[0].float().cpu().numpy())
+            return image_features
+        except Exception as e:
+            print(f"⚠️  图片特征编码失败: {e}")
+            return None
+
+    def _llm_payload_factory(self, image_source, image_hash: Optional[str], processed_image):
+        """返回 provider -> base64 图片负载的函数，主请求和对冲请求各按自己的尺寸和字节预算生成"""
+        def build(provider: str) -> str:
+            return self.image_processor.prepare_llm_payload(
+                image_source, provider, image_hash=image_hash, processed_image=processed_image
+            )
+        return build
+
+    def _build_cascade_result(self, direct_classification: Dict, similar_cases: List,
+                              decision: Dict, provider: str, score: bool = True) -> Dict:
+        """用相似案例的描述和默认整改建议构建结果（跳过 LLM 时使用）"""
+        hazard_type = decision["type"]
+        neighbour = next(
+            (case for case in similar_cases if case.get("type") == hazard_type), {}
+        )
+        result = self._integrate_results(
+            direct_classification=direct_classification,
+            enhanced_result={
+                "type": hazard_type,
+                "description": neighbour.get("description") or direct_classification["description"],
+                "suggestion": self._get_default_suggestion(hazard_type),
+                "confidence": decision["vote_share"],
+            },
+            similar_cases=similar_cases,
+            model=provider,
+            score=score,
+        )
+        result["analysis_method"] = "CLIP + Retrieval Cascade"
+        result["decision_path"] = "cascade"
+        result["cascade"] = decision
+        return result
+
+    def _analyze_with_llm(
+        self,
+        image_base64: Union[str, Callable[[str], str]],
+        direct_classification: Dict,
+        similar_cases: List,
+        few_shot_examples: List,
+        provider: str,
+        score: bool = True,
+    ) -> Dict:
+        """调用 LLM 并将其输出与 CLIP 分类、相似案例整合
+
+        image_base64 为 base64 字符串或 provider -> base64 的函数（见 _llm_payload_factory）；
+        score=False 时不计算 BERT/TF-IDF 相似度，由调用方用 _score_results 批量计算。
+        """
+        llm_response = self.llm_service.generate_hazard_analysis_detailed(
+            image_base64=image_base64,
+            similar_cases=similar_cases,
+            few_shot_examples=few_shot_examples,
+            provider=provider,
+        )
+        enhanced_result = llm_response["content"]
+        print("#####################llm输出结果########################")
+        print(enhanced_result)
+        
+        # 清理 markdown 代码块标记
+        cleaned_result = clean_llm_output(enhanced_result)
+        
+        print("#####################清理后的llm输出结果########################")
+        print(cleaned_result)
+
+        # 整合结果（带上 model）
+        result = self._integrate_results(
+            direct_classification=direct_classification,
+            enhanced_result=cleaned_result,
+            similar_cases=similar_cases,
+            model=provider,
+            score=score,
+        )
+        result["llm_latency"] = round(llm_response["elapsed"], 3)
+        if llm_response["provider"] != provider:
+            # 对冲请求胜出时记录实际作答的模型
+            result["answered_by"] = llm_response["provider"]
+        return result
+
     def _integrate_results(
         self,
         direct_classification: Dict,
         enhanced_result: str,
         similar_cases: List,
         model: str,
+        score: bool = True,
     ) -> Dict:
-        """整合直接分类和增强分析结果"""
+        """整合直接分类和增强分析结果，score=True 时计算 BERT/TF-IDF 相似度"""
         try:
             enhanced_data = None
             
@@ -176,32 +290,8 @@ class HazardAnalyzer:
                     "created_at": datetime.now().isoformat(),
                 }
 
-            # 计算BERT相似度（对所有结果都计算）
-            hazard_type = result["type"]
-            generated_desc = result["description"]
-            
-            try:
-                similarity, standard_desc = self.bert_similarity.calculate_similarity(
-                    generated_desc, hazard_type
-                )
-                result["bert_similarity"] = similarity
-                result["standard_description"] = standard_desc
-                print(f"📊 BERT相似度: {similarity:.4f} (类型 {hazard_type})")
-            except Exception as e:
-                print(f"⚠️  计算BERT相似度失败: {e}")
-                result["bert_similarity"] = 0.0
-                result["standard_description"] = ""
-            # 添加 TF-IDF 相似度计算
-            try:
-                tfidf_sim, _ = self.tfidf_similarity.calculate_similarity(
-                    generated_desc, hazard_type
-                )
-                result["tfidf_similarity"] = tfidf_sim
-                print(f"📊 TF-IDF相似度: {tfidf_sim:.4f} (类型 {hazard_type})")
-            except Exception as e:
-                print(f"⚠️  计算TF-IDF相似度失败: {e}")
-                result["tfidf_similarity"] = 0.0
-
+            if score:
+                self._score_results([result])
             return result
 
         except Exception as e:
@@ -226,30 +316,37 @@ class HazardAnalyzer:
             }
             
             # 即使fallback也计算相似度
-            try:
-                hazard_type = result["type"]
-                generated_desc = result["description"]
-                similarity, standard_desc = self.bert_similarity.calculate_similarity(
-                    generated_desc, hazard_type
-                )
-                result["bert_similarity"] = similarity
-                result["standard_description"] = standard_desc
-            except Exception as e:
-                print(f"⚠️  Fallback时计算BERT相似度失败: {e}")
-                result["bert_similarity"] = 0.0
-                result["standard_description"] = ""
-            # 添加 TF-IDF 计算
-            try:
-                tfidf_sim, _ = self.tfidf_similarity.calculate_similarity(
-                    generated_desc, hazard_type
-                )
-                result["tfidf_similarity"] = tfidf_sim
-            except Exception as e:
-                print(f"⚠️  Fallback时计算TF-IDF相似度失败: {e}")
-                result["tfidf_similarity"] = 0.0
-            
+            if score:
+                self._score_results([result])
             return result
 
+    def _score_results(self, results: List[Dict]):
+        """为结果批量计算 BERT 和 TF-IDF 相似度（各一次批量调用），写回 bert_similarity 等字段
+
+        计算失败时对应分数记为 0.0。
+        """
+        pairs = [(result["description"], result["type"]) for result in results]
+        try:
+            scores = self.bert_similarity.calculate_similarities(pairs)
+        except Exception as e:
+            print(f"⚠️  计算BERT相似度失败: {e}")
+            scores = [(0.0, "")] * len(results)
+        for result, (similarity, standard_desc) in zip(results, scores):
+            result["bert_similarity"] = similarity
+            result["standard_description"] = standard_desc
+        try:
+            tfidf_scores = self.tfidf_similarity.calculate_similarities(pairs)
+        except Exception as e:
+            print(f"⚠️  计算TF-IDF相似度失败: {e}")
+            tfidf_scores = [(0.0, "")] * len(results)
+        for result, (tfidf_sim, _) in zip(results, tfidf_scores):
+            result["tfidf_similarity"] = tfidf_sim
+        if len(results) == 1:
+            print(f"📊 BERT相似度: {results[0]['bert_similarity']:.4f}, "
+                  f"TF-IDF相似度: {results[0]['tfidf_similarity']:.4f} (类型 {results[0]['type']})")
+        else:
+            print(f"📊 批量计算 {len(results)} 条结果的 BERT/TF-IDF 相似度")
+
     def _get_default_suggestion(self, hazard_type: str) -> str:
         """获取默认整改建议"""
         suggestions = {
@@ -293,18 +390,188 @@ class HazardAnalyzer:
             "standard_description": "",
         }
 
-    def batch_analyze(self, image_paths: List[str], top_k: int = 5) -> List[Dict]:
-        """批量分析多张图片"""
-        results = []
-        for i, image_path in enumerate(image_paths, 1):
-            print(f"🔄 批量分析进度: {i}/{len(image_paths)} - {image_path}")
-            try:
-                result = self.analyze_hazard(image_path, top_k=top_k)
-                results.append(result)
-            except Exception as e:
-                error_result = self._create_error_result(str(e))
-                error_result["image_path"] = image_path
-                results.append(error_result)
+    def _prepare_batch_item(self, image_path: str, image_hash: Optional[str] = None):
+        """批量分析的预处理：读取图片、计算内容哈希并生成 CLIP 输入张量"""
+        if self.embedding_store is not None and image_hash is None:
+            image_hash = compute_content_hash(image_path)
+        processed_image = self.image_processor.process_image(image_path)
+        return processed_image, self.clip_service.preprocess(processed_image), image_hash
+
+    def _encode_batch_features(self, prepared: Dict, indices: List[int]):
+        """批量获取特征：已保存的直接读取，只对未命中的图片做一次 CLIP 批量编码"""
+        store = self.embedding_store
+        if store is None:
+            return self.clip_service.encode_preprocessed([prepared[i][1] for i in indices])
+
+        stored = store.get_many(prepared[i][2] for i in indices)
+        missing = [i for i in indices if prepared[i][2] not in stored]
+        if missing:
+            encoded = self.clip_service.encode_preprocessed(
+                [prepared[i][1] for i in missing]
+            ).float().cpu().numpy()
+            new_vectors = {prepared[i][2]: vector for i, vector in zip(missing, encoded)}
+            store.put_many(new_vectors)
+            stored.update(new_vectors)
+        print(f"⚡ 批量特征: 复用 {len(indices) - len(missing)} 个, 新编码 {len(missing)} 个")
+        return self.clip_service.features_from_numpy(
+            np.stack([stored[prepared[i][2]] for i in indices])
+        )
+
+    def iter_batch_analyze(
+        self,
+        image_paths: List[str],
+        top_k: int = 5,
+        few_shot_count: int = 3,
+        provider: str = "gemini",
+        max_workers: Optional[int] = None,
+        llm_concurrency: Optional[int] = None,
+        image_hashes: Optional[List[Optional[str]]] = None,
+        window_size: Optional[int] = None,
+    ) -> Iterator[Tuple[int, Dict]]:
+        """批量分析多张图片（路径或图片字节），按完成顺序逐个产出 (输入序号, 结果)
+
+        图片按 window_size（默认 CLIP_BATCH_SIZE）分窗口处理：每个窗口在线程池中并行预处理，
+        已保存特征的图片直接复用，其余由 CLIP 对堆叠后的张量一次编码，分类和检索各为一次矩阵运算，
+        LLM 请求按 llm_concurrency 并发发送，窗口内的描述再一次批量计算 BERT/TF-IDF 相似度；
+        失败的图片立即产出，成功的结果在相似度计算后产出，窗口结果全部产出后才处理下一窗口，
+        解码后的图片和张量随窗口释放，内存占用不随批量大小增长。
+        单张图片失败时产出带 error 字段的结果，不影响其他图片。
+        """
+        max_workers = max_workers or Config.BATCH_PREPROCESS_WORKERS
+        llm_concurrency = llm_concurrency or Config.LLM_MAX_CONCURRENCY
+        window_size = max(1, window_size or Config.CLIP_BATCH_SIZE)
+
+        for start in range(0, len(image_paths), window_size):
+            yield from self._iter_batch_window(
+                image_paths, range(start, min(start + window_size, len(image_paths))),
+                top_k, few_shot_count, provider, max_workers, llm_concurrency, image_hashes,
+            )
+
+    def _iter_batch_window(self, image_paths, window, top_k, few_shot_count, provider,
+                           max_workers, llm_concurrency, image_hashes):
+        """处理一个窗口内的图片：预处理、编码、检索、LLM，按完成顺序产出 (输入序号, 结果)"""
+
+        def with_path(index, result):
+            # 只有路径输入才回填 image_path，内存字节不放进结果
+            if isinstance(image_paths[index], str):
+                result["image_path"] = image_paths[index]
+            return index, result
+
+        def error_result(index, error):
+            return with_path(index, self._create_error_result(str(error), model=provider))
+
+        # 1. 并行预处理
+        prepared = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(
+                    self._prepare_batch_item, path, image_hashes[i] if image_hashes else None
+                ): i
+                for i, path in ((i, image_paths[i]) for i in window)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    prepared[index] = future.result()
+                except Exception as e:
+                    print(f"❌ 批量预处理失败: 第 {index + 1} 张 - {e}")
+                    yield error_result(index, e)
+
+        if not prepared:
+            return
+        indices = sorted(prepared)
+        print(f"🔄 批量分析: 第 {window.start + 1}-{window.stop} 张中 {len(indices)} 张预处理完成")
+
+        # 2. CLIP 批量编码、分类与检索
+        try:
+            features = self._encode_batch_features(prepared, indices)
+            classifications = self.clip_service.classify_features(features)
+            similar_cases_batch = self.clip_service.find_similar_cases_batch(
+                features, top_k=top_k
+            )
+        except Exception as e:
+            print(f"❌ 批量编码失败: {e}")
+            for index in indices:
+                yield error_result(index, e)
+            return
+
+        # 3. 并发调用 LLM（级联判定足够可信的图片直接返回）
+        def analyze_one(position):
+            decision = self.cascade_policy.decide(
+                classifications[position], similar_cases_batch[position]
+            )
+            if decision["skip_llm"]:
+                return self._build_cascade_result(
+                    classifications[position], similar_cases_batch[position], decision, provider,
+                    score=False,
+                )
+            processed_image, _, image_hash = prepared[indices[position]]
+            few_shot_examples = self.clip_service.select_examples(
+                classifications[position],
+                similar_cases_batch[position],
+                count=few_shot_count,
+            )
+            image_payload = self._llm_payload_factory(
+                image_paths[indices[position]], image_hash, processed_image
+            )
+            result = self._analyze_with_llm(
+                image_base64=image_payload,
+                direct_classification=classifications[position],
+                similar_cases=similar_cases_batch[position],
+                few_shot_examples=few_shot_examples,
+                provider=provider,
+                score=False,
+            )
+            result["decision_path"] = "llm"
+            result["cascade"] = decision
+            return result
+
+        completed = []
+        with ThreadPoolExecutor(max_workers=llm_concurrency) as pool:
+            futures = {
+                pool.submit(analyze_one, position): index
+                for position, index in enumerate(indices)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    completed.append((index, future.result()))
+                except Exception as e:
+                    print(f"❌ 批量分析失败: 第 {index + 1} 张 - {e}")
+                    yield error_result(index, e)
+
+        # 4. 窗口内所有描述一次批量计算 BERT/TF-IDF 相似度
+        if completed:
+            self._score_results([result for _, result in completed])
+        for index, result in completed:
+            yield with_path(index, result)
+
+    def batch_analyze(
+        self,
+        image_paths: List[str],
+        top_k: int = 5,
+        few_shot_count: int = 3,
+        provider: str = "gemini",
+        max_workers: Optional[int] = None,
+        llm_concurrency: Optional[int] = None,
+        image_hashes: Optional[List[Optional[str]]] = None,
+    ) -> List[Dict]:
+        """批量分析多张图片，结果按输入顺序返回"""
+        results = [None] * len(image_paths)
+        for done, (index, result) in enumerate(
+            self.iter_batch_analyze(
+                image_paths,
+                top_k=top_k,
+                few_shot_count=few_shot_count,
+                provider=provider,
+                max_workers=max_workers,
+                llm_concurrency=llm_concurrency,
+                image_hashes=image_hashes,
+            ),
+            1,
+        ):
+            print(f"🔄 批量分析进度: {done}/{len(image_paths)} - 第 {index + 1} 张")
+            results[index] = result
         return results
 
     def get_analysis_statistics(self) -> Dict:
@@ -0,0 +1,332 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+from pymongo import ReturnDocument
+from config import Config
+from services.database import get_db
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+def _is_stale(job: Dict, stale_before: datetime) -> bool:
+    """running 任务的心跳（旧任务没有心跳时用开始时间）早于 stale_before 即视为中断"""
+    last_seen = job.get('heartbeat_at') or job.get('started_at')
+    return job['status'] == JOB_RUNNING and last_seen is not None and last_seen < stale_before
+
+
+class MemoryJobStore:
+    """进程内任务存储（不跨进程、不跨重启，适合本地调试）"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: Dict, max_pending: Optional[int] = None) -> bool:
+        """写入任务；给定 max_pending 时未完成任务已达上限则不写入并返回 False"""
+        with self._lock:
+            if max_pending is not None and sum(
+                1 for existing in self._jobs.values() if existing['status'] not in FINISHED_STATUSES
+            ) >= max_pending:
+                return False
+            self._jobs[job['_id']] = dict(job)
+            return True
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id: str, fields: Dict):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def finish(self, job_id: str, worker_id: str, fields: Dict) -> bool:
+        """只有仍由 worker_id 持有的 running 任务才写入结束状态"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job['status'] != JOB_RUNNING or job.get('worker') != worker_id:
+                return False
+            job.update(fields)
+            return True
+
+    def claim(self, job_id: str, worker_id: str) -> Optional[Dict]:
+        """原子地将 queued 任务标记为 running，失败返回 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job['status'] != JOB_QUEUED:
+                return None
+            now = datetime.now()
+            job.update({
+                'status': JOB_RUNNING,
+                'worker': worker_id,
+                'started_at': now,
+                'heartbeat_at': now,
+                'attempts': job.get('attempts', 0) + 1,
+            })
+            return dict(job)
+
+    def heartbeat(self, job_ids: Iterable[str], worker_id: str) -> int:
+        now = datetime.now()
+        count = 0
+        with self._lock:
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job and job['status'] == JOB_RUNNING and job.get('worker') == worker_id:
+                    job['heartbeat_at'] = now
+                    count += 1
+        return count
+
+    def requeue_stale(self, stale_before: datetime) -> int:
+        count = 0
+        with self._lock:
+            for job in self._jobs.values():
+                if _is_stale(job, stale_before):
+                    job['status'] = JOB_QUEUED
+                    count += 1
+        return count
+
+    def find_queued(self) -> List[Dict]:
+        with self._lock:
+            return [dict(job) for job in self._jobs.values() if job['status'] == JOB_QUEUED]
+
+    def count_pending(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] not in FINISHED_STATUSES)
+
+
+class MongoJobStore:
+    """MongoDB 任务存储，任务状态在 worker 重启后仍然保留"""
+
+    def __init__(self, db=None):
+        if db is None:
+            db = get_db()
+        self.collection = db.analysis_jobs
+        self.collection.create_index([("status", 1), ("created_at", 1)])
+        self.collection.create_index([("status", 1), ("heartbeat_at", 1)])
+        self.collection.create_index("finished_at", expireAfterSeconds=Config.JOB_RESULT_TTL)
+
+    def create(self, job: Dict, max_pending: Optional[int] = None) -> bool:
+        """写入任务；给定 max_pending 时先写入再计数，超过上限则删除自己并返回 False
+
+        多个进程同时提交时可能都被拒绝，但未完成任务数不会超过上限。
+        """
+        self.collection.insert_one(dict(job))
+        if max_pending is not None and self.count_pending() > max_pending:
+            self.collection.delete_one({'_id': job['_id']})
+            return False
+        return True
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.collection.find_one({'_id': job_id})
+
+    def update(self, job_id: str, fields: Dict):
+        self.collection.update_one({'_id': job_id}, {'$set': fields})
+
+    def finish(self, job_id: str, worker_id: str, fields: Dict) -> bool:
+        """只有仍由 worker_id 持有的 running 任务才写入结束状态"""
+        result = self.collection.update_one(
+            {'_id': job_id, 'status': JOB_RUNNING, 'worker': worker_id},
+            {'$set': fields},
+        )
+        return result.modified_count == 1
+
+    def claim(self, job_id: str, worker_id: str) -> Optional[Dict]:
+        now = datetime.now()
+        return self.collection.find_one_and_update(
+            {'_id': job_id, 'status': JOB_QUEUED},
+            {
+                '$set': {'status': JOB_RUNNING, 'worker': worker_id, 'started_at': now, 'heartbeat_at': now},
+                '$inc': {'attempts': 1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def heartbeat(self, job_ids: Iterable[str], worker_id: str) -> int:
+        job_ids = list(job_ids)
+        if not job_ids:
+            return 0
+        result = self.collection.update_many(
+            {'_id': {'$in': job_ids}, 'status': JOB_RUNNING, 'worker': worker_id},
+            {'$set': {'heartbeat_at': datetime.now()}},
+        )
+        # 同一毫秒内重复写入时 modified_count 为 0，按匹配数返回仍持有的任务数
+        return result.matched_count
+
+    def requeue_stale(self, stale_before: datetime) -> int:
+        result = self.collection.update_many(
+            {'status': JOB_RUNNING, '$or': [
+                {'heartbeat_at': {'$lt': stale_before}},
+                {'heartbeat_at': {'$exists': False}, 'started_at': {'$lt': stale_before}},
+            ]},
+            {'$set': {'status': JOB_QUEUED}},
+        )
+        return result.modified_count
+
+    def find_queued(self) -> List[Dict]:
+        return list(self.collection.find({'status': JOB_QUEUED}).sort('created_at', 1))
+
+    def count_pending(self) -> int:
+        return self.collection.count_documents({'status': {'$in': [JOB_QUEUED, JOB_RUNNING]}})
+
+
+def create_job_store():
+    """按配置创建任务存储"""
+    if Config.JOB_STORE == 'memory':
+        return MemoryJobStore()
+    return MongoJobStore()
+
+
+class JobQueue:
+    """异步分析任务队列
+
+    任务先写入存储再交给有界线程池执行；runner 接收任务文档并返回结果字典，
+    可替换为使用假 LLM 的实现以便本地测试。
+    执行中的任务定期写入心跳；后台监控线程把心跳超过 JOB_STALE_SECONDS 的任务
+    （所在进程已退出）重新排队，并领取其他进程留下的排队任务。
+    """
+
+    def __init__(self, runner: Callable[[Dict], Dict], store=None, max_workers: Optional[int] = None):
+        self.runner = runner
+        self.store = store if store is not None else create_job_store()
+        self.max_workers = max_workers or Config.JOB_MAX_WORKERS
+        # 每个进程实例唯一，重启后的同名进程不会被当作旧任务的持有者
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='analysis-job')
+        self._events = {}
+        self._events_lock = threading.Lock()
+        self._running = set()
+        self._stop = threading.Event()
+        self._monitor = None
+
+    def start(self) -> int:
+        """恢复中断的任务并启动后台监控线程，返回本次领取的排队任务数量"""
+        recovered = self.recover()
+        if self._monitor is None or not self._monitor.is_alive():
+            self._stop.clear()
+            self._monitor = threading.Thread(target=self._monitor_loop, name='job-monitor', daemon=True)
+            self._monitor.start()
+        return recovered
+
+    def stop(self):
+        self._stop.set()
+        if self._monitor is not None:
+            self._monitor.join(timeout=Config.JOB_HEARTBEAT_INTERVAL)
+
+    def recover(self) -> int:
+        """把心跳超时的任务重新排队，并分派尚未在本进程排队的任务"""
+        stale_before = datetime.now() - timedelta(seconds=Config.JOB_STALE_SECONDS)
+        requeued = self.store.requeue_stale(stale_before)
+        with self._events_lock:
+            local = set(self._events)
+            capacity = self.max_workers - len(local)
+        queued = [job for job in self.store.find_queued() if job['_id'] not in local][:max(0, capacity)]
+        for job in queued:
+            self._dispatch(job['_id'])
+        if requeued or queued:
+            print(f"🔄 领取了 {len(queued)} 个排队的分析任务（其中 {requeued} 个心跳超时重排）")
+        return len(queued)
+
+    def _monitor_loop(self):
+        while not self._stop.wait(Config.JOB_HEARTBEAT_INTERVAL):
+            try:
+                with self._events_lock:
+                    running = list(self._running)
+                self.store.heartbeat(running, self.worker_id)
+                self.recover()
+            except Exception as e:
+                print(f"⚠️  任务监控失败: {e}")
+
+    def submit(self, payload: Dict) -> str:
+        """创建任务并排队，队列已满时抛出 RuntimeError"""
+        job_id = uuid.uuid4().hex
+        job = {
+            '_id': job_id,
+            'status': JOB_QUEUED,
+            'payload': payload,
+            'attempts': 0,
+            'created_at': datetime.now(),
+        }
+        if not self.store.create(job, max_pending=Config.JOB_MAX_PENDING):
+            raise RuntimeError('任务队列已满，请稍后重试')
+        self._dispatch(job_id)
+        print(f"📥 已创建分析任务: {job_id}")
+        return job_id
+
+    def _dispatch(self, job_id: str):
+        with self._events_lock:
+            self._events.setdefault(job_id, threading.Event())
+        self._executor.submit(self._execute, job_id)
+
+    def _execute(self, job_id: str):
+        job = self.store.claim(job_id, self.worker_id)
+        if job is None:
+            # 已被其他 worker 领取，唤醒等待者改为查询存储
+            with self._events_lock:
+                event = self._events.pop(job_id, None)
+            if event:
+                event.set()
+            return
+        with self._events_lock:
+            self._running.add(job_id)
+        try:
+            result = self.runner(job)
+            fields = {'status': JOB_SUCCEEDED, 'result': result, 'finished_at': datetime.now()}
+            print(f"✅ 分析任务完成: {job_id}")
+        except Exception as e:
+            print(f"❌ 分析任务失败: {job_id}, {e}")
+            fields = {'status': JOB_FAILED, 'error': str(e), 'finished_at': datetime.now()}
+        try:
+            if not self.store.finish(job_id, self.worker_id, fields):
+                # 心跳超时后已被重新排队，由新的持有者写入结果
+                print(f"⚠️  分析任务 {job_id} 已被重新排队，丢弃本次结果")
+        finally:
+            with self._events_lock:
+                self._running.discard(job_id)
+                event = self._events.pop(job_id, None)
+            if event:
+                event.set()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.store.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict]:
+        """长轮询：等待任务结束或超时，返回最新的任务文档"""
+        deadline = time.time() + max(0.0, timeout)
+        with self._events_lock:
+            event = self._events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+
+        # 任务由其他进程执行时，退化为定期查询存储
+        while True:
+            job = self.store.get(job_id)
+            if job is None or job['status'] in FINISHED_STATUSES or time.time() >= deadline:
+                return job
+            time.sleep(min(Config.JOB_POLL_INTERVAL, max(0.0, deadline - time.time())))
+
+
+def serialize_job(job: Dict) -> Dict:
+    """将任务文档转换为接口返回格式"""
+    data = {
+        'job_id': job['_id'],
+        'status': job['status'],
+        'attempts': job.get('attempts', 0),
+    }
+    for key in ('created_at', 'started_at', 'finished_at'):
+        if job.get(key):
+            data[key] = job[key].isoformat()
+    if job['status'] == JOB_SUCCEEDED:
+        data['result'] = job.get('result')
+    elif job['status'] == JOB_FAILED:
+        data['error'] = job.get('error')
+    return data
@@ -0,0 +1,168 @@
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+import httpx
+from openai import OpenAI, APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+from config import Config
+
+# 可重试的错误：网络错误、超时、限流和服务端错误
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+
+
+class LLMClientPool:
+    """按 provider 复用的 OpenAI 客户端池
+
+    每个 provider 只创建一个客户端，共享一个保持长连接的 httpx 连接池，
+    避免每次请求都重新建立 TCP/TLS 连接；请求失败时按指数退避重试，
+    并统计并发数、请求数、重试次数和耗时。
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    @staticmethod
+    def _provider_settings(provider: str):
+        if provider == "gpt4o":
+            return Config.GPT4O_BASE_URL, Config.GPT4O_API_KEY
+        # 默认使用 Gemini（经 OpenRouter）
+        return Config.GEMINI_BASE_URL, Config.GEMINI_API_KEY
+
+    @staticmethod
+    def _provider_key(provider: str) -> str:
+        return "gpt4o" if provider == "gpt4o" else "gemini"
+
+    def _create_client(self, provider: str) -> OpenAI:
+        base_url, api_key = self._provider_settings(provider)
+        http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=Config.LLM_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.LLM_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=Config.LLM_POOL_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                Config.LLM_READ_TIMEOUT,
+                connect=Config.LLM_CONNECT_TIMEOUT,
+            ),
+        )
+        print(f"🔗 创建 {provider} LLM 客户端: {base_url}")
+        return OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            http_client=http_client,
+            # 重试由连接池统一处理，便于配置退避策略和统计
+            max_retries=0,
+        )
+
+    def get_client(self, provider: str) -> OpenAI:
+        """获取 provider 对应的共享客户端（首次调用时创建）"""
+        key = self._provider_key(provider)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._create_client(key)
+                    self._clients[key] = client
+        return client
+
+    def _metric(self, key: str) -> Dict:
+        return self._metrics.setdefault(key, {
+            'requests': 0,
+            'errors': 0,
+            'retries': 0,
+            'in_flight': 0,
+            'peak_in_flight': 0,
+            'total_latency': 0.0,
+        })
+
+    def call(self, provider: str, request_fn: Callable[[OpenAI], object], deadline_at: Optional[float] = None):
+        """使用共享客户端执行请求，可重试错误按指数退避重试
+
+        deadline_at 为截止时间戳，退避等待会超过截止时间时不再重试。
+        """
+        key = self._provider_key(provider)
+        client = self.get_client(key)
+        with self._metrics_lock:
+            metric = self._metric(key)
+            metric['requests'] += 1
+            metric['in_flight'] += 1
+            metric['peak_in_flight'] = max(metric['peak_in_flight'], metric['in_flight'])
+        start = time.time()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return request_fn(client)
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= Config.LLM_MAX_RETRIES:
+                        raise
+                    delay = min(
+                        Config.LLM_RETRY_BACKOFF * (2 ** attempt),
+                        Config.LLM_RETRY_MAX_BACKOFF,
+                    ) * (0.5 + random.random() / 2)
+                    if deadline_at is not None and time.time() + delay >= deadline_at:
+                        raise
+                    attempt += 1
+                    with self._metrics_lock:
+                        metric['retries'] += 1
+                    print(f"⚠️  {key} 请求失败，{delay:.1f}s 后第 {attempt} 次重试: {e}")
+                    time.sleep(delay)
+        except Exception:
+            with self._metrics_lock:
+                metric['errors'] += 1
+            raise
+        finally:
+            with self._metrics_lock:
+                metric['in_flight'] -= 1
+                metric['total_latency'] += time.time() - start
+
+    @staticmethod
+    def _open_connections(client: OpenAI):
+        """尽力读取 httpx 连接池中的连接数（依赖内部实现，失败时返回 None）"""
+        try:
+            return len(client._client._transport._pool.connections)
+        except Exception:
+            return None
+
+    def stats(self) -> Dict:
+        """返回连接池配置和各 provider 的使用统计"""
+        with self._metrics_lock:
+            providers = {}
+            for key, metric in self._metrics.items():
+                data = dict(metric)
+                data['avg_latency'] = (
+                    metric['total_latency'] / metric['requests'] if metric['requests'] else 0.0
+                )
+                providers[key] = data
+        for key, client in list(self._clients.items()):
+            providers.setdefault(key, {})
+            providers[key]['open_connections'] = self._open_connections(client)
+        return {
+            'pool': {
+                'max_connections': Config.LLM_POOL_MAX_CONNECTIONS,
+                'max_keepalive_connections': Config.LLM_POOL_MAX_KEEPALIVE,
+                'keepalive_expiry': Config.LLM_POOL_KEEPALIVE_EXPIRY,
+                'connect_timeout': Config.LLM_CONNECT_TIMEOUT,
+                'read_timeout': Config.LLM_READ_TIMEOUT,
+                'max_retries': Config.LLM_MAX_RETRIES,
+            },
+            'providers': providers,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_llm_client_pool() -> LLMClientPool:
+    """获取进程内共享的 LLM 客户端池"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = LLMClientPool()
+    return _pool
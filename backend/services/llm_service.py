@@ -1,40 +1,52 @@
-from openai import OpenAI
+import json
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Optional
 from config import Config
+from services.llm_client_pool import get_llm_client_pool
+from services.prompt_builder import HAZARD_TYPES, PromptBuilder
+
+
+class LLMCancelled(Exception):
+    """对冲请求中的另一方已胜出"""
+
+
+def clean_llm_output(text: str) -> str:
+    """删除 LLM 输出中的 markdown 代码块标记"""
+    cleaned = (text or "").strip()
+    # 删除 ```json 或 ``` 开头的标记
+    cleaned = re.sub(r'^```(?:json)?\s*\n?', '', cleaned)
+    # 删除结尾的 ``` 标记
+    cleaned = re.sub(r'\n?```\s*$', '', cleaned)
+    return cleaned.strip()
+
+
+def parse_llm_json(text: str) -> Optional[Dict]:
+    """解析 LLM 输出的 JSON 对象，不是有效 JSON 对象时返回 None"""
+    try:
+        data = json.loads(clean_llm_output(text))
+    except (TypeError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
 
 
 class LLMService:
     def __init__(self):
         # 隐患类型映射
-        self.hazard_types = {
-            "1": "未按规定穿戴反光安全服",
-            "2": "高处作业未正确使用安全带",
-            "3": "配电箱未及时锁闭",
-            "4": "未按规定配置灭火器、消防设施等",
-            "5": "现场防护栏等安全防护设施缺失、破损或设置不规范",
-            "6": "设备安全防护设施、装置缺失或失效",
-            "7": "起重吊装设备钢丝绳磨损、断丝严重，搭接长度不足",
-            "8": "汽车吊、随车吊、泵车支腿未全部伸出、未垫枕木进行作业",
-            "9": "基坑支护措施不到位",
-            "10": "灭火器未按规定要求放置",
-            "11": "未按规定设置接地线或接地不良",
-            "12": "安全警示标志标识缺失或设置不规范",
-            "13": "灭火器压力不足，灭火器、消防设施等未按规定进行检查、维护",
-            "14": "不符合“三级配电两级漏电保护、一机一闸一漏一箱”要求",
-            "15": "电缆外皮破损或敷设不规范"
-        }
+        self.hazard_types = HAZARD_TYPES
+        # 按 provider 复用的客户端池（保持长连接）
+        self.client_pool = get_llm_client_pool()
+        self.prompt_builder = PromptBuilder()
+        # 执行各 provider 请求（含对冲请求）的线程池
+        self._executor = ThreadPoolExecutor(
+            max_workers=Config.LLM_POOL_MAX_CONNECTIONS, thread_name_prefix='llm-call'
+        )
 
     def _create_client(self, provider: str):
-        """按 provider 创建对应的 OpenAI 客户端"""
-        if provider == "gpt4o":
-            return OpenAI(
-                base_url=Config.GPT4O_BASE_URL,
-                api_key=Config.GPT4O_API_KEY
-            )
-        # 默认使用 Gemini（经 OpenRouter）
-        return OpenAI(
-            base_url=Config.GEMINI_BASE_URL,
-            api_key=Config.GEMINI_API_KEY
-        )
+        """获取 provider 对应的共享 OpenAI 客户端"""
+        return self.client_pool.get_client(provider)
 
     def _pick_model(self, provider: str) -> str:
         """按 provider 选择模型名称"""
@@ -42,92 +54,172 @@ class LLMService:
             return Config.GPT4O_MODEL
         return Config.GEMINI_MODEL
 
-    def generate_hazard_analysis(self, image_base64, similar_cases, few_shot_examples, provider: str = "gemini"):
-        """多模态分析：图片 + 文本提示"""
-        prompt = self._build_prompt(similar_cases, few_shot_examples)
-        client = self._create_client(provider)
-        model = self._pick_model(provider)
-        try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
+    def _build_messages(self, prompt, image_base64):
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
                     {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_base64}"
-                                }
-                            }
-                        ]
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{image_base64}"
+                        }
                     }
-                ],
-                max_tokens=1000
+                ]
+            }
+        ]
+
+    @staticmethod
+    def _consume_stream(stream, deadline_at, cancel_event):
+        """读取流式响应；JSON 对象完整后立即停止，超过截止时间或被取消时中断"""
+        parts = []
+        depth = 0
+        started = False
+        try:
+            for chunk in stream:
+                if cancel_event.is_set():
+                    raise LLMCancelled()
+                if time.time() > deadline_at:
+                    raise TimeoutError("LLM 流式响应超过截止时间")
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                parts.append(delta)
+                # 统计括号层级，完整 JSON 出现后不再等待剩余输出
+                for char in delta:
+                    if char == '{':
+                        depth += 1
+                        started = True
+                    elif char == '}' and started:
+                        depth -= 1
+                if started and depth <= 0 and parse_llm_json(''.join(parts)) is not None:
+                    break
+        finally:
+            response = getattr(stream, 'response', None)
+            if response is not None:
+                response.close()
+        return ''.join(parts)
+
+    def _call_provider(self, provider, image_base64, similar_cases, few_shot_examples, deadline_at, cancel_event):
+        """在截止时间内请求单个 provider，返回响应文本
+
+        image_base64 也可以是按 provider 生成图片负载的函数，在请求线程中调用。
+        """
+        if callable(image_base64):
+            image_base64 = image_base64(provider)
+        prompt = self._build_prompt(similar_cases, few_shot_examples, provider=provider)
+        messages = self._build_messages(prompt, image_base64)
+        model = self._pick_model(provider)
+
+        def request(client):
+            timeout = max(1.0, deadline_at - time.time())
+            if Config.LLM_STREAMING:
+                stream = client.chat.completions.create(
+                    model=model, messages=messages, max_tokens=1000, stream=True, timeout=timeout,
+                )
+                return self._consume_stream(stream, deadline_at, cancel_event)
+            response = client.chat.completions.create(
+                model=model, messages=messages, max_tokens=1000, timeout=timeout,
             )
             return response.choices[0].message.content
-        except Exception as e:
-            return f"{provider} 分析失败: {str(e)}"
+
+        return self.client_pool.call(provider, request, deadline_at=deadline_at)
+
+    def generate_hazard_analysis_detailed(self, image_base64, similar_cases, few_shot_examples,
+                                          provider: str = "gemini", hedge: Optional[bool] = None) -> Dict:
+        """多模态分析，返回 {content, provider, hedged, elapsed}
+
+        每个 provider 有独立的截止时间；启用对冲时，主请求在 LLM_HEDGE_DELAY 秒内
+        没有返回有效 JSON 就同时请求备用 provider，先返回有效 JSON 的结果胜出。
+        image_base64 可以是 base64 字符串，也可以是 provider -> base64 的函数；
+        传入函数时对冲请求使用按备用 provider 的尺寸和字节预算生成的图片。
+        """
+        hedge = Config.LLM_HEDGE_ENABLED if hedge is None else hedge
+        hedge_provider = Config.LLM_HEDGE_PROVIDERS.get(provider) if hedge else None
+        start = time.time()
+        cancel_event = threading.Event()
+        futures = {}
+        # 主请求的图片负载在当前线程生成，失败时与原先一样直接抛出
+        primary_payload = image_base64(provider) if callable(image_base64) else image_base64
+
+        def submit(name):
+            deadline_at = time.time() + Config.LLM_DEADLINES.get(name, Config.LLM_READ_TIMEOUT)
+            future = self._executor.submit(
+                self._call_provider, name, primary_payload if name == provider else image_base64,
+                similar_cases, few_shot_examples, deadline_at, cancel_event,
+            )
+            futures[future] = (name, deadline_at)
+
+        submit(provider)
+        fallback = None
+        hedged = False
+        try:
+            while futures:
+                now = time.time()
+                if hedge_provider and not hedged:
+                    timeout = max(0.0, start + Config.LLM_HEDGE_DELAY - now)
+                else:
+                    timeout = max(0.0, max(deadline for _, deadline in futures.values()) - now)
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                if not done:
+                    if hedge_provider and not hedged:
+                        print(f"⏱️  {provider} {Config.LLM_HEDGE_DELAY}s 内未返回，对冲请求 {hedge_provider}")
+                        hedged = True
+                        submit(hedge_provider)
+                        continue
+                    break
+
+                for future in done:
+                    name, _ = futures.pop(future)
+                    try:
+                        content = future.result()
+                    except Exception as e:
+                        print(f"⚠️  {name} 请求失败: {e}")
+                        fallback = fallback or f"{name} 分析失败: {str(e)}"
+                        if hedge_provider and not hedged:
+                            # 主请求直接失败时不必等待对冲延迟
+                            hedged = True
+                            submit(hedge_provider)
+                        continue
+                    if parse_llm_json(content) is not None:
+                        if name != provider:
+                            print(f"⚡ 对冲请求 {name} 先返回有效结果")
+                        return {'content': content, 'provider': name, 'hedged': hedged,
+                                'elapsed': time.time() - start}
+                    print(f"⚠️  {name} 返回的内容不是有效 JSON")
+                    fallback = content
+                    if hedge_provider and not hedged:
+                        hedged = True
+                        submit(hedge_provider)
+            return {'content': fallback or f"{provider} 分析失败: 超过截止时间",
+                    'provider': provider, 'hedged': hedged, 'elapsed': time.time() - start}
+        finally:
+            # 通知仍在进行的流式请求提前结束
+            cancel_event.set()
+
+    def generate_hazard_analysis(self, image_base64, similar_cases, few_shot_examples, provider: str = "gemini"):
+        """多模态分析：图片 + 文本提示"""
+        return self.generate_hazard_analysis_detailed(
+            image_base64, similar_cases, few_shot_examples, provider=provider
+        )['content']
 
     def generate_text_analysis(self, text_prompt, provider: str = "gemini"):
         """纯文本分析备用"""
-        client = self._create_client(provider)
         model = self._pick_model(provider)
         try:
-            response = client.chat.completions.create(
+            response = self.client_pool.call(provider, lambda client: client.chat.completions.create(
                 model=model,
                 messages=[{"role": "user", "content": text_prompt}],
                 max_tokens=1000
-            )
+            ))
             return response.choices[0].message.content
         except Exception as e:
             return f"文本分析失败: {str(e)}"
 
-    def _build_prompt(self, similar_cases, few_shot_examples):
-        """构建提示词"""
-        prompt = """
-你是一个专业的隐患识别专家。请分析上传的图片，识别其中的安全隐患，并提供整改建议，15种隐患类型如下所示。
-"1": "未按规定穿戴反光安全服",
-"2": "高处作业未正确使用安全带",
-"3": "配电箱未及时锁闭",
-"4": "未按规定配置灭火器、消防设施等",
-"5": "现场防护栏等安全防护设施缺失、破损或设置不规范",
-"6": "设备安全防护设施、装置缺失或失效",
-"7": "起重吊装设备钢丝绳磨损、断丝严重，搭接长度不足",
-"8": "汽车吊、随车吊、泵车支腿未全部伸出、未垫枕木进行作业",
-"9": "基坑支护措施不到位",
-"10": "灭火器未按规定要求放置",
-"11": "未按规定设置接地线或接地不良",
-"12": "安全警示标志标识缺失或设置不规范",
-"13": "灭火器压力不足，灭火器、消防设施等未按规定进行检查、维护",
-"14": "不符合“三级配电两级漏电保护、一机一闸一漏一箱”要求",
-"15": "电缆外皮破损或敷设不规范"
-"""
-        prompt += "\n部分类别的相关例子如下:\n"
-        for i, example in enumerate(few_shot_examples, 1):
-            example_type = example.get('type', '未知')
-            example_type_desc = self.hazard_types.get(example_type, example_type)
-            prompt += f"\n示例{i}:\n"
-            prompt += f"类型: {example_type} ({example_type_desc})\n"
-            prompt += f"描述: {example.get('description', '无描述')}\n"
-            prompt += f"建议: {example.get('suggestion', '无建议')}\n"
-
-        prompt += "\n 以下几个示例的图片与上传的图片非常类似，其隐患类别和描述如下，请据此确定隐患类型并提出建议：\n"
-        for i, case in enumerate(similar_cases, 1):
-            case_type = case.get('type', '未知')
-            case_type_desc = self.hazard_types.get(case_type, case_type)
-            prompt += f"\n相似案例{i}:\n"
-            prompt += f"类型: {case_type} ({case_type_desc})\n"
-            prompt += f"描述: {case.get('description', '无描述')}\n"
-
-        prompt += """
-请按照以下格式输出分析结果（JSON 或可被 JSON 解析）：
-{
-"type": "隐患类型",
-"description": "详细描述",
-"suggestion": "整改建议",
-"confidence": 0.95
-}
-"""
-        return prompt
\ No newline at end of file
+    def _build_prompt(self, similar_cases, few_shot_examples, provider: str = "gemini"):
+        """构建提示词（受 provider 的 token 预算约束）"""
+        prompt, tokens = self.prompt_builder.build(similar_cases, few_shot_examples, provider=provider)
+        print(f"📝 提示词约 {tokens} tokens（{provider} 预算 {self.prompt_builder.budget_for(provider)}）")
+        return prompt
@@ -0,0 +1,86 @@
+import threading
+import torch
+import clip
+from config import Config
+
+
+class ModelRegistry:
+    """进程内模型注册表
+
+    CLIP、BERT、TF-IDF（jieba）等模型和依赖它们的服务在每个进程中只创建一次，
+    CLIPService 与 ImageProcessor 共享同一份 CLIP 权重，分析器也从这里获取。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._instances = {}
+
+    def _get_or_create(self, key, factory):
+        instance = self._instances.get(key)
+        if instance is not None:
+            return instance
+        with self._lock:
+            instance = self._instances.get(key)
+            if instance is None:
+                instance = factory()
+                self._instances[key] = instance
+            return instance
+
+    def _load_clip(self):
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f"🔄 正在加载CLIP模型 {Config.CLIP_MODEL_NAME} (设备: {device})...")
+        model, preprocess = clip.load(Config.CLIP_MODEL_NAME, device=device)
+        model.eval()
+        return model, preprocess, device
+
+    def get_clip_model(self):
+        """返回共享的 (model, preprocess, device)"""
+        return self._get_or_create('clip_model', self._load_clip)
+
+    def get_clip_service(self):
+        from services.clip_service import CLIPService
+        return self._get_or_create('clip_service', lambda: CLIPService(*self.get_clip_model()))
+
+    def get_embedding_store(self):
+        from services.embedding_store import EmbeddingStore
+        return self._get_or_create('embedding_store', EmbeddingStore)
+
+    def get_image_processor(self):
+        from utils.image_processor import ImageProcessor
+        return self._get_or_create('image_processor', lambda: ImageProcessor(*self.get_clip_model()))
+
+    def get_bert_similarity(self):
+        from services.bert_similarity_service import BertSimilarityService
+        return self._get_or_create('bert_similarity', BertSimilarityService)
+
+    def get_tfidf_similarity(self):
+        from services.tfidf_similarity_service import TfidfSimilarityService
+        return self._get_or_create('tfidf_similarity', TfidfSimilarityService)
+
+    def get_llm_service(self):
+        from services.llm_service import LLMService
+        return self._get_or_create('llm_service', LLMService)
+
+    def get_hazard_analyzer(self):
+        from services.hazard_analyzer import HazardAnalyzer
+        return self._get_or_create(
+            'hazard_analyzer', lambda: HazardAnalyzer(self.get_llm_service(), registry=self)
+        )
+
+    def loaded_models(self):
+        """返回已加载的模型/服务名称"""
+        return sorted(self._instances.keys())
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    """获取进程内唯一的模型注册表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
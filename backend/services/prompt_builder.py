@@ -0,0 +1,146 @@
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+from config import Config
+
+HAZARD_TYPES = {
+    "1": "未按规定穿戴反光安全服",
+    "2": "高处作业未正确使用安全带",
+    "3": "配电箱未及时锁闭",
+    "4": "未按规定配置灭火器、消防设施等",
+    "5": "现场防护栏等安全防护设施缺失、破损或设置不规范",
+    "6": "设备安全防护设施、装置缺失或失效",
+    "7": "起重吊装设备钢丝绳磨损、断丝严重，搭接长度不足",
+    "8": "汽车吊、随车吊、泵车支腿未全部伸出、未垫枕木进行作业",
+    "9": "基坑支护措施不到位",
+    "10": "灭火器未按规定要求放置",
+    "11": "未按规定设置接地线或接地不良",
+    "12": "安全警示标志标识缺失或设置不规范",
+    "13": "灭火器压力不足，灭火器、消防设施等未按规定进行检查、维护",
+    "14": "不符合“三级配电两级漏电保护、一机一闸一漏一箱”要求",
+    "15": "电缆外皮破损或敷设不规范",
+}
+
+# 静态部分只在导入时拼接一次
+PREAMBLE = (
+    "\n你是一个专业的隐患识别专家。请分析上传的图片，识别其中的安全隐患，并提供整改建议，15种隐患类型如下所示。\n"
+    + ",\n".join(f'"{key}": "{value}"' for key, value in HAZARD_TYPES.items())
+    + "\n"
+)
+EXAMPLES_HEADER = "\n部分类别的相关例子如下:\n"
+SIMILAR_HEADER = "\n 以下几个示例的图片与上传的图片非常类似，其隐患类别和描述如下，请据此确定隐患类型并提出建议：\n"
+OUTPUT_FORMAT = """
+请按照以下格式输出分析结果（JSON 或可被 JSON 解析）：
+{
+"type": "隐患类型",
+"description": "详细描述",
+"suggestion": "整改建议",
+"confidence": 0.95
+}
+"""
+
+_CJK_PATTERN = re.compile(r'[　-〿一-鿿＀-￯]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文字符及全角标点约 1 个/字，其余字符约 4 个/token"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    text = ' '.join(str(text).split())
+    if max_chars and len(text) > max_chars:
+        return text[:max_chars - 1] + '…'
+    return text
+
+
+class PromptBuilder:
+    """按 provider 的 token 预算构建提示词
+
+    相似案例比 few-shot 示例更贴近当前图片，预算不足时优先保留；
+    描述相同的条目只保留一次，过长的描述会被截断。
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, max_description_chars: Optional[int] = None):
+        self.budgets = budgets or Config.PROMPT_TOKEN_BUDGET
+        self.max_description_chars = max_description_chars or Config.PROMPT_MAX_DESCRIPTION_CHARS
+        self.fixed_tokens = estimate_tokens(PREAMBLE + OUTPUT_FORMAT)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def budget_for(self, provider: str) -> int:
+        return self.budgets.get(provider, self.budgets.get('default', 2000))
+
+    @staticmethod
+    def _type_label(hazard_type) -> str:
+        hazard_type = hazard_type or '未知'
+        return f"{hazard_type} ({HAZARD_TYPES.get(hazard_type, hazard_type)})"
+
+    def _example_block(self, i: int, example: Dict) -> str:
+        return (
+            f"\n示例{i}:\n"
+            f"类型: {self._type_label(example.get('type'))}\n"
+            f"描述: {truncate_text(example.get('description') or '无描述', self.max_description_chars)}\n"
+            f"建议: {truncate_text(example.get('suggestion') or '无建议', self.max_description_chars)}\n"
+        )
+
+    def _case_block(self, i: int, case: Dict) -> str:
+        return (
+            f"\n相似案例{i}:\n"
+            f"类型: {self._type_label(case.get('type'))}\n"
+            f"描述: {truncate_text(case.get('description') or '无描述', self.max_description_chars)}\n"
+        )
+
+    def build(self, similar_cases: List[Dict], few_shot_examples: List[Dict], provider: str = "gemini") -> Tuple[str, int]:
+        """构建提示词，返回 (提示词, 估算 token 数)"""
+        budget = self.budget_for(provider)
+        used = self.fixed_tokens
+        seen = set()
+        dropped = 0
+
+        def take(items, header, render):
+            nonlocal used, dropped
+            blocks = []
+            header_tokens = estimate_tokens(header)
+            for item in items or []:
+                key = (item.get('type'), truncate_text(item.get('description') or '', self.max_description_chars))
+                if key in seen:
+                    dropped += 1
+                    continue
+                block = render(len(blocks) + 1, item)
+                cost = estimate_tokens(block) + (0 if blocks else header_tokens)
+                if used + cost > budget:
+                    dropped += 1
+                    continue
+                seen.add(key)
+                used += cost
+                blocks.append(block)
+            return header + ''.join(blocks) if blocks else ''
+
+        similar_text = take(similar_cases, SIMILAR_HEADER, self._case_block)
+        examples_text = take(few_shot_examples, EXAMPLES_HEADER, self._example_block)
+        prompt = PREAMBLE + examples_text + similar_text + OUTPUT_FORMAT
+        tokens = estimate_tokens(prompt)
+        self._record(provider, tokens, dropped)
+        return prompt, tokens
+
+    def _record(self, provider: str, tokens: int, dropped: int):
+        with self._lock:
+            stats = self._stats.setdefault(provider, {'prompts': 0, 'total_tokens': 0, 'max_tokens': 0, 'dropped_items': 0})
+            stats['prompts'] += 1
+            stats['total_tokens'] += tokens
+            stats['max_tokens'] = max(stats['max_tokens'], tokens)
+            stats['dropped_items'] += dropped
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                provider: dict(
+                    stats,
+                    budget=self.budget_for(provider),
+                    avg_tokens=stats['total_tokens'] / stats['prompts'] if stats['prompts'] else 0.0,
+                )
+                for provider, stats in self._stats.items()
+            }
@@ -0,0 +1,170 @@
+import os
+import numpy as np
+from typing import Dict, Optional, Tuple
+from config import Config
+
+try:
+    import faiss
+except ImportError:  # faiss 为可选依赖，未安装时只能使用暴力检索
+    faiss = None
+
+
+class BruteForceBackend:
+    """精确暴力检索：一次矩阵乘法 + argpartition"""
+
+    name = 'bruteforce'
+
+    def __init__(self, params: Optional[Dict] = None):
+        self.params = params or {}
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.matrix.shape[0])
+
+    def build(self, matrix: np.ndarray):
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+
+    def with_added(self, vectors: np.ndarray) -> 'BruteForceBackend':
+        """返回追加了 vectors 的新后端，原后端不变（检索中的线程不受影响）"""
+        backend = BruteForceBackend(self.params)
+        backend.matrix = np.ascontiguousarray(np.vstack([self.matrix, vectors]), dtype=np.float32)
+        return backend
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (scores, indices)，形状均为 (n_queries, k)，按相似度降序"""
+        scores = queries @ self.matrix.T
+        k = min(k, scores.shape[1])
+        if k < scores.shape[1]:
+            top_idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top_idx = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        top_scores = np.take_along_axis(scores, top_idx, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return (
+            np.take_along_axis(top_scores, order, axis=1),
+            np.take_along_axis(top_idx, order, axis=1),
+        )
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            np.save(f, self.matrix)
+
+    def load(self, path: str):
+        with open(path, 'rb') as f:
+            self.matrix = np.load(f)
+
+
+class _FaissBackend:
+    """FAISS 检索后端基类（特征已归一化，内积即余弦相似度）"""
+
+    name = 'faiss'
+
+    def __init__(self, params: Optional[Dict] = None):
+        if faiss is None:
+            raise ImportError("未安装 faiss-cpu，无法使用 FAISS 检索后端")
+        self.params = params or {}
+        self.index = None
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.index.ntotal) if self.index is not None else 0
+
+    def _create_index(self, dim: int, count: int):
+        raise NotImplementedError
+
+    def _apply_search_params(self):
+        pass
+
+    def build(self, matrix: np.ndarray):
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.index = self._create_index(matrix.shape[1], matrix.shape[0])
+        if not self.index.is_trained:
+            self.index.train(matrix)
+        self.index.add(matrix)
+        self._apply_search_params()
+
+    def with_added(self, vectors: np.ndarray):
+        """复制索引后追加 vectors，不重新训练（IVF 沿用已有聚类中心），原索引不变"""
+        backend = type(self)(self.params)
+        backend.index = faiss.clone_index(self.index)
+        backend.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+        backend._apply_search_params()
+        return backend
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        return self.index.search(queries, min(k, self.ntotal))
+
+    def save(self, path: str):
+        faiss.write_index(self.index, path)
+
+    def load(self, path: str):
+        self.index = faiss.read_index(path)
+        self._apply_search_params()
+
+
+class FaissFlatBackend(_FaissBackend):
+    """FAISS IndexFlatIP 精确检索"""
+
+    name = 'faiss_flat'
+
+    def _create_index(self, dim: int, count: int):
+        return faiss.IndexFlatIP(dim)
+
+
+class FaissIVFBackend(_FaissBackend):
+    """FAISS IVF 倒排近似检索，适合大规模案例库"""
+
+    name = 'faiss_ivf'
+
+    def _create_index(self, dim: int, count: int):
+        # 聚类中心数不能超过训练样本数
+        nlist = max(1, min(int(self.params.get('nlist', 100)), count))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        return index
+
+    def _apply_search_params(self):
+        self.index.nprobe = int(self.params.get('nprobe', 10))
+
+
+class FaissHNSWBackend(_FaissBackend):
+    """FAISS HNSW 图索引近似检索"""
+
+    name = 'faiss_hnsw'
+
+    def _create_index(self, dim: int, count: int):
+        index = faiss.IndexHNSWFlat(dim, int(self.params.get('m', 32)), faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = int(self.params.get('ef_construction', 200))
+        return index
+
+    def _apply_search_params(self):
+        self.index.hnsw.efSearch = int(self.params.get('ef_search', 64))
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (BruteForceBackend, FaissFlatBackend, FaissIVFBackend, FaissHNSWBackend)
+}
+
+
+def create_backend(name: Optional[str] = None, params: Optional[Dict] = None):
+    """按名称创建检索后端，FAISS 不可用时回退到暴力检索"""
+    name = name or Config.RETRIEVAL_BACKEND
+    if name not in BACKENDS:
+        print(f"⚠️  未知的检索后端 {name}，使用暴力检索")
+        name = BruteForceBackend.name
+    if params is None:
+        params = Config.RETRIEVAL_BACKEND_PARAMS.get(name, {})
+    try:
+        return BACKENDS[name](params)
+    except ImportError as e:
+        print(f"⚠️  {e}，使用暴力检索")
+        return BruteForceBackend()
+
+
+def index_file_paths(name: str) -> Tuple[str, str]:
+    """返回某检索后端的索引文件路径和 id 映射文件路径"""
+    base = os.path.join(Config.RETRIEVAL_INDEX_DIR, f"cases_{name}")
+    return f"{base}.index", f"{base}.ids.json"
@@ -0,0 +1,243 @@
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from pymongo import UpdateOne
+from services.database import acquire_lease, get_db, lease_owner, release_lease
+
+STATS_MODELS = ('gemini', 'gpt4o')
+
+
+def _contribution(result: Optional[Dict]) -> Optional[Dict]:
+    """一条分析结果对统计的贡献，级联结果（未调用 LLM）不计入
+
+    counted: 计入 count/bert_sum/tfidf_sum，BERT 和 TF-IDF 相似度都为 0 的结果不计入；
+    scored: 计入 scored_count/scored_bert_sum，即所有带 bert_similarity 的结果（含 0 分），
+    与 /similarity/stats 原先扫描 analysis_cache 的口径一致。
+    """
+    if not result or result.get('decision_path') == 'cascade':
+        return None
+    bert = float(result.get('bert_similarity') or 0.0)
+    tfidf = float(result.get('tfidf_similarity') or 0.0)
+    counted = bert > 0 or tfidf > 0
+    scored = result.get('bert_similarity') is not None
+    if not (counted or scored):
+        return None
+    return {'type': str(result.get('type')), 'bert': bert, 'tfidf': tfidf,
+            'counted': counted, 'scored': scored}
+
+
+def _average(doc: Optional[Dict]) -> Dict:
+    doc = doc or {}
+    count = doc.get('count', 0)
+    scored_count = doc.get('scored_count', 0)
+    return {
+        'count': count,
+        'bert_avg': doc['bert_sum'] / count if count else 0.0,
+        'tfidf_avg': doc['tfidf_sum'] / count if count else 0.0,
+        'scored_count': scored_count,
+        'scored_bert_avg': doc['scored_bert_sum'] / scored_count if scored_count else 0.0,
+    }
+
+
+STATS_FIELDS = ('count', 'bert_sum', 'tfidf_sum', 'scored_count', 'scored_bert_sum')
+
+
+class SimilarityStats:
+    """按模型和隐患类型增量维护的相似度统计（similarity_stats 集合）
+
+    保存分析结果时用 $inc 原子地累加计数和相似度总和（更新已有结果时先减去旧值），
+    读取时只需读几十个小文档，与 analysis_cache 的大小无关；
+    rebuild() 用 $group 聚合从 analysis_cache 全量重建；重建期间 record() 的增量写入
+    journal 集合，替换统计后回放，不会丢失。
+    """
+
+    META_ID = 'meta'
+    # 统计字段变化时加一，旧版本的统计在首次读取时重建
+    STATS_VERSION = 2
+    REBUILD_LEASE = 'similarity_stats_rebuild'
+    REBUILD_LEASE_TTL = 600
+
+    def __init__(self, db=None):
+        if db is None:
+            db = get_db()
+        self.db = db
+        self.collection = db.similarity_stats
+        self.journal = db.similarity_stats_journal
+
+    @staticmethod
+    def _keys(model: str, hazard_type: str):
+        return ['all', f'model:{model}', f'type:{model}:{hazard_type}']
+
+    def _increments(self, model: str, contribution: Dict, sign: int) -> Dict:
+        counted = sign if contribution['counted'] else 0
+        scored = sign if contribution['scored'] else 0
+        inc = {
+            'count': counted,
+            'bert_sum': counted * contribution['bert'],
+            'tfidf_sum': counted * contribution['tfidf'],
+            'scored_count': scored,
+            'scored_bert_sum': scored * contribution['bert'],
+        }
+        return {key: inc for key in self._keys(model, contribution['type'])}
+
+    def _rebuilding(self) -> Optional[str]:
+        """正在进行的重建的标识，没有重建（或重建已超时）时返回 None"""
+        meta = self.collection.find_one({'_id': self.META_ID}, {'rebuilding': 1, 'rebuilding_until': 1})
+        if meta and meta.get('rebuilding') and meta.get('rebuilding_until', datetime.min) > datetime.now():
+            return meta['rebuilding']
+        return None
+
+    def record(self, model: str, new_result: Optional[Dict], old_result: Optional[Dict] = None):
+        """记录一次结果写入：加上新结果，减去被覆盖的旧结果
+
+        重建进行中时增量写入 journal 集合，由 rebuild() 在替换统计后回放。
+        """
+        deltas = {}
+        for result, sign in ((old_result, -1), (new_result, 1)):
+            contribution = _contribution(result)
+            if contribution is None:
+                continue
+            for key, inc in self._increments(model, contribution, sign).items():
+                total = deltas.setdefault(key, dict.fromkeys(STATS_FIELDS, 0))
+                for field, value in inc.items():
+                    total[field] += value
+        deltas = [[key, inc] for key, inc in deltas.items() if any(inc.values())]
+        if not deltas:
+            return
+        rebuilding = self._rebuilding()
+        if rebuilding:
+            self.journal.insert_one({'rebuild': rebuilding, 'deltas': deltas, 'created_at': datetime.now()})
+        else:
+            self.collection.bulk_write(self._operations(deltas), ordered=False)
+
+    @staticmethod
+    def _operations(deltas):
+        operations = []
+        for key, inc in deltas:
+            parts = key.split(':')
+            operations.append(UpdateOne(
+                {'_id': key},
+                {
+                    '$inc': inc,
+                    '$set': {'updated_at': datetime.now()},
+                    '$setOnInsert': {
+                        'model': parts[1] if len(parts) > 1 else None,
+                        'type': parts[2] if len(parts) > 2 else None,
+                    },
+                },
+                upsert=True,
+            ))
+        return operations
+
+    def _replay_journal(self, token: str) -> int:
+        """把重建期间记录的增量应用到统计集合"""
+        replayed = 0
+        while True:
+            entries = list(self.journal.find({'rebuild': token}).sort('_id', 1).limit(1000))
+            if not entries:
+                return replayed
+            self.collection.bulk_write(
+                [op for entry in entries for op in self._operations(entry['deltas'])], ordered=False
+            )
+            self.journal.delete_many({'_id': {'$in': [entry['_id'] for entry in entries]}})
+            replayed += len(entries)
+
+    def rebuild(self) -> Dict:
+        """用 $group 聚合从 analysis_cache 重建统计
+
+        结果先写入临时集合，再用 rename(dropTarget=True) 原子替换，
+        读取方不会看到空的或只写了一半的统计。
+        开始聚合前在 meta 文档上标记重建，此后 record() 的增量写入 journal，
+        替换完成后回放到新的统计集合再清除标记。
+        """
+        bert = {'$ifNull': ['$result.bert_similarity', 0]}
+        tfidf = {'$ifNull': ['$result.tfidf_similarity', 0]}
+        counted = {'$or': [{'$gt': [bert, 0]}, {'$gt': [tfidf, 0]}]}
+        scored = {'$ne': [{'$ifNull': ['$result.bert_similarity', None]}, None]}
+        pipeline = [
+            {'$match': {
+                'result.decision_path': {'$ne': 'cascade'},
+                '$or': [
+                    {'result.bert_similarity': {'$ne': None}},
+                    {'result.tfidf_similarity': {'$gt': 0}},
+                ],
+            }},
+            {'$group': {
+                '_id': {'model': '$model', 'type': {'$toString': '$result.type'}},
+                'count': {'$sum': {'$cond': [counted, 1, 0]}},
+                'bert_sum': {'$sum': {'$cond': [counted, bert, 0]}},
+                'tfidf_sum': {'$sum': {'$cond': [counted, tfidf, 0]}},
+                'scored_count': {'$sum': {'$cond': [scored, 1, 0]}},
+                'scored_bert_sum': {'$sum': {'$cond': [scored, bert, 0]}},
+            }},
+        ]
+        token = uuid.uuid4().hex
+        rebuilding = {'rebuilding': token,
+                      'rebuilding_until': datetime.now() + timedelta(seconds=self.REBUILD_LEASE_TTL)}
+        self.collection.update_one({'_id': self.META_ID}, {'$set': rebuilding}, upsert=True)
+        now = datetime.now()
+        docs = {}
+        for group in self.db.analysis_cache.aggregate(pipeline):
+            model, hazard_type = group['_id']['model'], group['_id']['type']
+            for key in self._keys(model, hazard_type):
+                parts = key.split(':')
+                doc = docs.setdefault(key, {
+                    '_id': key,
+                    'model': parts[1] if len(parts) > 1 else None,
+                    'type': parts[2] if len(parts) > 2 else None,
+                    **dict.fromkeys(STATS_FIELDS, 0),
+                    'updated_at': now,
+                })
+                for field in STATS_FIELDS:
+                    doc[field] += group[field]
+
+        docs[self.META_ID] = dict(rebuilding, _id=self.META_ID, rebuilt_at=now, version=self.STATS_VERSION)
+        staging = self.db[f'{self.collection.name}_rebuild_{token[:8]}']
+        try:
+            staging.insert_many(list(docs.values()))
+            staging.rename(self.collection.name, dropTarget=True)
+        except Exception:
+            staging.drop()
+            raise
+        finally:
+            # 先回放一次再清除标记，清除标记前已开始写 journal 的增量由第二次回放处理
+            replayed = self._replay_journal(token)
+            self.collection.update_one(
+                {'_id': self.META_ID, 'rebuilding': token},
+                {'$unset': {'rebuilding': '', 'rebuilding_until': ''}},
+            )
+            replayed += self._replay_journal(token)
+        print(f"✅ 相似度统计重建完成: {docs.get('all', {}).get('count', 0)} 条结果，回放 {replayed} 条重建期间的写入")
+        return self.get_stats(rebuild_if_missing=False)
+
+    def get_stats(self, rebuild_if_missing: bool = True) -> Dict:
+        """读取统计: {'all', 'by_model': {model: {count, bert_avg, tfidf_avg, by_type}}}"""
+        docs = {doc['_id']: doc for doc in self.collection.find({})}
+        stale = docs.get(self.META_ID, {}).get('version') != self.STATS_VERSION
+        if stale and rebuild_if_missing:
+            # 首次使用时从已有缓存构建一次；多个请求/进程同时触发时只有一个执行重建，
+            # 其余先返回现有统计
+            owner = lease_owner()
+            if acquire_lease(self.db, self.REBUILD_LEASE, self.REBUILD_LEASE_TTL, owner):
+                try:
+                    meta = self.collection.find_one({'_id': self.META_ID}) or {}
+                    if meta.get('version') != self.STATS_VERSION:
+                        return self.rebuild()
+                    return self.get_stats(rebuild_if_missing=False)
+                finally:
+                    release_lease(self.db, self.REBUILD_LEASE, owner)
+
+        by_model = {model: dict(_average(None), by_type={}) for model in STATS_MODELS}
+        for key, doc in docs.items():
+            if key.startswith('model:'):
+                by_model.setdefault(doc['model'], {'by_type': {}}).update(_average(doc))
+        for key, doc in docs.items():
+            if key.startswith('type:') and doc.get('count'):
+                by_model.setdefault(doc['model'], dict(_average(None), by_type={}))
+                by_model[doc['model']]['by_type'][doc['type']] = _average(doc)
+        rebuilt_at = docs.get(self.META_ID, {}).get('rebuilt_at')
+        return {
+            'all': _average(docs.get('all')),
+            'by_model': by_model,
+            'rebuilt_at': rebuilt_at.isoformat() if rebuilt_at else None,
+        }
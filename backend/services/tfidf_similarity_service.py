@@ -2,8 +2,7 @@ import os
 import jieba
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 from config import Config
 
 
@@ -15,6 +14,7 @@ class TfidfSimilarityService:
         self.hazard_descriptions = self._load_hazard_descriptions()
         # 初始化 TF-IDF 向量化器
         self.vectorizer = self._init_vectorizer()
+        self.category_matrix = self._build_category_matrix()
         print("✅ TF-IDF 相似度服务初始化完成")
     
     def _load_hazard_descriptions(self) -> Dict[str, str]:
@@ -84,6 +84,58 @@ class TfidfSimilarityService:
         
         return vectorizer
     
+    def _build_category_matrix(self):
+        """预先向量化所有标准描述（TF-IDF 默认 L2 归一化，点积即余弦相似度）"""
+        self.type_index = {hazard_type: i for i, hazard_type in enumerate(self.hazard_descriptions)}
+        try:
+            return self.vectorizer.transform(list(self.hazard_descriptions.values()))
+        except Exception as e:
+            print(f"⚠️  标准描述向量化失败: {e}")
+            return None
+    
+    @staticmethod
+    def _char_similarity(text_a: str, text_b: str) -> float:
+        """分词失败时使用字符级别 TF-IDF 单独计算一对文本"""
+        char_vectorizer = TfidfVectorizer(
+            analyzer='char',
+            ngram_range=(1, 2),
+            max_features=5000
+        )
+        vectors = char_vectorizer.fit_transform([text_a, text_b])
+        return float(vectors[0].multiply(vectors[1]).sum())
+    
+    def calculate_similarities(self, pairs: List[Tuple[str, str]]) -> List[Tuple[float, str]]:
+        """批量计算 (生成描述, 隐患类型) 的 TF-IDF 相似度，返回与 pairs 对齐的 (相似度分数, 标准描述文本)
+
+        向量化失败时按字符级别重试，重试也失败则抛出异常。
+        """
+        results = [(0.0, "")] * len(pairs)
+        valid = []
+        for i, (_, hazard_type) in enumerate(pairs):
+            if hazard_type in self.type_index:
+                valid.append(i)
+            else:
+                print(f"⚠️  未找到类型 {hazard_type} 的标准描述")
+        if not valid:
+            return results
+        
+        try:
+            # 所有描述一次 transform，再与对应类别行逐行点积
+            generated = self.vectorizer.transform([pairs[i][0] or "" for i in valid])
+            rows = self.category_matrix[[self.type_index[pairs[i][1]] for i in valid]]
+            similarities = np.asarray(generated.multiply(rows).sum(axis=1)).ravel()
+        except Exception as e:
+            print(f"⚠️  向量化失败: {e}，使用字符级别重试")
+            similarities = [
+                self._char_similarity(pairs[i][0] or "", self.hazard_descriptions[pairs[i][1]])
+                for i in valid
+            ]
+        
+        for i, similarity in zip(valid, similarities):
+            # 确保相似度在 [0, 1] 范围内
+            results[i] = (max(0.0, min(1.0, float(similarity))), self.hazard_descriptions[pairs[i][1]])
+        return results
+    
     def calculate_similarity(
         self, 
         generated_description: str, 
@@ -97,38 +149,10 @@ class TfidfSimilarityService:
             hazard_type: 隐患类型（如 "1", "2"）
         
         Returns:
-            (相似度分数, 标准描述文本)
+            (相似度分数, 标准描述文本)，计算失败时为 (0.0, "")
         """
         try:
-            # 获取标准描述
-            standard_description = self.hazard_descriptions.get(hazard_type)
-            if not standard_description:
-                print(f"⚠️  未找到类型 {hazard_type} 的标准描述")
-                return 0.0, ""
-            
-            # 向量化两个文本
-            try:
-                vectors = self.vectorizer.transform([generated_description, standard_description])
-            except Exception as e:
-                print(f"⚠️  向量化失败: {e}，使用字符级别重试")
-                # 如果分词失败，使用字符级别
-                char_vectorizer = TfidfVectorizer(
-                    analyzer='char',
-                    ngram_range=(1, 2),
-                    max_features=5000
-                )
-                vectors = char_vectorizer.fit_transform([generated_description, standard_description])
-            
-            # 计算余弦相似度
-            similarity = cosine_similarity(vectors[0:1], vectors[1:2])[0][0]
-            
-            # 确保相似度在 [0, 1] 范围内
-            similarity = max(0.0, min(1.0, float(similarity)))
-            
-            return similarity, standard_description
-            
+            return self.calculate_similarities([(generated_description, hazard_type)])[0]
         except Exception as e:
             print(f"❌ 计算 TF-IDF 相似度失败: {e}")
-            import traceback
-            traceback.print_exc()
-            return 0.0, ""
\ No newline at end of file
+            return 0.0, ""
@@ -0,0 +1,80 @@
+import pytest
+
+from config import Config
+from utils.lru_cache import MISSING
+
+
+@pytest.fixture
+def cache_service(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    import services.cache_service as module
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(module, 'get_mongo_client', lambda: client)
+    return module.CacheService()
+
+
+def result(hazard_type='1', bert=0.8):
+    return {'type': hazard_type, 'description': '测试结果', 'bert_similarity': bert, 'tfidf_similarity': 0.5}
+
+
+def test_phash_index_deduplicates_reloaded_records(cache_service, monkeypatch):
+    monkeypatch.setattr(Config, 'NEAR_DUP_REFRESH_INTERVAL', 0)
+    phash = f"{0b1011:016x}"
+    cache_service.save_result('a' * 32, result(), 'gemini', phash=phash)
+    cache_service._refresh_phash_index()
+    # 保存结果后加入索引，随后的增量加载又读到同一条记录
+    cache_service.save_result('a' * 32, result(bert=0.6), 'gemini', phash=phash)
+    cache_service.save_result('b' * 32, result(), 'gemini', phash=phash)
+    cache_service._refresh_phash_index()
+
+    assert len(cache_service._phash_tree) == 2
+    assert sorted(cache_service._phash_tree.search(0b1011, 0)) == [(0, ('a' * 32, 'gemini')), (0, ('b' * 32, 'gemini'))]
+
+
+def test_find_near_duplicate_respects_model_and_radius(cache_service):
+    cache_service.save_result('a' * 32, result(), 'gemini', phash=f"{0:016x}")
+
+    hit = cache_service.find_near_duplicate(f"{0b11:016x}", 'gemini', max_distance=2)
+
+    assert hit['image_hash'] == 'a' * 32
+    assert hit['distance'] == 2
+    assert cache_service.find_near_duplicate(f"{0b111:016x}", 'gemini', max_distance=2) is None
+    assert cache_service.find_near_duplicate(f"{0b11:016x}", 'gpt4o', max_distance=2) is None
+
+
+def test_stale_refill_is_skipped_when_save_result_runs_during_read(cache_service, monkeypatch):
+    image_hash = 'c' * 32
+    cache_service.save_result(image_hash, result(bert=0.1), 'gemini')
+    cache_service.local_cache.clear()
+    collection = cache_service.cache_collection
+    original_find = collection.find
+    saved = []
+
+    def find_then_concurrent_save(*args, **kwargs):
+        docs = list(original_find(*args, **kwargs))
+        if not saved:
+            # 读取方已从数据库取到旧值，回填本地缓存之前另一个请求保存了新结果
+            # （mongomock 的 find_one_and_update 内部也会调用 find，只触发一次）
+            saved.append(True)
+            cache_service.save_result(image_hash, result(bert=0.9), 'gemini')
+        return iter(docs)
+
+    monkeypatch.setattr(collection, 'find', find_then_concurrent_save)
+    stale = cache_service.get_cached_result(image_hash, 'gemini')
+    monkeypatch.setattr(collection, 'find', original_find)
+
+    assert stale['result']['bert_similarity'] == 0.1
+    assert cache_service.local_cache.get((image_hash, 'gemini'))['result']['bert_similarity'] == 0.9
+    assert cache_service.get_cached_result(image_hash, 'gemini')['result']['bert_similarity'] == 0.9
+
+
+def test_refill_without_concurrent_write_populates_local_cache(cache_service):
+    image_hash = 'd' * 32
+    cache_service.save_result(image_hash, result(), 'gemini')
+    cache_service.local_cache.clear()
+
+    cache_service.get_cached_results_for_hashes([image_hash, 'e' * 32], 'gemini')
+
+    assert cache_service.local_cache.get((image_hash, 'gemini'))['image_hash'] == image_hash
+    # 数据库中不存在的键以否定缓存回填，不再重复查询
+    assert cache_service.local_cache.get(('e' * 32, 'gemini')) is not MISSING
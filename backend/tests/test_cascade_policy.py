@@ -0,0 +1,83 @@
+import pytest
+
+from services.cascade_policy import CASCADE_MODEL, CascadePolicy, cache_model_key
+
+
+def classification(scores, hazard_type='1'):
+    return {'type': hazard_type, 'all_scores': scores}
+
+
+def neighbours(*pairs):
+    return [{'type': hazard_type, 'similarity': similarity} for hazard_type, similarity in pairs]
+
+
+CONFIDENT_SCORES = {'1': 0.30, '2': 0.25, '3': 0.20}
+AGREEING = neighbours(('1', 0.95), ('1', 0.93), ('1', 0.92), ('2', 0.5))
+
+
+@pytest.fixture
+def policy():
+    return CascadePolicy(enabled=True, min_clip_margin=0.5, min_vote_share=0.8,
+                         min_top_similarity=0.9, min_neighbours=3)
+
+
+def test_clip_probabilities_softmax():
+    probabilities = CascadePolicy.clip_probabilities({'1': 0.30, '2': 0.29})
+
+    assert sum(probabilities.values()) == pytest.approx(1.0)
+    assert probabilities['1'] / probabilities['2'] == pytest.approx(2.718281828, rel=1e-6)
+    assert CascadePolicy.clip_probabilities({}) == {}
+
+
+def test_confident_and_agreeing_neighbours_skip_llm(policy):
+    decision = policy.decide(classification(CONFIDENT_SCORES), AGREEING)
+
+    assert decision['skip_llm'] is True
+    assert decision['reason'] == 'confident'
+    assert decision['type'] == '1'
+    assert decision['vote_share'] == pytest.approx((0.95 + 0.93 + 0.92) / (0.95 + 0.93 + 0.92 + 0.5), abs=1e-4)
+    assert decision['neighbours'] == 4
+
+
+def test_margin_threshold(policy):
+    # 0.01 的余弦差经 logit 缩放后概率比约为 e，第一、二名概率差约 0.46
+    decision = policy.decide(classification({'1': 0.30, '2': 0.29, '3': 0.10}), AGREEING)
+
+    assert decision['skip_llm'] is False
+    assert decision['reason'] == 'low_clip_margin'
+    assert decision['clip_margin'] < 0.5
+    assert CascadePolicy(enabled=True, min_clip_margin=0.4, min_vote_share=0.8, min_top_similarity=0.9,
+                         min_neighbours=3).decide(classification({'1': 0.30, '2': 0.29, '3': 0.10}),
+                                                  AGREEING)['skip_llm'] is True
+
+
+def test_vote_share_threshold(policy):
+    split = neighbours(('1', 0.95), ('1', 0.93), ('2', 0.92), ('2', 0.5))
+    decision = policy.decide(classification(CONFIDENT_SCORES), split)
+
+    assert decision['reason'] == 'neighbours_disagree'
+    assert decision['vote_share'] < 0.8
+
+
+def test_vote_share_at_threshold_passes():
+    policy = CascadePolicy(enabled=True, min_clip_margin=0.5, min_vote_share=0.75,
+                           min_top_similarity=0.9, min_neighbours=3)
+    decision = policy.decide(classification(CONFIDENT_SCORES),
+                             neighbours(('1', 1.0), ('1', 1.0), ('1', 1.0), ('2', 1.0)))
+
+    assert decision['vote_share'] == 0.75
+    assert decision['skip_llm'] is True
+
+
+def test_other_guards(policy):
+    scores = classification(CONFIDENT_SCORES)
+    assert policy.decide(scores, AGREEING[:2])['reason'] == 'too_few_neighbours'
+    assert policy.decide(scores, neighbours(('1', 0.85), ('1', 0.85), ('1', 0.85)))['reason'] == 'low_similarity'
+    assert policy.decide(classification(CONFIDENT_SCORES, 'unknown'), AGREEING)['reason'] == 'clip_failed'
+    disabled = CascadePolicy(enabled=False).decide(scores, AGREEING)
+    assert disabled['skip_llm'] is False and disabled['reason'] == 'disabled'
+
+
+def test_cache_model_key():
+    assert cache_model_key({'decision_path': 'cascade'}, 'gemini') == CASCADE_MODEL
+    assert cache_model_key({'decision_path': 'llm'}, 'gemini') == 'gemini'
@@ -0,0 +1,144 @@
+import json
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from config import Config
+from services.case_index import CaseIndex
+from utils.feature_codec import encode_features
+
+
+def make_case(case_id, vector):
+    case = {
+        '_id': case_id,
+        'type': '1',
+        'description': f'案例 {case_id}',
+        'content_hash': f'hash-{case_id}',
+        'updated_at': datetime.now(),
+    }
+    case.update(encode_features(vector, dtype='float32'))
+    return case
+
+
+@pytest.fixture
+def db():
+    mongomock = pytest.importorskip('mongomock')
+    return mongomock.MongoClient().db
+
+
+@pytest.fixture
+def index(db, monkeypatch):
+    monkeypatch.setattr(Config, 'CASE_INDEX_REBUILD_RATIO', 0.5)
+    rng = np.random.default_rng(0)
+    db.cases.insert_many([make_case(f'c{i}', rng.normal(size=8)) for i in range(10)])
+    index = CaseIndex(db, refresh_interval=3600, backend_name='bruteforce')
+    index.load(rebuild=True)
+    return index
+
+
+def test_apply_changes_appends_and_tombstones_without_rebuild(index):
+    backend = index._state[1]
+    vector = np.eye(8)[0]
+
+    index.apply_changes([make_case('new', vector)], ['c0'])
+
+    snapshot, new_backend = index._state
+    assert len(index) == 10
+    assert snapshot['matrix'].shape[0] == 11
+    assert snapshot['dead'] == 1
+    # 原后端未被修改，新后端只是在末尾追加了一行
+    assert backend.ntotal == 10 and new_backend.ntotal == 11
+    assert index.search(vector, top_k=1)[0]['_id'] == 'new'
+    assert all(hit['_id'] != 'c0' for hit in index.search_batch(snapshot['matrix'], top_k=10)[0])
+
+
+def test_replaced_case_is_returned_once(index):
+    vector = np.eye(8)[1]
+
+    index.upsert_cases([make_case('c3', vector)])
+
+    hits = index.search(vector, top_k=10)
+    assert [hit['_id'] for hit in hits].count('c3') == 1
+    assert hits[0]['_id'] == 'c3'
+    assert len(hits) == 10
+
+
+def test_drift_above_ratio_compacts(index):
+    index.remove_cases(['c0', 'c1', 'c2', 'c3', 'c4'])
+    assert index._state[0]['dead'] == 5
+
+    index.remove_cases(['c5'])
+
+    snapshot = index._state[0]
+    assert snapshot['dead'] == 0
+    assert snapshot['matrix'].shape[0] == 4
+    assert sorted(hit['_id'] for hit in index.search(np.ones(8), top_k=10)) == ['c6', 'c7', 'c8', 'c9']
+
+
+def test_faiss_index_with_tombstones_survives_save_and_load(db, tmp_path, monkeypatch):
+    pytest.importorskip('faiss')
+    monkeypatch.setattr(Config, 'RETRIEVAL_INDEX_DIR', str(tmp_path))
+    monkeypatch.setattr(Config, 'CASE_INDEX_REBUILD_RATIO', 0.5)
+    rng = np.random.default_rng(1)
+    db.cases.insert_many([make_case(f'c{i}', rng.normal(size=8)) for i in range(10)])
+    index = CaseIndex(db, refresh_interval=3600, backend_name='faiss_flat')
+    index.load(rebuild=True)
+
+    vector = np.eye(8)[2]
+    new_case = make_case('new', vector)
+    db.cases.insert_one(new_case)
+    db.cases.delete_one({'_id': 'c0'})
+    index.apply_changes([new_case], ['c0'])
+    index.save()
+
+    reloaded = CaseIndex(db, refresh_interval=3600, backend_name='faiss_flat')
+    reloaded.load()
+
+    snapshot, backend = reloaded._state
+    assert backend.ntotal == 11
+    assert snapshot['dead'] == 1
+    assert len(reloaded) == 10
+    assert reloaded.search(vector, top_k=1)[0]['_id'] == 'new'
+    assert all(hit['_id'] != 'c0' for hit in reloaded.search(np.ones(8), top_k=10))
+
+
+@pytest.fixture
+def saved_faiss_index(db, tmp_path, monkeypatch):
+    pytest.importorskip('faiss')
+    monkeypatch.setattr(Config, 'RETRIEVAL_INDEX_DIR', str(tmp_path))
+    rng = np.random.default_rng(2)
+    db.cases.insert_many([make_case(f'c{i}', rng.normal(size=8)) for i in range(10)])
+    index = CaseIndex(db, refresh_interval=3600, backend_name='faiss_flat')
+    index.load(rebuild=True)
+    index.save()
+    return index
+
+
+def test_saved_index_is_loaded_when_digest_matches(db, saved_faiss_index):
+    reloaded = CaseIndex(db, refresh_interval=3600, backend_name='faiss_flat')
+
+    assert reloaded._load_backend_from_disk(reloaded._build_snapshot(db.cases.find({}))) is not None
+
+
+def test_saved_index_with_changed_case_content_is_rejected(db, saved_faiss_index):
+    # 同一组 id，但某个案例的图片内容已变化
+    db.cases.update_one({'_id': 'c3'}, {'$set': {'content_hash': 'hash-changed'}})
+    reloaded = CaseIndex(db, refresh_interval=3600, backend_name='faiss_flat')
+
+    assert reloaded._load_backend_from_disk(reloaded._build_snapshot(db.cases.find({}))) is None
+
+
+def test_saved_index_with_tampered_digest_is_rejected(db, saved_faiss_index):
+    from services.retrieval_backends import index_file_paths
+    _, ids_path = index_file_paths('faiss_flat')
+    with open(ids_path, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    saved['digest'] = '0' * 40
+    with open(ids_path, 'w', encoding='utf-8') as f:
+        json.dump(saved, f)
+    reloaded = CaseIndex(db, refresh_interval=3600, backend_name='faiss_flat')
+
+    assert reloaded._load_backend_from_disk(reloaded._build_snapshot(db.cases.find({}))) is None
+    # load() 退回到全量重建
+    assert reloaded.load() == 10
@@ -0,0 +1,22 @@
+import hashlib
+import io
+
+from utils.content_hash import compute_content_hash
+from utils.upload_handler import read_upload
+
+
+class FakeFileStorage:
+    def __init__(self, data, filename='a.jpg'):
+        self.stream = io.BytesIO(data)
+        self.filename = filename
+
+
+def test_path_bytes_and_upload_hashes_agree(tmp_path):
+    data = bytes(range(256)) * 5000
+    path = tmp_path / 'image.jpg'
+    path.write_bytes(data)
+    expected = hashlib.md5(data).hexdigest()
+
+    assert compute_content_hash(str(path), chunk_size=4096) == expected
+    assert compute_content_hash(data) == expected
+    assert read_upload(FakeFileStorage(data), chunk_size=1000).content_hash == expected
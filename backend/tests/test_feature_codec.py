@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from utils.feature_codec import decode_features, encode_features
+
+
+@pytest.fixture
+def vector():
+    rng = np.random.default_rng(0)
+    vector = rng.normal(size=(1, 512)).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_f32_round_trip_is_exact(vector):
+    doc = encode_features(vector, dtype='float32')
+
+    assert doc['features_format'] == 'f32v1'
+    assert doc['features_dim'] == 512
+    assert len(doc['features']) == 512 * 4
+    decoded = decode_features(doc)
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, vector.reshape(-1))
+
+
+def test_f16_round_trip_within_half_precision(vector):
+    doc = encode_features(vector, dtype='float16')
+
+    assert doc['features_format'] == 'f16v1'
+    assert len(doc['features']) == 512 * 2
+    decoded = decode_features(doc)
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, vector.reshape(-1), atol=1e-3)
+    # 半精度存储不影响余弦相似度排序的精度
+    assert float(decoded @ vector.reshape(-1)) == pytest.approx(1.0, abs=1e-3)
+
+
+def test_legacy_nested_list_is_decoded(vector):
+    decoded = decode_features({'features': vector.tolist()})
+
+    assert decoded.shape == (512,)
+    np.testing.assert_allclose(decoded, vector.reshape(-1))
+
+
+def test_missing_features_decode_to_none():
+    assert decode_features({'description': '没有特征'}) is None
+
+
+def test_dim_mismatch_raises(vector):
+    doc = encode_features(vector, dtype='float32')
+    doc['features_dim'] = 256
+
+    with pytest.raises(ValueError):
+        decode_features(doc)
+
+
+def test_unknown_format_raises(vector):
+    doc = encode_features(vector, dtype='float32')
+    doc['features_format'] = 'f64v9'
+
+    with pytest.raises(ValueError):
+        decode_features(doc)
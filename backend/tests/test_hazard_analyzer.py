@@ -0,0 +1,89 @@
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('clip')
+from config import Config
+from services.hazard_analyzer import HazardAnalyzer
+
+
+class FakeSimilarity:
+    def __init__(self, score):
+        self.score = score
+        self.batches = []
+
+    def calculate_similarities(self, pairs):
+        self.batches.append(list(pairs))
+        return [(self.score, f'标准描述 {hazard_type}') for _, hazard_type in pairs]
+
+    def calculate_similarity(self, generated_description, hazard_type):
+        raise AssertionError('批量路径不应逐条计算相似度')
+
+
+class FakeClipService:
+    def classify_features(self, features):
+        return [{'type': '1', 'description': f'分类 {i}', 'confidence': 0.9} for i in range(len(features))]
+
+    def find_similar_cases_batch(self, features, top_k=5):
+        return [[{'type': '1', 'description': '相似案例'}] * top_k for _ in features]
+
+    def select_examples(self, classification, similar_cases, count=3):
+        return []
+
+
+class FakeImageProcessor:
+    def process_image(self, path):
+        return path
+
+
+class FakeRegistry:
+    def __init__(self):
+        self.bert = FakeSimilarity(0.8)
+        self.tfidf = FakeSimilarity(0.5)
+
+    def get_clip_service(self):
+        return FakeClipService()
+
+    def get_image_processor(self):
+        return FakeImageProcessor()
+
+    def get_bert_similarity(self):
+        return self.bert
+
+    def get_tfidf_similarity(self):
+        return self.tfidf
+
+
+class FakeLLMService:
+    def generate_hazard_analysis_detailed(self, image_base64, similar_cases, few_shot_examples, provider):
+        return {'content': '{"type": "2", "description": "LLM 描述"}', 'elapsed': 0.1, 'provider': provider}
+
+
+@pytest.fixture
+def analyzer(monkeypatch):
+    monkeypatch.setattr(Config, 'EMBEDDING_STORE_ENABLED', False)
+    registry = FakeRegistry()
+    analyzer = HazardAnalyzer(FakeLLMService(), registry=registry)
+    monkeypatch.setattr(analyzer, '_prepare_batch_item', lambda path, image_hash=None: (path, path, image_hash))
+    monkeypatch.setattr(analyzer, '_encode_batch_features', lambda prepared, indices: list(indices))
+    monkeypatch.setattr(analyzer, '_llm_payload_factory', lambda *args: (lambda provider: ''))
+    # 偶数张走级联，奇数张调用 LLM
+    monkeypatch.setattr(analyzer.cascade_policy, 'decide', lambda classification, similar_cases: {
+        'skip_llm': classification['description'].endswith(('0', '2')), 'type': '1', 'vote_share': 1.0,
+    })
+    return analyzer, registry
+
+
+def test_batch_scores_each_window_with_one_call_per_model(analyzer):
+    analyzer, registry = analyzer
+
+    results = dict(analyzer.iter_batch_analyze(['a', 'b', 'c', 'd', 'e'], window_size=3))
+
+    assert sorted(results) == [0, 1, 2, 3, 4]
+    assert [len(batch) for batch in registry.bert.batches] == [3, 2]
+    assert [len(batch) for batch in registry.tfidf.batches] == [3, 2]
+    for result in results.values():
+        assert result['bert_similarity'] == 0.8
+        assert result['tfidf_similarity'] == 0.5
+        assert result['standard_description'] == f"标准描述 {result['type']}"
+    assert results[1]['decision_path'] == 'llm' and results[1]['type'] == '2'
+    assert results[0]['decision_path'] == 'cascade'
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+pytest.importorskip('flask')
+from flask import Flask
+
+import routes.history as history
+
+
+@pytest.fixture
+def client(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(history, 'get_db_connection', lambda: db)
+    history.page_cache.clear()
+    history.count_cache.clear()
+    app = Flask(__name__)
+    app.register_blueprint(history.history_bp, url_prefix='/api')
+    return app.test_client(), db
+
+
+def test_cursor_round_trip_keeps_id_type():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123000)
+    object_id = ObjectId()
+
+    assert history._decode_cursor(history._encode_cursor({'_id': object_id, 'created_at': created_at})) == (
+        created_at, object_id)
+    assert history._decode_cursor(history._encode_cursor({'_id': 'case-7', 'created_at': created_at})) == (
+        created_at, 'case-7')
+    assert history._decode_cursor(history._encode_cursor({'_id': 'legacy'})) == (None, 'legacy')
+
+
+@pytest.mark.parametrize('token', ['not-base64!', 'eyJ4IjogMX0='])
+def test_invalid_cursor_raises_value_error(token):
+    with pytest.raises(ValueError):
+        history._decode_cursor(token)
+
+
+def test_cursor_pagination_reaches_cases_without_created_at(client):
+    client, db = client
+    start = datetime(2024, 1, 1)
+    dated = [{'_id': f'd{i:02d}', 'type': '1', 'created_at': start + timedelta(minutes=i)} for i in range(5)]
+    # 同一时间的多条记录按 _id 排序
+    dated.append({'_id': 'd99', 'type': '1', 'created_at': start + timedelta(minutes=4)})
+    legacy = [{'_id': 'l0', 'type': '1'}, {'_id': 'l1', 'type': '1', 'created_at': None}]
+    db.cases.insert_many(dated + legacy)
+
+    seen, cursor = [], None
+    for _ in range(10):
+        url = '/api/history?limit=2&total=none' + (f'&cursor={cursor}' if cursor else '')
+        data = client.get(url).get_json()
+        seen.extend(case['_id'] for case in data['cases'])
+        cursor = data['next_cursor']
+        if not data['has_more']:
+            break
+
+    assert seen == ['d99', 'd04', 'd03', 'd02', 'd01', 'd00', 'l1', 'l0']
+
+
+def test_invalid_cursor_returns_400(client):
+    client, _ = client
+    assert client.get('/api/history?cursor=bad').status_code == 400
@@ -0,0 +1,53 @@
+import io
+
+import pytest
+from PIL import Image
+
+pytest.importorskip('torch')
+from utils.image_processor import ImageProcessor
+
+
+def segment(marker, payload):
+    return bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, 'big') + payload
+
+
+def markers(data):
+    """返回 SOS 之前所有段的标记"""
+    found, pos = [], 2
+    while data[pos + 1] != 0xDA:
+        found.append(data[pos + 1])
+        pos += 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+    return found
+
+
+@pytest.fixture
+def jpeg_with_metadata():
+    buffer = io.BytesIO()
+    Image.new('RGB', (16, 16), (200, 30, 30)).save(buffer, format='JPEG')
+    data = buffer.getvalue()
+    extra = (
+        segment(0xE1, b'Exif\x00\x00' + b'\x00' * 16)
+        + segment(0xE2, b'ICC_PROFILE\x00\x01\x01' + b'\x00' * 16)
+        + segment(0xED, b'Photoshop 3.0\x00' + b'\x00' * 8)
+        + segment(0xEE, b'Adobe\x00\x64\x00\x00\x00\x00\x01')
+        + segment(0xFE, b'comment')
+    )
+    return data[:2] + extra + data[2:]
+
+
+def test_strip_jpeg_metadata_keeps_color_segments(jpeg_with_metadata):
+    assert {0xE1, 0xE2, 0xED, 0xEE, 0xFE} <= set(markers(jpeg_with_metadata))
+
+    stripped = ImageProcessor._strip_jpeg_metadata(jpeg_with_metadata)
+
+    remaining = markers(stripped)
+    assert 0xE2 in remaining and 0xEE in remaining
+    assert not {0xE1, 0xED, 0xFE} & set(remaining)
+    # 熵编码数据原样保留，图片仍可解码
+    assert stripped.endswith(jpeg_with_metadata[jpeg_with_metadata.index(b'\xff\xda'):])
+    assert Image.open(io.BytesIO(stripped)).size == (16, 16)
+
+
+def test_strip_jpeg_metadata_rejects_non_jpeg():
+    with pytest.raises(ValueError):
+        ImageProcessor._strip_jpeg_metadata(b'\x89PNG\r\n\x1a\n')
@@ -0,0 +1,212 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from config import Config
+from services.job_queue import (
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JOB_SUCCEEDED,
+    JobQueue,
+    MemoryJobStore,
+    serialize_job,
+)
+
+
+def fake_llm_runner(job):
+    """代替真实分析流程的假 LLM：直接返回固定结果"""
+    return {'type': '1', 'description': '假 LLM 结果', 'model': job['payload']['provider']}
+
+
+def failing_runner(job):
+    raise RuntimeError('LLM 不可用')
+
+
+@pytest.fixture(autouse=True)
+def job_config(monkeypatch):
+    monkeypatch.setattr(Config, 'JOB_MAX_PENDING', 10)
+    monkeypatch.setattr(Config, 'JOB_STALE_SECONDS', 60)
+    monkeypatch.setattr(Config, 'JOB_POLL_INTERVAL', 0.01)
+
+
+def make_job(job_id='job-1', status=JOB_QUEUED, **fields):
+    job = {
+        '_id': job_id,
+        'status': status,
+        'payload': {'image_path': f'/tmp/{job_id}.jpg', 'provider': 'gemini'},
+        'attempts': 0,
+        'created_at': datetime.now(),
+    }
+    job.update(fields)
+    return job
+
+
+def test_submit_runs_job_and_stores_result():
+    queue = JobQueue(runner=fake_llm_runner, store=MemoryJobStore(), max_workers=1)
+    job_id = queue.submit({'image_path': '/tmp/a.jpg', 'provider': 'gpt4o'})
+
+    job = queue.wait(job_id, timeout=5)
+
+    assert job['status'] == JOB_SUCCEEDED
+    assert job['attempts'] == 1
+    assert job['result']['model'] == 'gpt4o'
+    data = serialize_job(job)
+    assert data['result']['description'] == '假 LLM 结果'
+    assert 'finished_at' in data
+
+
+def test_runner_error_marks_job_failed():
+    queue = JobQueue(runner=failing_runner, store=MemoryJobStore(), max_workers=1)
+    job_id = queue.submit({'image_path': '/tmp/a.jpg', 'provider': 'gemini'})
+
+    job = queue.wait(job_id, timeout=5)
+
+    assert job['status'] == JOB_FAILED
+    assert serialize_job(job)['error'] == 'LLM 不可用'
+
+
+def test_submit_rejects_when_queue_full(monkeypatch):
+    monkeypatch.setattr(Config, 'JOB_MAX_PENDING', 1)
+    release = threading.Event()
+
+    def blocking_runner(job):
+        release.wait(5)
+        return {}
+
+    queue = JobQueue(runner=blocking_runner, store=MemoryJobStore(), max_workers=1)
+    job_id = queue.submit({'image_path': '/tmp/a.jpg', 'provider': 'gemini'})
+    try:
+        with pytest.raises(RuntimeError):
+            queue.submit({'image_path': '/tmp/b.jpg', 'provider': 'gemini'})
+    finally:
+        release.set()
+    assert queue.wait(job_id, timeout=5)['status'] == JOB_SUCCEEDED
+
+
+def test_claim_is_exclusive():
+    store = MemoryJobStore()
+    store.create(make_job())
+
+    claimed = store.claim('job-1', 'worker-a')
+
+    assert claimed['status'] == JOB_RUNNING
+    assert claimed['worker'] == 'worker-a'
+    assert claimed['attempts'] == 1
+    assert store.claim('job-1', 'worker-b') is None
+    assert store.claim('missing', 'worker-b') is None
+
+
+def test_requeue_stale_only_requeues_old_running_jobs():
+    store = MemoryJobStore()
+    now = datetime.now()
+    store.create(make_job('stale', JOB_RUNNING, started_at=now - timedelta(minutes=10)))
+    store.create(make_job('active', JOB_RUNNING, started_at=now))
+    store.create(make_job('done', JOB_SUCCEEDED, started_at=now - timedelta(minutes=10)))
+
+    assert store.requeue_stale(now - timedelta(minutes=5)) == 1
+    assert store.get('stale')['status'] == JOB_QUEUED
+    assert store.get('active')['status'] == JOB_RUNNING
+    assert store.get('done')['status'] == JOB_SUCCEEDED
+    assert [job['_id'] for job in store.find_queued()] == ['stale']
+
+
+def test_start_resumes_queued_and_stale_jobs():
+    store = MemoryJobStore()
+    store.create(make_job('queued'))
+    store.create(make_job('stale', JOB_RUNNING, attempts=1,
+                          started_at=datetime.now() - timedelta(minutes=10)))
+    queue = JobQueue(runner=fake_llm_runner, store=store, max_workers=2)
+
+    assert queue.start() == 2
+
+    assert queue.wait('queued', timeout=5)['status'] == JOB_SUCCEEDED
+    stale = queue.wait('stale', timeout=5)
+    assert stale['status'] == JOB_SUCCEEDED
+    assert stale['attempts'] == 2
+
+
+def test_requeue_uses_heartbeat_age():
+    store = MemoryJobStore()
+    now = datetime.now()
+    store.create(make_job('alive', JOB_RUNNING, worker='w',
+                          started_at=now - timedelta(hours=1), heartbeat_at=now))
+    store.create(make_job('dead', JOB_RUNNING, worker='w',
+                          started_at=now - timedelta(minutes=3), heartbeat_at=now - timedelta(minutes=3)))
+
+    assert store.requeue_stale(now - timedelta(minutes=2)) == 1
+    assert store.get('alive')['status'] == JOB_RUNNING
+    assert store.get('dead')['status'] == JOB_QUEUED
+
+
+def test_finish_rejected_after_job_was_requeued():
+    store = MemoryJobStore()
+    store.create(make_job())
+    store.claim('job-1', 'worker-a')
+    store.requeue_stale(datetime.now() + timedelta(seconds=1))
+    store.claim('job-1', 'worker-b')
+
+    assert not store.finish('job-1', 'worker-a', {'status': JOB_SUCCEEDED})
+    assert store.finish('job-1', 'worker-b', {'status': JOB_SUCCEEDED})
+    assert store.get('job-1')['status'] == JOB_SUCCEEDED
+
+
+def test_recover_picks_up_jobs_of_dead_worker(monkeypatch):
+    monkeypatch.setattr(Config, 'JOB_STALE_SECONDS', 1)
+    store = MemoryJobStore()
+    long_ago = datetime.now() - timedelta(minutes=1)
+    store.create(make_job('orphan', JOB_RUNNING, worker='dead-worker', attempts=1,
+                          started_at=long_ago, heartbeat_at=long_ago))
+    queue = JobQueue(runner=fake_llm_runner, store=store, max_workers=1)
+
+    assert queue.recover() == 1
+
+    job = queue.wait('orphan', timeout=5)
+    assert job['status'] == JOB_SUCCEEDED
+    assert job['worker'] == queue.worker_id
+    assert job['attempts'] == 2
+
+
+class TestMongoJobStore:
+    @pytest.fixture
+    def store(self):
+        mongomock = pytest.importorskip('mongomock')
+        from services.job_queue import MongoJobStore
+        return MongoJobStore(mongomock.MongoClient().db)
+
+    def test_ttl_index_on_finished_at(self, store):
+        indexes = store.collection.index_information()
+        ttl = [info for info in indexes.values() if info['key'] == [('finished_at', 1)]]
+        assert ttl and ttl[0]['expireAfterSeconds'] == Config.JOB_RESULT_TTL
+
+    def test_claim_heartbeat_and_finish(self, store):
+        store.create(make_job())
+
+        claimed = store.claim('job-1', 'worker-a')
+        assert claimed['status'] == JOB_RUNNING
+        assert claimed['attempts'] == 1
+        assert claimed['heartbeat_at'] is not None
+        assert store.claim('job-1', 'worker-b') is None
+
+        assert store.heartbeat(['job-1'], 'worker-b') == 0
+        assert store.heartbeat(['job-1'], 'worker-a') == 1
+        assert not store.finish('job-1', 'worker-b', {'status': JOB_SUCCEEDED})
+        assert store.finish('job-1', 'worker-a', {'status': JOB_SUCCEEDED, 'finished_at': datetime.now()})
+        assert store.get('job-1')['status'] == JOB_SUCCEEDED
+
+    def test_requeue_stale(self, store):
+        now = datetime.now()
+        store.create(make_job('dead', JOB_RUNNING, heartbeat_at=now - timedelta(minutes=5)))
+        store.create(make_job('alive', JOB_RUNNING, heartbeat_at=now))
+        store.create(make_job('legacy', JOB_RUNNING, started_at=now - timedelta(minutes=5)))
+
+        assert store.requeue_stale(now - timedelta(minutes=2)) == 2
+        assert sorted(job['_id'] for job in store.find_queued()) == ['dead', 'legacy']
+        assert store.get('alive')['status'] == JOB_RUNNING
+
+    def test_create_respects_max_pending(self, store):
+        assert store.create(make_job('a'), max_pending=1)
+        assert not store.create(make_job('b'), max_pending=1)
+        assert store.get('b') is None
+        assert store.count_pending() == 1
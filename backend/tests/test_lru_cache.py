@@ -0,0 +1,99 @@
+import pytest
+
+import utils.lru_cache as lru_cache
+from utils.lru_cache import MISSING, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(lru_cache, 'time', clock)
+    return clock
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(10, ttl=5)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=20)
+    cache.set('c', 3, ttl=0)
+
+    clock.now += 5
+    assert cache.get('a') is MISSING
+    assert cache.get('b') == 2
+    clock.now += 1000
+    assert cache.get('b', None) is None
+    # ttl=0 的条目不过期
+    assert cache.get('c') == 3
+    assert cache.expirations == 2
+    assert len(cache) == 1
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.evictions == 1
+
+
+def test_overwrite_refreshes_recency_and_value(clock):
+    cache = TTLCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.set('a', 10)
+    cache.set('c', 3)
+
+    assert cache.get('a') == 10
+    assert cache.get('b') is MISSING
+
+
+def test_stats_counters(clock):
+    cache = TTLCache(1, ttl=1)
+    cache.get('a')
+    cache.set('a', 1)
+    cache.get('a')
+    cache.set('b', 2)
+    clock.now += 2
+    cache.get('b')
+
+    assert cache.stats() == {
+        'size': 0,
+        'max_size': 1,
+        'ttl': 1,
+        'hits': 1,
+        'misses': 2,
+        'hit_rate': pytest.approx(1 / 3),
+        'evictions': 1,
+        'expirations': 1,
+    }
+
+
+def test_zero_size_cache_stores_nothing(clock):
+    cache = TTLCache(0)
+    cache.set('a', 1)
+
+    assert cache.get('a') is MISSING
+    assert len(cache) == 0
+
+
+def test_pop_and_clear(clock):
+    cache = TTLCache(3)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.pop('a')
+    cache.pop('missing')
+    assert cache.get('a') is MISSING
+    cache.clear()
+    assert len(cache) == 0
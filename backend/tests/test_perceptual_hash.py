@@ -0,0 +1,105 @@
+import io
+import random
+
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+from config import Config
+from utils.perceptual_hash import BKTree, dhash, hamming_distance, image_dhash
+
+
+def scene(size=(640, 480)):
+    """带有明显结构的测试图片：渐变背景加几个色块"""
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    draw.rectangle([width * 0.1, height * 0.2, width * 0.4, height * 0.7], fill=(220, 40, 40))
+    draw.ellipse([width * 0.55, height * 0.1, width * 0.9, height * 0.5], fill=(30, 30, 200))
+    draw.line([0, height, width, height * 0.6], fill=(250, 250, 0), width=max(1, width // 40))
+    return image
+
+
+def jpeg_bytes(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def test_hamming_distance():
+    assert hamming_distance(0b1011, 0b1011) == 0
+    assert hamming_distance(0b1011, 0b0010) == 2
+    assert hamming_distance(0, (1 << 64) - 1) == 64
+
+
+def test_dhash_stable_under_resize_and_reencode():
+    original = scene()
+    original_hash = int(image_dhash(jpeg_bytes(original, 95)), 16)
+
+    resized = int(image_dhash(jpeg_bytes(original.resize((320, 240)), 95)), 16)
+    recompressed = int(image_dhash(jpeg_bytes(original, 40)), 16)
+
+    assert hamming_distance(original_hash, resized) <= Config.NEAR_DUP_MAX_DISTANCE
+    assert hamming_distance(original_hash, recompressed) <= Config.NEAR_DUP_MAX_DISTANCE
+
+
+def test_dhash_separates_different_images():
+    original = dhash(scene())
+    different = dhash(scene().transpose(Image.Transpose.FLIP_LEFT_RIGHT).filter(ImageFilter.GaussianBlur(2)))
+
+    assert hamming_distance(original, different) > Config.NEAR_DUP_MAX_DISTANCE
+
+
+def test_image_dhash_is_fixed_width_hex():
+    value = image_dhash(jpeg_bytes(scene(), 90))
+    assert len(value) == 16
+    int(value, 16)
+
+
+@pytest.fixture
+def tree():
+    tree = BKTree()
+    for value in (0b0, 0b1, 0b11, 0b111111, (1 << 64) - 1):
+        tree.add(value, f'item-{value}')
+    return tree
+
+
+def test_bktree_search_returns_items_within_radius_sorted(tree):
+    results = tree.search(0b0, 2)
+
+    assert results == [(0, 'item-0'), (1, 'item-1'), (2, 'item-3')]
+
+
+def test_bktree_radius_boundary_is_inclusive():
+    radius = Config.NEAR_DUP_MAX_DISTANCE
+    tree = BKTree()
+    at_boundary = (1 << radius) - 1
+    beyond = (1 << (radius + 1)) - 1
+    tree.add(0, 'origin')
+    tree.add(at_boundary, 'boundary')
+    tree.add(beyond, 'beyond')
+
+    found = dict((item, distance) for distance, item in tree.search(0, radius))
+
+    assert found == {'origin': 0, 'boundary': radius}
+
+
+def test_bktree_keeps_items_with_identical_hash(tree):
+    tree.add(0b11, 'another')
+
+    assert len(tree) == 6
+    assert sorted(item for distance, item in tree.search(0b11, 0)) == ['another', 'item-3']
+
+
+def test_bktree_matches_linear_scan():
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    tree = BKTree()
+    for index, value in enumerate(values):
+        tree.add(value, index)
+    query = values[0] ^ 0b1010_0101
+
+    expected = sorted(
+        (hamming_distance(query, value), index) for index, value in enumerate(values)
+        if hamming_distance(query, value) <= 20
+    )
+    assert sorted(tree.search(query, 20)) == expected
@@ -0,0 +1,77 @@
+import pytest
+
+from services.prompt_builder import (
+    EXAMPLES_HEADER,
+    SIMILAR_HEADER,
+    PromptBuilder,
+    estimate_tokens,
+    truncate_text,
+)
+
+
+def case(hazard_type, description):
+    return {'type': hazard_type, 'description': description, 'suggestion': '立即整改'}
+
+
+@pytest.fixture
+def builder():
+    return PromptBuilder(budgets={'gemini': 100000, 'default': 100000}, max_description_chars=40)
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert estimate_tokens('配电箱') == 3
+    assert estimate_tokens('abcd' * 3) == 3
+    assert estimate_tokens('配电箱 abcd') == 3 + 2
+
+
+def test_truncate_text_collapses_whitespace_and_marks_cut():
+    assert truncate_text('a  b\n c', 10) == 'a b c'
+    assert truncate_text('一二三四五六', 4) == '一二三…'
+
+
+def test_similar_cases_come_after_examples_and_in_input_order(builder):
+    prompt, tokens = builder.build(
+        [case('1', '相似案例甲'), case('2', '相似案例乙')],
+        [case('3', '示例丙')],
+    )
+
+    assert prompt.index(EXAMPLES_HEADER) < prompt.index(SIMILAR_HEADER)
+    assert prompt.index('相似案例甲') < prompt.index('相似案例乙')
+    assert '相似案例1:' in prompt and '相似案例2:' in prompt and '示例1:' in prompt
+    assert tokens == estimate_tokens(prompt)
+
+
+def test_duplicate_descriptions_are_kept_once(builder):
+    prompt, _ = builder.build(
+        [case('1', '未穿反光衣'), case('1', '未穿反光衣'), case('2', '未穿反光衣')],
+        [case('1', '未穿反光衣'), case('4', '灭火器缺失')],
+    )
+
+    assert prompt.count('未穿反光衣') == 2
+    assert prompt.count('灭火器缺失') == 1
+    assert builder.stats()['gemini']['dropped_items'] == 2
+
+
+def test_budget_prefers_similar_cases_and_is_respected():
+    roomy = PromptBuilder(budgets={'default': 100000}, max_description_chars=40)
+    similar = [case('1', f'相似案例描述{i}' * 3) for i in range(3)]
+    examples = [case('2', f'示例描述{i}' * 3) for i in range(3)]
+    full_prompt, full_tokens = roomy.build(similar, examples, provider='gpt4o')
+    # 只够放下相似案例的预算
+    similar_only, _ = roomy.build(similar, [], provider='gpt4o')
+    budget = estimate_tokens(similar_only) + 5
+
+    tight = PromptBuilder(budgets={'default': budget}, max_description_chars=40)
+    prompt, tokens = tight.build(similar, examples, provider='gpt4o')
+
+    assert tokens <= budget < full_tokens
+    assert all(item['description'] in prompt for item in similar)
+    assert EXAMPLES_HEADER not in prompt
+    assert tight.stats()['gpt4o']['dropped_items'] == 3
+
+
+def test_long_descriptions_are_truncated(builder):
+    prompt, _ = builder.build([case('1', '很长的描述' * 50)], [])
+
+    assert '很长的描述' * 50 not in prompt
+    assert truncate_text('很长的描述' * 50, 40) in prompt
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from services.retrieval_backends import BruteForceBackend, create_backend
+
+pytest.importorskip('faiss')
+
+FAISS_BACKENDS = [
+    ('faiss_flat', {}),
+    # nprobe 等于 nlist 时 IVF 扫描全部倒排表，结果应与精确检索一致
+    ('faiss_ivf', {'nlist': 4, 'nprobe': 4}),
+    ('faiss_hnsw', {'m': 16, 'ef_construction': 200, 'ef_search': 128}),
+]
+
+
+def normalized(rows, dim=32, seed=0):
+    matrix = np.random.default_rng(seed).normal(size=(rows, dim)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def data():
+    return normalized(200), normalized(20, seed=1)
+
+
+@pytest.mark.parametrize('name, params', FAISS_BACKENDS)
+def test_faiss_top1_matches_bruteforce(data, name, params):
+    matrix, queries = data
+    exact = BruteForceBackend()
+    exact.build(matrix)
+    backend = create_backend(name, params)
+    backend.build(matrix)
+
+    exact_scores, exact_indices = exact.search(queries, 5)
+    scores, indices = backend.search(queries, 5)
+
+    assert backend.name == name
+    np.testing.assert_array_equal(indices[:, 0], exact_indices[:, 0])
+    np.testing.assert_allclose(scores[:, 0], exact_scores[:, 0], rtol=1e-5)
+
+
+def test_ivf_nlist_is_clamped_to_training_rows():
+    matrix = normalized(3)
+    backend = create_backend('faiss_ivf', {'nlist': 100, 'nprobe': 100})
+    backend.build(matrix)
+
+    _, indices = backend.search(matrix, 1)
+
+    assert backend.index.nlist == 3
+    np.testing.assert_array_equal(indices[:, 0], [0, 1, 2])
+
+
+@pytest.mark.parametrize('name, params', [('bruteforce', {})] + FAISS_BACKENDS)
+def test_with_added_appends_without_touching_original(data, name, params):
+    matrix, queries = data
+    backend = create_backend(name, params)
+    backend.build(matrix[:150])
+
+    grown = backend.with_added(matrix[150:])
+
+    assert backend.ntotal == 150
+    assert grown.ntotal == 200
+    _, indices = grown.search(matrix[150:], 1)
+    np.testing.assert_array_equal(indices[:, 0], np.arange(150, 200))
+
+
+@pytest.mark.parametrize('name, params', [('bruteforce', {})] + FAISS_BACKENDS)
+def test_save_and_load_round_trip(data, tmp_path, name, params):
+    matrix, queries = data
+    backend = create_backend(name, params)
+    backend.build(matrix)
+    path = str(tmp_path / f'{name}.index')
+    backend.save(path)
+
+    loaded = create_backend(name, params)
+    loaded.load(path)
+
+    assert loaded.ntotal == backend.ntotal
+    np.testing.assert_array_equal(loaded.search(queries, 3)[1], backend.search(queries, 3)[1])
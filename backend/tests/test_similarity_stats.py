@@ -0,0 +1,78 @@
+import pytest
+
+from services.similarity_stats import SimilarityStats
+
+
+@pytest.fixture
+def db():
+    mongomock = pytest.importorskip('mongomock')
+    return mongomock.MongoClient().db
+
+
+def result(hazard_type='1', bert=None, tfidf=None, **fields):
+    data = {'type': hazard_type, **fields}
+    if bert is not None:
+        data['bert_similarity'] = bert
+    if tfidf is not None:
+        data['tfidf_similarity'] = tfidf
+    return data
+
+
+def insert_cache(db, image_hash, model, data):
+    db.analysis_cache.insert_one({'image_hash': image_hash, 'model': model, 'result': data})
+
+
+def test_record_and_rebuild_agree(db):
+    stats = SimilarityStats(db)
+    entries = [
+        ('a', 'gemini', result('1', 0.8, 0.4)),
+        ('b', 'gemini', result('2', 0.0, 0.0)),
+        ('c', 'gpt4o', result('1', 0.6, 0.2)),
+        ('d', 'gemini', result('1', 0.9, 0.9, decision_path='cascade')),
+    ]
+    for image_hash, model, data in entries:
+        insert_cache(db, image_hash, model, data)
+        stats.record(model, data)
+    recorded = stats.get_stats(rebuild_if_missing=False)
+
+    rebuilt = stats.rebuild()
+
+    assert rebuilt['all'] == pytest.approx(recorded['all'])
+    assert rebuilt['by_model']['gemini']['by_type'] == recorded['by_model']['gemini']['by_type']
+    # 0 分结果不计入平均值，但计入 /similarity/stats 原有口径的 scored_count
+    assert rebuilt['all']['count'] == 2
+    assert rebuilt['all']['scored_count'] == 3
+    assert rebuilt['all']['scored_bert_avg'] == pytest.approx((0.8 + 0.0 + 0.6) / 3)
+
+
+def test_record_during_rebuild_is_replayed(db, monkeypatch):
+    stats = SimilarityStats(db)
+    insert_cache(db, 'a', 'gemini', result('1', 0.8, 0.4))
+    original_aggregate = db.analysis_cache.aggregate
+
+    def aggregate_with_concurrent_write(pipeline):
+        groups = list(original_aggregate(pipeline))
+        # 聚合完成后、替换统计前另一个请求写入了新结果
+        stats.record('gemini', result('1', 0.6, 0.2))
+        return groups
+
+    monkeypatch.setattr(db.analysis_cache, 'aggregate', aggregate_with_concurrent_write)
+    rebuilt = stats.rebuild()
+
+    assert rebuilt['all']['count'] == 2
+    assert rebuilt['all']['bert_avg'] == pytest.approx(0.7)
+    assert db.similarity_stats_journal.count_documents({}) == 0
+    assert stats._rebuilding() is None
+
+    stats.record('gemini', result('1', 0.4, 0.1))
+    assert stats.get_stats()['all']['count'] == 3
+
+
+def test_stats_from_older_version_are_rebuilt(db):
+    insert_cache(db, 'a', 'gemini', result('1', 0.5, 0.5))
+    db.similarity_stats.insert_one({'_id': 'meta'})
+
+    data = SimilarityStats(db).get_stats()
+
+    assert data['all']['scored_count'] == 1
+    assert data['rebuilt_at'] is not None
@@ -0,0 +1,16 @@
+import hashlib
+
+
+def compute_content_hash(image_source, chunk_size: int = 1024 * 1024) -> str:
+    """计算图片路径或图片字节的MD5
+
+    分析结果缓存、特征存储、案例导入和上传处理都使用这个哈希作为图片的内容标识。
+    """
+    hash_md5 = hashlib.md5()
+    if isinstance(image_source, (bytes, bytearray, memoryview)):
+        hash_md5.update(image_source)
+    else:
+        with open(image_source, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                hash_md5.update(chunk)
+    return hash_md5.hexdigest()
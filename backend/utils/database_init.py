@@ -1,22 +1,29 @@
+import argparse
 import os
 import json
 import re
 import sys
+import threading
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir)
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, DuplicateKeyError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError
 from config import Config
-from services.clip_service import CLIPService
-from utils.image_processor import ImageProcessor
+from services.case_index import CaseIndex
+from services.database import acquire_lease, get_mongo_client, lease_owner, release_lease
+from services.model_registry import get_model_registry
+from services.similarity_stats import SimilarityStats
+from utils.feature_codec import encode_features, decode_features, DTYPE_TO_FORMAT
+from utils.content_hash import compute_content_hash
 
 def init_database():
     """初始化数据库和索引"""
     try:
         # 连接MongoDB
-        client = MongoClient(Config.MONGODB_URI, serverSelectionTimeoutMS=5000)
+        client = get_mongo_client()
         
         # 测试连接
         client.admin.command('ping')
@@ -34,6 +41,10 @@ def init_database():
         cases_collection.create_index("type")
         cases_collection.create_index("filename")
         cases_collection.create_index("image_id")
+        cases_collection.create_index("updated_at")
+        # 历史列表按 (created_at, _id) 游标分页
+        cases_collection.create_index([("created_at", -1), ("_id", -1)])
+        cases_collection.create_index([("type", 1), ("created_at", -1), ("_id", -1)])
         cases_collection.create_index([("type", 1), ("image_id", 1)], unique=True)
         
         # 创建文本搜索索引
@@ -107,8 +118,179 @@ def load_hazard_descriptions():
     
     return descriptions, categories
 
-def load_dataset():
-    """加载数据集到数据库"""
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def parse_image_filename(filename):
+    """解析文件名（格式: 类型-编号.ext），返回 (hazard_type, image_id)，格式不正确时返回 None"""
+    name_without_ext = os.path.splitext(filename)[0]
+    parts = name_without_ext.split('-')
+    if len(parts) >= 2:
+        return parts[0], parts[1]
+    return None
+
+def load_manifest(path=None):
+    """读取导入清单 {filename: {hash, size, mtime, ingested_at}}"""
+    path = path or Config.INGEST_MANIFEST_PATH
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️  读取导入清单失败，将重新扫描: {e}")
+        return {}
+
+def save_manifest(manifest, path=None):
+    """原子写入导入清单，作为断点续传的检查点"""
+    path = path or Config.INGEST_MANIFEST_PATH
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # 每个写入者使用独立的临时文件，避免多个进程同时写同一个 .tmp
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _scan_file(image_folder, filename, manifest):
+    """读取文件状态；大小和修改时间未变时沿用清单中的哈希，避免重新读取"""
+    image_path = os.path.join(image_folder, filename)
+    stat = os.stat(image_path)
+    entry = manifest.get(filename)
+    if entry and entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+        content_hash = entry['hash']
+    else:
+        content_hash = compute_content_hash(image_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': content_hash}
+
+def scan_dataset_files(image_folder, image_files, manifest, workers=None):
+    """并行读取文件状态，返回 ({filename: state}, 错误数)"""
+    states = {}
+    error_count = 0
+    with ThreadPoolExecutor(max_workers=workers or Config.INGEST_WORKERS) as pool:
+        futures = {
+            filename: pool.submit(_scan_file, image_folder, filename, manifest)
+            for filename in image_files
+            if parse_image_filename(filename)
+        }
+        for filename in image_files:
+            if filename not in futures:
+                print(f"⚠️  文件名格式不正确: {filename}")
+                error_count += 1
+                continue
+            try:
+                states[filename] = futures[filename].result()
+            except Exception as e:
+                print(f"❌ 读取文件 {filename} 时出错: {str(e)}")
+                error_count += 1
+    return states, error_count
+
+def _prepare_image(image_processor, clip_service, image_path):
+    """解码并预处理一张图片，返回 CLIP 输入张量"""
+    if not image_processor.validate_image(image_path):
+        raise ValueError("无效图片文件")
+    processed_image = image_processor.process_image(image_path)
+    return clip_service.preprocess(processed_image)
+
+def ingest_files(db, image_folder, file_states, descriptions, categories, manifest,
+                 workers=None, batch_size=None):
+    """并行解码、批量编码并批量写入指定文件，每批写入后更新清单
+
+    file_states: {filename: {'size', 'mtime', 'hash'}}
+    返回 (统计信息, 写入的文件名列表)
+    """
+    workers = workers or Config.INGEST_WORKERS
+    batch_size = batch_size or Config.INGEST_BATCH_SIZE
+    registry = get_model_registry()
+    clip_service = registry.get_clip_service()
+    image_processor = registry.get_image_processor()
+
+    stats = {'loaded': 0, 'updated': 0, 'errors': 0}
+    written = []
+    filenames = sorted(file_states)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(filenames), batch_size):
+            batch = filenames[start:start + batch_size]
+            print(f"🔄 处理进度: {start + len(batch)}/{len(filenames)}")
+
+            # 1. 并行解码和预处理
+            futures = {
+                filename: pool.submit(
+                    _prepare_image, image_processor, clip_service,
+                    os.path.join(image_folder, filename),
+                )
+                for filename in batch
+            }
+            prepared = []
+            for filename in batch:
+                try:
+                    prepared.append((filename, futures[filename].result()))
+                except Exception as e:
+                    print(f"❌ 处理文件 {filename} 时出错: {str(e)}")
+                    stats['errors'] += 1
+            if not prepared:
+                continue
+
+            # 2. 批量编码
+            try:
+                features = clip_service.encode_preprocessed([tensor for _, tensor in prepared])
+                features = features.float().cpu().numpy()
+            except Exception as e:
+                print(f"❌ 批量编码失败: {e}")
+                stats['errors'] += len(prepared)
+                continue
+
+            # 3. 批量写入
+            now = datetime.now()
+            operations = []
+            for (filename, _), vector in zip(prepared, features):
+                hazard_type, image_id = parse_image_filename(filename)
+                image_path = os.path.join(image_folder, filename)
+                # 构建描述键（格式: 1-1）
+                desc_key = f"{hazard_type}-{image_id}"
+                description = descriptions.get(desc_key, f"隐患类型{hazard_type}的示例图片")
+                category_desc = categories.get(hazard_type, f"隐患类型{hazard_type}")
+                case_data = {
+                    'filename': filename,
+                    'type': hazard_type,
+                    'image_id': image_id,
+                    **encode_features(vector),
+                    'content_hash': file_states[filename]['hash'],
+                    'description': description,
+                    'category_description': category_desc,
+                    'suggestion': generate_suggestion(hazard_type, category_desc),
+                    'image_path': image_path,
+                    'updated_at': now,
+                    'file_size': file_states[filename]['size'],
+                    'file_type': os.path.splitext(filename)[1].lower()
+                }
+                operations.append(UpdateOne(
+                    {'filename': filename},
+                    {'$set': case_data, '$setOnInsert': {'created_at': now}},
+                    upsert=True,
+                ))
+            try:
+                result = db.cases.bulk_write(operations, ordered=False)
+                stats['loaded'] += result.upserted_count
+                stats['updated'] += len(operations) - result.upserted_count
+            except BulkWriteError as e:
+                failed = {error['index'] for error in e.details.get('writeErrors', [])}
+                print(f"⚠️  批量写入部分失败: {len(failed)} 个文档")
+                stats['errors'] += len(failed)
+                stats['loaded'] += e.details.get('nUpserted', 0)
+                stats['updated'] += len(operations) - len(failed) - e.details.get('nUpserted', 0)
+                prepared = [item for i, item in enumerate(prepared) if i not in failed]
+
+            # 4. 更新检查点
+            for filename, _ in prepared:
+                manifest[filename] = dict(file_states[filename], ingested_at=now.isoformat())
+                written.append(filename)
+            save_manifest(manifest)
+
+    return stats, written
+
+def load_dataset(force=False, workers=None, batch_size=None):
+    """加载数据集到数据库（并行、可断点续传，未变化的文件按内容哈希跳过）"""
     # 初始化数据库
     db = init_database()
     if db is None:
@@ -117,13 +299,8 @@ def load_dataset():
         # 加载描述文档
         descriptions, categories = load_hazard_descriptions()
         
-        # 初始化服务
-        print("🔄 正在初始化CLIP服务...")
-        clip_service = CLIPService()
-        image_processor = ImageProcessor()
-        
         # 图片文件夹路径
-        image_folder = "datasets/隐患数据集/隐患数据集/隐患图片"
+        image_folder = Config.DATASET_PATH
         
         if not os.path.exists(image_folder):
             print(f"❌ 图片文件夹不存在: {image_folder}")
@@ -131,92 +308,41 @@ def load_dataset():
         
         # 获取所有图片文件
         image_files = [f for f in os.listdir(image_folder) 
-                      if f.lower().endswith(('.png', '.jpg', '.jpeg', '.PNG', '.JPG', '.JPEG'))]
+                      if f.lower().endswith(IMAGE_EXTENSIONS)]
         
         print(f"📁 找到 {len(image_files)} 个图片文件")
-        
-        loaded_count = 0
-        updated_count = 0
-        error_count = 0
+
+        manifest = {} if force else load_manifest()
+        # 数据库中已有文档的内容哈希，清单与数据库都一致时才跳过
+        existing_hashes = {
+            doc['filename']: doc.get('content_hash')
+            for doc in db.cases.find({}, {'filename': 1, 'content_hash': 1})
+        }
+
+        workers = workers or Config.INGEST_WORKERS
+        scanned, error_count = scan_dataset_files(image_folder, image_files, manifest, workers)
         skipped_count = 0
-        
-        for i, filename in enumerate(image_files, 1):
-            try:
-                print(f"🔄 处理进度: {i}/{len(image_files)} - {filename}")
-                
-                # 解析文件名获取类型和编号
-                name_without_ext = os.path.splitext(filename)[0]
-                parts = name_without_ext.split('-')
-                
-                if len(parts) >= 2:
-                    hazard_type = parts[0]
-                    image_id = parts[1]
-                    
-                    image_path = os.path.join(image_folder, filename)
-                    
-                    # 验证图片文件
-                    if not image_processor.validate_image(image_path):
-                        print(f"⚠️  无效图片文件: {filename}")
-                        error_count += 1
-                        continue
-                    
-                    # 处理图片
-                    processed_image = image_processor.process_image(image_path)
-                    
-                    # 提取特征向量
-                    features = clip_service.encode_image(processed_image)
-                    
-                    # 构建描述键（格式: 1-1）
-                    desc_key = f"{hazard_type}-{image_id}"
-                    description = descriptions.get(desc_key, f"隐患类型{hazard_type}的示例图片")
-                    category_desc = categories.get(hazard_type, f"隐患类型{hazard_type}")
-                    
-                    # 存储到数据库
-                    case_data = {
-                        'filename': filename,
-                        'type': hazard_type,
-                        'image_id': image_id,
-                        'features': features.tolist(),
-                        'description': description,
-                        'category_description': category_desc,
-                        'suggestion': generate_suggestion(hazard_type, category_desc),
-                        'image_path': image_path,
-                        'created_at': datetime.now(),
-                        'updated_at': datetime.now(),
-                        'file_size': os.path.getsize(image_path),
-                        'file_type': os.path.splitext(filename)[1].lower()
-                    }
-                    
-                    # 检查是否已存在
-                    existing = db.cases.find_one({'filename': filename})
-                    if existing:
-                        # 更新现有记录
-                        case_data['created_at'] = existing.get('created_at', datetime.now())
-                        db.cases.update_one(
-                            {'filename': filename}, 
-                            {'$set': case_data}
-                        )
-                        updated_count += 1
-                        print(f"🔄 已更新: {filename}")
-                    else:
-                        # 插入新记录
-                        db.cases.insert_one(case_data)
-                        loaded_count += 1
-                        print(f"✅ 已加载: {filename}")
-                    
-                else:
-                    print(f"⚠️  文件名格式不正确: {filename}")
-                    error_count += 1
-                    
-            except Exception as e:
-                print(f"❌ 处理文件 {filename} 时出错: {str(e)}")
-                error_count += 1
+        file_states = {}
+        for filename, state in scanned.items():
+            if (not force
+                    and existing_hashes.get(filename) == state['hash']
+                    and manifest.get(filename, {}).get('hash') == state['hash']):
+                skipped_count += 1
+                continue
+            file_states[filename] = state
+
+        print(f"🔄 需要导入 {len(file_states)} 个文件，跳过 {skipped_count} 个未变化的文件")
+        stats, written = ingest_files(
+            db, image_folder, file_states, descriptions, categories, manifest,
+            workers=workers, batch_size=batch_size,
+        )
         
         # 显示统计结果
         print(f"\n📊 数据集加载完成:")
-        print(f"✅ 成功加载: {loaded_count} 个文件")
-        print(f"🔄 更新文件: {updated_count} 个文件")
-        print(f"❌ 错误文件: {error_count} 个文件")
+        print(f"✅ 成功加载: {stats['loaded']} 个文件")
+        print(f"🔄 更新文件: {stats['updated']} 个文件")
+        print(f"⏭️  跳过文件: {skipped_count} 个文件")
+        print(f"❌ 错误文件: {error_count + stats['errors']} 个文件")
         
         # 显示数据库统计
         total_docs = db.cases.count_documents({})
@@ -231,10 +357,217 @@ def load_dataset():
         print("📋 按类型统计:")
         for stat in type_stats:
             print(f"   类型 {stat['_id']}: {stat['count']} 个文件")
+        
+        # 构建检索索引文件
+        if written or force:
+            build_retrieval_index(db)
             
     except Exception as e:
         print(f"❌ 数据集加载失败: {e}")
 
+_sync_lock = threading.Lock()
+
+def sync_dataset(db=None, case_index=None, workers=None, batch_size=None):
+    """增量同步数据集目录：只编码新增或内容变化的图片，并删除图片已移除的案例
+
+    传入 case_index 时（服务进程内）直接更新内存中的检索索引并写回索引文件，无需重启；
+    多个进程通过数据库租约互斥，同一时间只有一个进程执行同步。
+    返回 {'added', 'changed', 'removed', 'errors'} 统计，目录不可用或其他进程正在同步时返回 None。
+    """
+    if db is None:
+        db = init_database()
+        if db is None:
+            return None
+    image_folder = Config.DATASET_PATH
+    if not os.path.isdir(image_folder):
+        print(f"❌ 图片文件夹不存在: {image_folder}")
+        return None
+
+    with _sync_lock:
+        owner = lease_owner()
+        if not acquire_lease(db, 'dataset_sync', Config.DATASET_SYNC_LEASE_TTL, owner):
+            print("⏳ 其他进程正在同步数据集，跳过本次同步")
+            return None
+        try:
+            return _sync_dataset_locked(db, image_folder, case_index, workers, batch_size)
+        finally:
+            release_lease(db, 'dataset_sync', owner)
+
+def _sync_dataset_locked(db, image_folder, case_index, workers, batch_size):
+    """持有同步租约后执行的增量同步"""
+    image_files = [f for f in os.listdir(image_folder)
+                   if f.lower().endswith(IMAGE_EXTENSIONS)]
+    manifest = load_manifest()
+    existing = {
+        doc['filename']: doc
+        for doc in db.cases.find({}, {'filename': 1, 'content_hash': 1})
+    }
+    scanned, error_count = scan_dataset_files(image_folder, image_files, manifest, workers)
+
+    file_states = {
+        filename: state for filename, state in scanned.items()
+        if existing.get(filename, {}).get('content_hash') != state['hash']
+    }
+    present = set(image_files)
+    removed_docs = [doc for filename, doc in existing.items() if filename not in present]
+    if removed_docs and not image_files:
+        # 目录为空多半是挂载或拷贝异常，不据此清空案例库
+        print("⚠️  数据集目录为空，跳过删除案例")
+        removed_docs = []
+
+    stats = {
+        'added': sum(1 for filename in file_states if filename not in existing),
+        'changed': sum(1 for filename in file_states if filename in existing),
+        'removed': len(removed_docs),
+        'errors': error_count,
+    }
+    if not file_states and not removed_docs:
+        return stats
+
+    written = []
+    if file_states:
+        descriptions, categories = load_hazard_descriptions()
+        ingest_stats, written = ingest_files(
+            db, image_folder, file_states, descriptions, categories, manifest,
+            workers=workers, batch_size=batch_size,
+        )
+        stats['errors'] += ingest_stats['errors']
+
+    removed_ids = [doc['_id'] for doc in removed_docs]
+    if removed_ids:
+        db.cases.delete_many({'_id': {'$in': removed_ids}})
+        for doc in removed_docs:
+            manifest.pop(doc['filename'], None)
+        save_manifest(manifest)
+
+    if case_index is not None:
+        upserted = list(db.cases.find({'filename': {'$in': written}}, CaseIndex.PROJECTION)) if written else []
+        case_index.apply_changes(upserted, removed_ids)
+        # 写回索引文件，重启后或其他进程加载时不会恢复已删除/已修改的案例
+        if len(case_index) > 0:
+            case_index.save()
+    else:
+        build_retrieval_index(db)
+
+    print(f"🔄 数据集同步完成: 新增 {stats['added']}, 更新 {stats['changed']}, "
+          f"删除 {stats['removed']}, 错误 {stats['errors']}")
+    return stats
+
+def build_retrieval_index(db, backend_name=None):
+    """根据 cases 集合构建检索索引并写入磁盘"""
+    try:
+        backend_name = backend_name or Config.RETRIEVAL_BACKEND
+        print(f"🔄 正在构建检索索引 (后端: {backend_name})...")
+        case_index = CaseIndex(db, backend_name=backend_name)
+        # 始终根据当前快照重建，不复用可能过期的索引文件
+        case_index.load(rebuild=True)
+        if len(case_index) == 0:
+            print("⚠️  没有可索引的案例，跳过索引构建")
+            return None
+        return case_index.save()
+    except Exception as e:
+        print(f"❌ 构建检索索引失败: {e}")
+        return None
+
+def migrate_features(db=None, dtype=None, batch_size=500):
+    """将 cases 集合中旧的列表格式特征转换为二进制格式（也可用于切换存储精度）"""
+    if db is None:
+        db = init_database()
+        if db is None:
+            return 0
+    dtype = dtype or Config.FEATURE_STORAGE_DTYPE
+    target_format = DTYPE_TO_FORMAT[dtype]
+    query = {
+        'features': {'$exists': True},
+        'features_format': {'$ne': target_format},
+    }
+    total = db.cases.count_documents(query)
+    print(f"🔄 需要迁移特征格式的文档: {total} 个 (目标格式: {target_format})")
+
+    migrated = 0
+    operations = []
+    cursor = db.cases.find(query, {'features': 1, 'features_format': 1, 'features_dim': 1})
+    for doc in cursor:
+        try:
+            vector = decode_features(doc)
+        except ValueError as e:
+            print(f"⚠️  文档 {doc['_id']} 特征解码失败，已跳过: {e}")
+            continue
+        operations.append(UpdateOne(
+            {'_id': doc['_id']},
+            {'$set': {**encode_features(vector, dtype), 'updated_at': datetime.now()}},
+        ))
+        if len(operations) >= batch_size:
+            migrated += db.cases.bulk_write(operations, ordered=False).modified_count
+            operations = []
+            print(f"🔄 迁移进度: {migrated}/{total}")
+    if operations:
+        migrated += db.cases.bulk_write(operations, ordered=False).modified_count
+
+    print(f"✅ 特征格式迁移完成: {migrated} 个文档")
+    return migrated
+
+def rescore_analysis_cache(db=None, batch_size=None):
+    """用当前的 BERT / TF-IDF 模型批量重新计算 analysis_cache 中所有结果的相似度"""
+    if db is None:
+        db = init_database()
+        if db is None:
+            return 0
+    batch_size = batch_size or Config.SIMILARITY_RESCORE_BATCH_SIZE
+    registry = get_model_registry()
+    bert_similarity = registry.get_bert_similarity()
+    tfidf_similarity = registry.get_tfidf_similarity()
+
+    cursor = db.analysis_cache.find(
+        {'result.type': {'$exists': True}},
+        {'result.type': 1, 'result.description': 1},
+        batch_size=batch_size,
+    )
+    total = 0
+    skipped = 0
+    batch = []
+
+    def flush(docs):
+        nonlocal skipped
+        pairs = [
+            ((doc['result'].get('description') or ''), str(doc['result'].get('type')))
+            for doc in docs
+        ]
+        try:
+            bert_scores = bert_similarity.calculate_similarities(pairs)
+            tfidf_scores = tfidf_similarity.calculate_similarities(pairs)
+        except Exception as e:
+            # 计算失败时保留原有分数，不写入 0
+            skipped += len(docs)
+            print(f"❌ 本批相似度计算失败，跳过 {len(docs)} 条: {e}")
+            return 0
+        operations = [
+            UpdateOne({'_id': doc['_id']}, {'$set': {
+                'result.bert_similarity': bert_score,
+                'result.standard_description': standard_desc,
+                'result.tfidf_similarity': tfidf_score,
+            }})
+            for doc, (bert_score, standard_desc), (tfidf_score, _) in zip(docs, bert_scores, tfidf_scores)
+        ]
+        db.analysis_cache.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            total += flush(batch)
+            batch = []
+            print(f"🔄 已重新计算 {total} 条分析结果的相似度")
+    if batch:
+        total += flush(batch)
+
+    print(f"✅ 相似度重新计算完成: {total} 条分析结果")
+    if skipped:
+        print(f"⚠️  {skipped} 条分析结果因计算失败未更新")
+    # 相似度变化后重建增量统计
+    SimilarityStats(db).rebuild()
+    return total
+
 def generate_suggestion(hazard_type, category_desc):
     """根据隐患类型生成整改建议"""
     suggestions = {
@@ -282,12 +615,42 @@ def backup_database():
         print(f"❌ 备份失败: {e}")
 
 if __name__ == "__main__":
-    print("🚀 开始初始化MongoDB数据库...")
-    
-    # 可选：清理现有数据
-    # cleanup_database()
-    
-    # 初始化并加载数据
-    load_dataset()
-    
-    print("🎉 数据库初始化完成！")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="隐患案例数据库初始化工具")
+    parser.add_argument(
+        'command', nargs='?', default='load',
+        choices=['load', 'sync', 'migrate-features', 'build-index', 'rescore', 'rebuild-stats'],
+        help="load: 加载数据集（默认）; sync: 增量同步数据集目录; "
+             "migrate-features: 转换特征存储格式; build-index: 构建检索索引文件; "
+             "rescore: 重新计算分析结果的相似度; rebuild-stats: 重建相似度统计",
+    )
+    parser.add_argument('--dtype', choices=sorted(DTYPE_TO_FORMAT), help="特征存储精度（migrate-features）")
+    parser.add_argument('--backend', help="检索后端名称（build-index）")
+    parser.add_argument('--force', action='store_true', help="忽略导入清单，重新导入所有图片（load）")
+    parser.add_argument('--workers', type=int, help="并行解码线程数（load/sync）")
+    parser.add_argument('--batch-size', type=int, help="每批处理的条目数（load/sync/rescore）")
+    args = parser.parse_args()
+
+    if args.command == 'migrate-features':
+        migrate_features(dtype=args.dtype)
+    elif args.command == 'sync':
+        sync_dataset(workers=args.workers, batch_size=args.batch_size)
+    elif args.command == 'rescore':
+        rescore_analysis_cache(batch_size=args.batch_size)
+    elif args.command == 'rebuild-stats':
+        db = init_database()
+        if db is not None:
+            SimilarityStats(db).rebuild()
+    elif args.command == 'build-index':
+        db = init_database()
+        if db is not None:
+            build_retrieval_index(db, backend_name=args.backend)
+    else:
+        print("🚀 开始初始化MongoDB数据库...")
+        
+        # 可选：清理现有数据
+        # cleanup_database()
+        
+        # 初始化并加载数据
+        load_dataset(force=args.force, workers=args.workers, batch_size=args.batch_size)
+        
+        print("🎉 数据库初始化完成！")
\ No newline at end of file
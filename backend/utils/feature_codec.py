@@ -0,0 +1,43 @@
+import numpy as np
+from typing import Dict, Optional
+from bson.binary import Binary
+from config import Config
+
+# 特征存储格式：格式标签 -> 小端序 numpy 数据类型
+FEATURE_FORMATS = {
+    'f32v1': np.dtype('<f4'),
+    'f16v1': np.dtype('<f2'),
+}
+DTYPE_TO_FORMAT = {
+    'float32': 'f32v1',
+    'float16': 'f16v1',
+}
+
+
+def encode_features(features, dtype: Optional[str] = None) -> Dict:
+    """将特征向量编码为 BSON Binary，返回可直接写入文档的字段"""
+    feature_format = DTYPE_TO_FORMAT[dtype or Config.FEATURE_STORAGE_DTYPE]
+    vector = np.asarray(features, dtype=np.float32).reshape(-1)
+    return {
+        'features': Binary(vector.astype(FEATURE_FORMATS[feature_format]).tobytes()),
+        'features_format': feature_format,
+        'features_dim': int(vector.shape[0]),
+    }
+
+
+def decode_features(doc: Dict) -> Optional[np.ndarray]:
+    """从案例文档解码特征，返回一维 float32 向量；兼容旧的嵌套列表格式"""
+    features = doc.get('features')
+    if features is None:
+        return None
+    feature_format = doc.get('features_format')
+    if feature_format is None:
+        # 旧格式：features.tolist() 得到的（嵌套）浮点数列表
+        return np.asarray(features, dtype=np.float32).reshape(-1)
+    if feature_format not in FEATURE_FORMATS:
+        raise ValueError(f"未知的特征格式: {feature_format}")
+    vector = np.frombuffer(bytes(features), dtype=FEATURE_FORMATS[feature_format])
+    dim = doc.get('features_dim')
+    if dim is not None and vector.shape[0] != dim:
+        raise ValueError(f"特征维度不一致: 期望 {dim}, 实际 {vector.shape[0]}")
+    return vector.astype(np.float32)
@@ -1,23 +1,39 @@
 import os
 from PIL import Image
 import torch
-import clip
 import base64
 import io
 from config import Config
+from utils.lru_cache import TTLCache
 
 class ImageProcessor:
-    def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model, self.preprocess = clip.load(Config.CLIP_MODEL_NAME, device=self.device)
+    # 发送给 LLM 前去掉的 JPEG 段：APP1（EXIF/GPS/XMP）、APP13（IPTC）、COM
+    METADATA_MARKERS = (0xE1, 0xED, 0xFE)
+
+    def __init__(self, model=None, preprocess=None, device=None):
+        # 与 CLIPService 共享模型注册表中的 CLIP 权重，避免重复加载
+        if model is None:
+            from services.model_registry import get_model_registry
+            model, preprocess, device = get_model_registry().get_clip_model()
+        self.model, self.preprocess = model, preprocess
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        # (内容哈希, provider) -> 发送给 LLM 的 base64 图片
+        self.payload_cache = TTLCache(Config.LLM_PAYLOAD_CACHE_SIZE, ttl=Config.LLM_PAYLOAD_CACHE_TTL)
     
+    @staticmethod
+    def _open_source(image_source):
+        """图片来源可以是文件路径、图片字节或文件对象"""
+        if isinstance(image_source, (bytes, bytearray)):
+            return io.BytesIO(image_source)
+        return image_source
+
     def process_image(self, image_path):
         """
-        处理图片，返回PIL Image对象
+        处理图片，返回PIL Image对象（image_path 也可以是内存中的图片字节）
         """
         try:
             # 打开图片
-            image = Image.open(image_path)
+            image = Image.open(self._open_source(image_path))
             
             # 转换为RGB格式（处理RGBA等格式）
             if image.mode != 'RGB':
@@ -45,6 +61,105 @@ class ImageProcessor:
         except Exception as e:
             raise Exception(f"图片转base64失败: {str(e)}")
     
+    @staticmethod
+    def _payload_profile(provider):
+        profiles = Config.LLM_IMAGE_PROFILES
+        return profiles.get(provider, profiles['default'])
+
+    @staticmethod
+    def _encode_jpeg(image, max_side, quality, max_bytes):
+        """缩放并编码为 JPEG，超过字节预算时依次降低质量、缩小尺寸"""
+        image = image.copy()
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        while True:
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            data = buffer.getvalue()
+            if len(data) <= max_bytes or max(image.size) <= 256:
+                return data
+            if quality > 60:
+                quality -= 10
+            else:
+                image.thumbnail((int(max(image.size) * 0.75),) * 2, Image.Resampling.LANCZOS)
+
+    @staticmethod
+    def _strip_jpeg_metadata(data):
+        """去掉 JPEG 中可能含隐私信息的 APP1（EXIF/GPS/XMP）、APP13（IPTC）段和注释段
+
+        其余段原样保留，包括 APP2 的 ICC 色彩配置和 APP14 的 Adobe 色彩变换标记，
+        去掉它们会让广色域或 CMYK/YCCK 图片解码出错误的颜色。结构异常时抛出 ValueError。
+        """
+        if data[:2] != b'\xff\xd8':
+            raise ValueError("不是 JPEG 数据")
+        parts, pos = [data[:2]], 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                raise ValueError("JPEG 段结构无效")
+            marker = data[pos + 1]
+            if marker == 0xFF:
+                # 段之间的填充字节
+                pos += 1
+                continue
+            if marker == 0xDA:
+                # SOS 之后是熵编码数据，原样保留
+                parts.append(data[pos:])
+                return b''.join(parts)
+            if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+                parts.append(data[pos:pos + 2])
+                pos += 2
+                continue
+            length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+            if marker not in ImageProcessor.METADATA_MARKERS:
+                parts.append(data[pos:pos + 2 + length])
+            pos += 2 + length
+        raise ValueError("JPEG 缺少图像数据")
+
+    def prepare_llm_payload(self, image_source, provider, image_hash=None, processed_image=None):
+        """按 provider 的尺寸、质量和字节预算生成发送给 LLM 的 base64 JPEG
+
+        已经是尺寸和大小都合适的 JPEG 时只去掉 EXIF/GPS 等元数据，不重新编码
+        （需要按 EXIF 方向旋转的图片仍重新编码，与原先的处理一致）；
+        传入 image_hash 时按 (内容哈希, provider) 缓存结果。
+        读取原图失败时退回编码已处理的 processed_image。
+        """
+        cache_key = (image_hash, provider) if image_hash else None
+        if cache_key:
+            cached = self.payload_cache.get(cache_key, None)
+            if cached is not None:
+                return cached
+
+        profile = self._payload_profile(provider)
+        max_side, quality, max_bytes = profile['max_side'], profile['quality'], profile['max_bytes']
+        try:
+            if isinstance(image_source, (bytes, bytearray)):
+                raw = bytes(image_source)
+            else:
+                with open(image_source, 'rb') as f:
+                    raw = f.read()
+            with Image.open(io.BytesIO(raw)) as image:
+                data = None
+                if (image.format == 'JPEG' and image.mode == 'RGB' and max(image.size) <= max_side
+                        and len(raw) <= max_bytes and image.getexif().get(0x0112, 1) == 1):
+                    try:
+                        # 元数据不发送给第三方 LLM
+                        data = self._strip_jpeg_metadata(raw)
+                    except ValueError:
+                        data = None
+                if data is None:
+                    # JPEG 按目标尺寸在解码阶段降采样，12MP 原图无需完整解码
+                    image.draft('RGB', (max_side, max_side))
+                    data = self._encode_jpeg(image.convert('RGB'), max_side, quality, max_bytes)
+        except Exception as e:
+            if processed_image is None:
+                raise Exception(f"生成LLM图片失败: {str(e)}")
+            data = self._encode_jpeg(processed_image, max_side, quality, max_bytes)
+
+        payload = base64.b64encode(data).decode()
+        if cache_key:
+            self.payload_cache.set(cache_key, payload)
+        return payload
+
     def base64_to_image(self, base64_str):
         """
         将base64字符串转换为PIL Image
@@ -69,7 +184,7 @@ class ImageProcessor:
         验证图片文件是否有效
         """
         try:
-            with Image.open(image_path) as img:
+            with Image.open(self._open_source(image_path)) as img:
                 img.verify()
             return True
         except Exception:
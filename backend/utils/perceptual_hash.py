@@ -0,0 +1,78 @@
+import io
+from typing import Any, List, Tuple
+from PIL import Image
+
+HASH_SIZE = 8  # 64 位 dHash
+
+
+def dhash(image: Image.Image, hash_size: int = HASH_SIZE) -> int:
+    """计算差异哈希（dHash）：缩放为 (hash_size+1) x hash_size 灰度图后比较相邻像素"""
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def image_dhash(image_source, hash_size: int = HASH_SIZE) -> str:
+    """从图片路径或字节计算 dHash，返回十六进制字符串（便于存入 MongoDB）"""
+    if isinstance(image_source, (bytes, bytearray)):
+        image_source = io.BytesIO(image_source)
+    with Image.open(image_source) as image:
+        # JPEG 可直接按低分辨率解码，大幅减少解码开销
+        image.draft('L', (hash_size * 8, hash_size * 8))
+        value = dhash(image, hash_size)
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树，用于查找阈值内的近似哈希"""
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, hash_value: int, item: Any):
+        node = [hash_value, [item], {}]
+        self._size += 1
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming_distance(hash_value, current[0])
+            if distance == 0:
+                current[1].append(item)
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, hash_value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """返回距离不超过 max_distance 的 (距离, 条目)，按距离升序"""
+        if self._root is None:
+            return []
+        results = []
+        stack = [self._root]
+        while stack:
+            node_hash, items, children = stack.pop()
+            distance = hamming_distance(hash_value, node_hash)
+            if distance <= max_distance:
+                results.extend((distance, item) for item in items)
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda pair: pair[0])
+        return results
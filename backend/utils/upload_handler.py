@@ -0,0 +1,55 @@
+import os
+import uuid
+from typing import Optional
+from config import Config
+from utils.content_hash import compute_content_hash
+
+
+class UploadedImage:
+    """已读入内存的上传图片，content_hash 为图片字节的 MD5"""
+
+    def __init__(self, data: bytes, content_hash: str, filename: str):
+        self.data = data
+        self.content_hash = content_hash
+        self.filename = filename
+
+    @property
+    def ext(self) -> str:
+        return os.path.splitext(self.filename)[1].lower()
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+def read_upload(file_storage, chunk_size: int = 64 * 1024) -> UploadedImage:
+    """分块读取上传流（超过大小限制立即停止）并计算内容哈希，图片只保存在内存中"""
+    chunks = []
+    size = 0
+    while True:
+        chunk = file_storage.stream.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > Config.MAX_CONTENT_LENGTH:
+            raise ValueError(f"图片文件过大，超过{Config.MAX_CONTENT_LENGTH / 1024 / 1024:.1f}MB限制")
+        chunks.append(chunk)
+    data = b''.join(chunks)
+    return UploadedImage(data, compute_content_hash(data), file_storage.filename or '')
+
+
+def persist_upload(upload: UploadedImage, directory: str, name: Optional[str] = None) -> str:
+    """写入磁盘并返回文件路径
+
+    默认按内容哈希命名（相同内容只写一次）；传入 name 时使用该文件名（不含扩展名）。
+    """
+    os.makedirs(directory, exist_ok=True)
+    image_path = os.path.join(directory, f"{name or upload.content_hash}{upload.ext}")
+    if os.path.exists(image_path):
+        return image_path
+    # 先写临时文件再原子替换，避免并发请求读到写了一半的文件
+    tmp_path = f"{image_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(upload.data)
+    os.replace(tmp_path, image_path)
+    return image_path